@@ -9,9 +9,46 @@ import base64
 import shutil
 import hashlib
 import logging
+import sys
+import argparse
+import threading
+import sqlite3
+import asyncio
+import csv
+import codecs
+import io
+import bisect
+import heapq
+import operator
+import zlib
+import struct
+import tempfile
+import unicodedata
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain
+from array import array
+from collections import OrderedDict, namedtuple
 from typing import Dict
+from urllib.parse import urlsplit, urlencode
 from tqdm import tqdm
 
+try:
+    import httpx
+except ImportError:
+    httpx = None  # 未安装时批量查询改用线程池执行同步请求
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None  # 未安装时不能导出Parquet格式的弹幕
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # 未安装时直播信息流使用zlib压缩
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -23,6 +60,178 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 网络配置，可在config.json的network段中覆盖
+NETWORK_CONFIG = {
+    'timeout': 30,         # 单次请求超时（秒）
+    'max_retries': 3,      # 遇到412/-352/5xx时的最大重试次数
+    'pool_size': 16,       # 每个主机保持的最大连接数
+    'backoff_base': 1.0,   # 退避基数（秒），第n次重试等待 base * 2^(n-1) 加随机抖动
+    'backoff_max': 30.0,   # 单次退避的最长等待（秒）
+    'rate_limit': 5.0,     # 每个主机读请求的初始速率（次/秒），风控时自动降低、持续成功后回升
+    'write_rate_limit': 0.5,  # 点赞/投币/举报等写请求的初始速率（次/秒）
+}
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def load_network_config(config_file: str = 'config.json') -> Dict:
+    """读取config.json中的network配置，缺省项使用默认值"""
+    config = dict(NETWORK_CONFIG)
+    if os.path.exists(config_file):
+        try:
+            with open(config_file, 'r', encoding='utf-8') as f:
+                network = json.load(f).get('network', {})
+            config.update({k: v for k, v in network.items() if k in NETWORK_CONFIG})
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取网络配置失败，使用默认值: {str(e)}")
+    return config
+
+def get_http_session() -> requests.Session:
+    """获取全进程共用的HTTP会话，复用TCP/TLS连接"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            NETWORK_CONFIG.update(load_network_config())
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=NETWORK_CONFIG['pool_size'],
+                pool_maxsize=NETWORK_CONFIG['pool_size']
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+        return _http_session
+
+class TokenBucket:
+    """自适应令牌桶限速器
+    
+    按rate（个/秒）生成令牌，最多积攒burst个。遇到风控时速率减半，
+    连续成功increase_after次后速率增加初始速率的十分之一，直到max_rate。
+    线程安全；异步代码可用reserve()取得需要等待的秒数后自行await。
+    """
+    
+    def __init__(self, rate: float, burst: float = 1, min_rate: float = 0.1, max_rate: float = None,
+                 increase_after: int = 20):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 4
+        self.increase_step = rate / 10
+        self.increase_after = increase_after
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._successes = 0
+        self._lock = threading.Lock()
+    
+    def reserve(self) -> float:
+        """取一个令牌，返回拿到令牌前需要等待的秒数（令牌不足时预支）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+    
+    def acquire(self) -> None:
+        """阻塞直到拿到令牌"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+    
+    def on_success(self) -> None:
+        """请求成功，连续成功足够次数后提高速率"""
+        with self._lock:
+            self._successes += 1
+            if self._successes >= self.increase_after and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.increase_step)
+                self._successes = 0
+    
+    def on_throttle(self) -> None:
+        """触发风控，速率减半并清空积攒的令牌"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0)
+            self._successes = 0
+            logger.warning(f"触发风控，请求速率降至 {self.rate:.2f} 次/秒")
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(url: str, method: str = 'GET') -> TokenBucket:
+    """获取某个主机的限速器，读请求和写请求（点赞/投币/举报等）分开限速"""
+    host = urlsplit(url).netloc
+    key = (host, method.upper() == 'GET')
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            rate = NETWORK_CONFIG['rate_limit'] if key[1] else NETWORK_CONFIG['write_rate_limit']
+            _rate_limiters[key] = TokenBucket(rate, burst=max(1, rate), max_rate=rate * 4)
+        return _rate_limiters[key]
+
+def _is_risk_control(response, stream: bool = False) -> bool:
+    """412和code=-352是B站风控拦截，请求未被处理
+    
+    stream=True的响应（直播流、文件下载）只看状态码：读取response.content会把整个响应体读入内存，
+    对不会结束的直播流来说永远不会返回。
+    """
+    if response.status_code == 412:
+        return True
+    # 风控时HTTP状态码可能仍为200，只在JSON中返回code=-352
+    return not stream and b'"code":-352' in response.content[:64]
+
+def _should_retry(response, method: str, stream: bool = False) -> bool:
+    """判断响应是否需要退避重试：风控拦截总是重试，5xx只对GET重试"""
+    if _is_risk_control(response, stream):
+        return True
+    return response.status_code >= 500 and method == 'GET'
+
+def http_request(method: str, url: str, **kwargs) -> requests.Response:
+    """通过共享会话发送请求，遇到风控或服务器错误时按指数退避加抖动重试
+    
+    Args:
+        method (str): 请求方法
+        url (str): 请求地址
+        **kwargs: 传给requests的其他参数，未指定timeout时使用配置中的超时
+        
+    Returns:
+        requests.Response: 最后一次请求的响应
+    """
+    session = get_http_session()
+    kwargs.setdefault('timeout', NETWORK_CONFIG['timeout'])
+    stream = kwargs.get('stream', False)
+    method = method.upper()
+    max_retries = NETWORK_CONFIG['max_retries']
+    
+    limiter = get_rate_limiter(url, method)
+    
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            # 连接失败时POST可能尚未送达，但无法确认，只重试GET
+            if method != 'GET' or attempt >= max_retries:
+                raise
+        else:
+            if _is_risk_control(response, stream):
+                limiter.on_throttle()
+            else:
+                limiter.on_success()
+            if attempt >= max_retries or not _should_retry(response, method, stream):
+                return response
+            response.close()
+            logger.warning(f"请求被限制或服务器错误（HTTP {response.status_code}），准备重试: {url}")
+        
+        delay = min(NETWORK_CONFIG['backoff_max'], NETWORK_CONFIG['backoff_base'] * 2 ** attempt)
+        time.sleep(delay / 2 + random.uniform(0, delay / 2))
+
+def http_get(url: str, **kwargs) -> requests.Response:
+    """GET请求，见http_request"""
+    return http_request('GET', url, **kwargs)
+
+def http_post(url: str, **kwargs) -> requests.Response:
+    """POST请求，见http_request"""
+    return http_request('POST', url, **kwargs)
+
 def convert_browser_cookies(browser_cookies: list) -> Dict:
     """转换浏览器导出的cookies格式为简单的键值对"""
     cookies = {}
@@ -196,80 +405,224 @@ def find_ffmpeg() -> str:
     print("警告：未找到ffmpeg，请确保ffmpeg已正确安装添加到系统PATH中")
     return ''
 
-def convert_to_mp3(input_file: str) -> bool:
-    """将音频文件转换为MP3格式"""
+# 已知的音频时长（秒），下载时从视频信息中记录，转码时免去探测
+_known_durations = {}
+
+def remember_duration(filepath: str, duration: float) -> None:
+    """记录从视频信息中得到的音频时长"""
+    if filepath and duration:
+        _known_durations[os.path.abspath(filepath)] = float(duration)
+
+def find_ffprobe(ffmpeg: str = 'ffmpeg') -> str:
+    """根据ffmpeg路径推断ffprobe路径，二者通常安装在同一目录"""
+    directory, name = os.path.split(ffmpeg)
+    candidate = os.path.join(directory, name.replace('ffmpeg', 'ffprobe'))
+    if directory and os.path.isfile(candidate):
+        return candidate
+    return shutil.which('ffprobe') or ''
+
+def parse_ffmpeg_time(time_str: str) -> float:
+    """解析ffmpeg输出的时间（HH:MM:SS.mmm），无法解析时返回0"""
+    try:
+        hours, minutes, seconds = time_str.strip().split(':')
+        return float(hours) * 3600 + float(minutes) * 60 + float(seconds)
+    except ValueError:
+        return 0.0
+
+def probe_audio_duration(input_file: str, ffmpeg: str = 'ffmpeg') -> float:
+    """读取音频时长（秒），只读容器元数据，不解码音频
+    
+    依次尝试：下载时记录的时长、ffprobe的format=duration、ffmpeg -i输出的文件头信息。
+    
+    Returns:
+        float: 时长（秒），无法获取时返回0
+    """
+    known = _known_durations.get(os.path.abspath(input_file))
+    if known:
+        return known
+    
+    ffprobe = find_ffprobe(ffmpeg)
+    if ffprobe:
+        try:
+            result = subprocess.run(
+                [ffprobe, '-v', 'error', '-show_entries', 'format=duration',
+                 '-of', 'default=noprint_wrappers=1:nokey=1', input_file],
+                capture_output=True, text=True, timeout=30
+            )
+            return float(result.stdout.strip())
+        except (subprocess.TimeoutExpired, OSError, ValueError):
+            pass
+    
+    # 没有ffprobe时，ffmpeg不指定输出文件只会打印文件头信息后退出
+    try:
+        result = subprocess.run([ffmpeg, '-hide_banner', '-i', input_file],
+                                capture_output=True, text=True, timeout=30,
+                                encoding='utf-8', errors='replace')
+        match = re.search(r'Duration: (\d+:\d{2}:\d{2}(?:\.\d+)?)', result.stderr)
+        if match:
+            return parse_ffmpeg_time(match.group(1))
+    except (subprocess.TimeoutExpired, OSError):
+        pass
+    return 0.0
+
+def run_ffmpeg_with_progress(cmd: list, duration: float, desc: str = "转换进度") -> tuple:
+    """运行带 -progress pipe:1 参数的ffmpeg命令并显示进度条
+    
+    Args:
+        cmd (list): ffmpeg命令
+        duration (float): 音频总时长（秒），为0时只显示已处理的秒数
+        desc (str): 进度条标题
+        
+    Returns:
+        tuple: (返回码, 错误输出)
+    """
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        encoding='utf-8',
+        errors='replace'
+    )
+    # 单独读取stderr，避免管道写满后ffmpeg阻塞
+    stderr_lines = []
+    stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+    stderr_thread.start()
+    
+    if duration > 0:
+        pbar = tqdm(total=100, desc=desc, ncols=80,
+                    bar_format='{desc}: {percentage:3.1f}%|{bar}| [{elapsed}<{remaining}]')
+    else:
+        pbar = tqdm(desc=desc, unit='s', ncols=80,
+                    bar_format='{desc}: 已处理 {n:.0f} 秒 [{elapsed}]')
+    
+    with pbar:
+        last_value = 0
+        for line in process.stdout:
+            if not line.startswith('out_time='):
+                continue
+            current_time = parse_ffmpeg_time(line.split('=', 1)[1])
+            if duration > 0:
+                value = min(100, int(current_time / duration * 100))
+            else:
+                value = int(current_time)
+            if value > last_value:
+                pbar.update(value - last_value)
+                last_value = value
+        process.wait()
+        if process.returncode == 0 and duration > 0 and last_value < 100:
+            pbar.update(100 - last_value)
+    
+    stderr_thread.join()
+    return process.returncode, ''.join(stderr_lines)
+
+# 输出格式：mp3重新编码，其余均为不重新编码的封装转换
+OUTPUT_FORMATS = ['mp3', 'm4a', 'aac', 'flac', 'copy']
+
+def probe_audio_codec(input_file: str, ffmpeg: str = 'ffmpeg') -> str:
+    """读取第一条音轨的编码名称（如aac、flac、eac3），无法获取时返回空字符串"""
+    ffprobe = find_ffprobe(ffmpeg)
+    if ffprobe:
+        try:
+            result = subprocess.run(
+                [ffprobe, '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=codec_name',
+                 '-of', 'default=noprint_wrappers=1:nokey=1', input_file],
+                capture_output=True, text=True, timeout=30
+            )
+            if result.stdout.strip():
+                return result.stdout.strip().splitlines()[0]
+        except (subprocess.TimeoutExpired, OSError):
+            pass
+    try:
+        result = subprocess.run([ffmpeg, '-hide_banner', '-i', input_file],
+                                capture_output=True, text=True, timeout=30,
+                                encoding='utf-8', errors='replace')
+        match = re.search(r'Audio: (\w+)', result.stderr)
+        if match:
+            return match.group(1)
+    except (subprocess.TimeoutExpired, OSError):
+        pass
+    return ''
+
+def build_audio_convert_command(input_file: str, output_format: str = 'mp3', ffmpeg: str = 'ffmpeg',
+                                threads: int = 4) -> tuple:
+    """生成音频格式转换的ffmpeg命令
+    
+    Args:
+        input_file (str): 输入文件
+        output_format (str): mp3为libmp3lame重新编码；m4a/aac/flac为 -c:a copy 直接封装；
+            copy根据原始编码自动选择容器（flac音轨存为.flac，其余存为.m4a）
+        ffmpeg (str): ffmpeg路径
+        threads (int): 编码线程数，仅mp3有效
+        
+    Returns:
+        tuple: (ffmpeg参数列表（不含输出文件）, 输出文件路径)
+        
+    Raises:
+        ValueError: 原始编码无法不经重新编码存入目标格式
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    
+    cmd = [ffmpeg, '-i', input_file, '-vn']
+    if output_format == 'mp3':
+        cmd += ['-acodec', 'libmp3lame', '-q:a', '0', '-threads', str(threads)]
+        extension = '.mp3'
+    else:
+        codec = probe_audio_codec(input_file, ffmpeg)
+        if output_format == 'copy':
+            output_format = 'flac' if codec == 'flac' else 'm4a'
+        if output_format == 'aac' and codec and codec != 'aac':
+            raise ValueError(f"音轨编码为{codec}，无法直接保存为aac，请使用m4a或mp3")
+        if output_format == 'flac' and codec and codec != 'flac':
+            raise ValueError(f"音轨编码为{codec}，不是无损音轨，请使用m4a或mp3")
+        cmd += ['-c:a', 'copy']
+        if output_format == 'm4a':
+            cmd += ['-movflags', '+faststart']
+        elif output_format == 'aac':
+            cmd += ['-f', 'adts']
+        extension = '.' + output_format
+    
+    return cmd, os.path.splitext(input_file)[0] + extension
+
+def convert_to_mp3(input_file: str, duration: float = None, output_format: str = 'mp3') -> bool:
+    """将音频文件转换为MP3格式，或不重新编码地封装为m4a/aac/flac
+    
+    Args:
+        input_file (str): 输入文件
+        duration (float): 已知的音频时长（秒），不传则从文件元数据读取
+        output_format (str): 输出格式，见build_audio_convert_command
+    """
     if not os.path.exists(input_file):
         print(f"错误：找不到文件 {input_file}")
         return False
     
-    output_file = os.path.splitext(input_file)[0] + '.mp3'
-    
     try:
         # 构建ffmpeg命令
-        cmd = [
-            'ffmpeg',
-            '-i', input_file,
-            '-acodec', 'libmp3lame',
-            '-q:a', '0',  # 最高质量
-            '-threads', '4',  # 使用4个线程
+        cmd, output_file = build_audio_convert_command(input_file, output_format)
+        # 输出与输入同名（如m4a重新封装）时先写临时文件，完成后替换原文件
+        same_file = os.path.abspath(output_file) == os.path.abspath(input_file)
+        target_file = output_file + '.tmp' + os.path.splitext(output_file)[1] if same_file else output_file
+        cmd += [
             '-progress', 'pipe:1',  # 输出进度信息到stdout
             '-nostats',  # 不输出额外统计信息
-            output_file
+            target_file
         ]
         
-        print(f"正在转换为MP3: {os.path.basename(input_file)}")
-        
-        # 创建进度条
-        with tqdm(total=100, 
-                 desc="转换进度", 
-                 ncols=80,
-                 bar_format='{desc}: {percentage:3.1f}%|{bar}| [{elapsed}<{remaining}]') as pbar:
-            
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
-            )
-            
-            # 读取并更新进度
-            last_percent = 0
-            while True:
-                line = process.stdout.readline()
-                if not line and process.poll() is not None:
-                    break
-                    
-                # 从输出中提取时间信息
-                if line.startswith('out_time='):
-                    time_str = line.split('=')[1].strip()
-                    try:
-                        # 解析时间格式 HH:MM:SS.mmm
-                        time_parts = time_str.split(':')
-                        if len(time_parts) == 3:
-                            hours = float(time_parts[0])
-                            minutes = float(time_parts[1])
-                            seconds = float(time_parts[2])
-                            current_time = hours * 3600 + minutes * 60 + seconds
-                            
-                            # 这里需要知道总时长才能计算准确进度
-                            # 暂时使用一个估算值，实际应该先获取文件时长
-                            estimated_duration = 180  # 假设3分钟，实际应该动态获取
-                            percent = min(100, max(0, int((current_time / estimated_duration) * 100)))
-                            
-                            # 更新进度条
-                            if percent > last_percent:
-                                pbar.update(percent - last_percent)
-                                last_percent = percent
-                    except:
-                        pass
-            
-            # 确保进度条到达100%
-            if last_percent < 100:
-                pbar.update(100 - last_percent)
+        if output_format == 'mp3':
+            print(f"正在转换为MP3: {os.path.basename(input_file)}")
+        else:
+            print(f"正在封装为{os.path.splitext(output_file)[1][1:]}（不重新编码）: {os.path.basename(input_file)}")
+        if not duration:
+            duration = probe_audio_duration(input_file)
+        returncode, error = run_ffmpeg_with_progress(cmd, duration)
         
         # 检查转换结果
-        if process.returncode == 0:
+        if returncode == 0:
             print(f"\n转换完成：{os.path.basename(output_file)}")
+            if same_file:
+                os.replace(target_file, output_file)
+                return True
             # 询问是否删除原始文件
             choice = input("是否删除原始音频文件？(y/n) [y]: ").lower()
             if not choice or choice == 'y':  # 直接回车或输入y都删除
@@ -277,7 +630,8 @@ def convert_to_mp3(input_file: str) -> bool:
                 print("原始文件已删除")
             return True
         else:
-            error = process.stderr.read()
+            if same_file and os.path.exists(target_file):
+                os.remove(target_file)
             print(f"转换失败！错误信息：\n{error}")
             return False
             
@@ -285,8 +639,45 @@ def convert_to_mp3(input_file: str) -> bool:
         print(f"转换过程中发生错误: {str(e)}")
         return False
 
-def download_audio(url_or_bvid: str, cookies: Dict):
-    """下载音频"""
+def transcode_audio(input_file: str, ffmpeg: str = 'ffmpeg', output_format: str = 'mp3',
+                    delete_source: bool = True) -> tuple:
+    """无交互地转换音频格式，供批量流水线的转码线程池调用
+    
+    每个ffmpeg进程只用单线程编码，并发度由转码线程池控制。
+    
+    Returns:
+        tuple: (是否成功, 输出文件路径, 错误信息)
+    """
+    if not os.path.exists(input_file):
+        return False, None, f"找不到文件 {input_file}"
+    
+    try:
+        cmd, output_file = build_audio_convert_command(input_file, output_format, ffmpeg, threads=1)
+    except ValueError as e:
+        return False, None, str(e)
+    same_file = os.path.abspath(output_file) == os.path.abspath(input_file)
+    target_file = output_file + '.tmp' + os.path.splitext(output_file)[1] if same_file else output_file
+    cmd[1:1] = ['-y', '-nostdin', '-loglevel', 'error']
+    cmd.append(target_file)
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace')
+    except Exception as e:
+        return False, None, str(e)
+    
+    if result.returncode != 0:
+        if os.path.exists(target_file):
+            os.remove(target_file)
+        error = result.stderr.strip().splitlines()
+        return False, None, error[-1] if error else f"ffmpeg退出码 {result.returncode}"
+    
+    if same_file:
+        os.replace(target_file, output_file)
+    elif delete_source:
+        os.remove(input_file)
+    return True, output_file, ''
+
+def download_audio(url_or_bvid: str, cookies: Dict, backend: str = 'auto'):
+    """下载音频，backend见download_audio_file"""
     save_cookies(cookies)
     
     headers = {
@@ -298,6 +689,11 @@ def download_audio(url_or_bvid: str, cookies: Dict):
         # 获取视频BV号并显示信息
         bvid = extract_bvid(url_or_bvid)
         if bvid:
+            # 单P视频已在下载存档中时，不需要再请求视频信息
+            archived = archive_lookup(bvid)
+            if archived and archived['page_count'] == 1:
+                print(f"该视频已下载过: {archived['file']}")
+                return
             pages = get_video_info(bvid, headers, show_info=False)  # 添加参数控制是否显示信息
             if len(pages) > 1:
                 choice = input("\n是否显示分P列表？(y/n) [n]: ").lower()
@@ -337,13 +733,13 @@ def download_audio(url_or_bvid: str, cookies: Dict):
                         page = pages[page_num - 1]
                         page_url = f"https://www.bilibili.com/video/{bvid}?p={page_num}"
                         print(f"\n开始下载P{page_num}: {page['part']}")
-                        download_single_audio(page_url, cookies)
+                        download_single_audio(page_url, cookies, backend)
                 else:
                     print("未选择有效的分P编号，将下载P1")
-                    download_single_audio(url_or_bvid, cookies)
+                    download_single_audio(url_or_bvid, cookies, backend)
             else:
                 # 单P视频直接下载
-                download_single_audio(url_or_bvid, cookies)
+                download_single_audio(url_or_bvid, cookies, backend)
         else:
             print("请输入有效的B站视频链接或BV号！")
     except Exception as e:
@@ -363,7 +759,7 @@ def get_user_info(cookies: Dict) -> None:
     try:
         # 获取用户导航信息
         nav_url = 'https://api.bilibili.com/x/web-interface/nav'
-        nav_resp = requests.get(nav_url, cookies=cookies, headers=headers)
+        nav_resp = http_get(nav_url, cookies=cookies, headers=headers)
         nav_data = nav_resp.json()
         
         if nav_data['code'] == 0:
@@ -403,7 +799,7 @@ def get_user_info(cookies: Dict) -> None:
             
             # 获取关注和粉丝数
             stat_url = f'https://api.bilibili.com/x/relation/stat?vmid={data["mid"]}'
-            stat_resp = requests.get(stat_url, headers=headers)
+            stat_resp = http_get(stat_url, headers=headers)
             stat_data = stat_resp.json()
             
             if stat_data['code'] == 0:
@@ -414,7 +810,7 @@ def get_user_info(cookies: Dict) -> None:
             
             # 获取今日投币经验
             coin_exp_url = 'https://api.bilibili.com/x/web-interface/coin/today/exp'
-            coin_exp_resp = requests.get(coin_exp_url, cookies=cookies, headers=headers)
+            coin_exp_resp = http_get(coin_exp_url, cookies=cookies, headers=headers)
             coin_exp_data = coin_exp_resp.json()
             
             if coin_exp_data['code'] == 0:
@@ -465,7 +861,7 @@ def batch_coin(cookies: Dict) -> None:
     try:
         # 先检查今日投币情况
         coin_exp_url = 'https://api.bilibili.com/x/web-interface/coin/today/exp'
-        coin_exp_resp = requests.get(coin_exp_url, cookies=cookies, headers=headers)
+        coin_exp_resp = http_get(coin_exp_url, cookies=cookies, headers=headers)
         coin_exp_data = coin_exp_resp.json()
         
         if coin_exp_data['code'] == 0:
@@ -493,9 +889,8 @@ def batch_coin(cookies: Dict) -> None:
                 return
             
             print(f"从文件中提取到 {len(bvids)} 个BV号:")
-            # 获取每个视频的信息
-            for bvid in bvids:
-                get_video_info(bvid, headers)
+            # 并发获取每个视频的信息
+            show_video_infos(bvids, cookies)
             
             # 询问是否继续投币
             choice = input("\n是否开始批量投币？(y/n) [y]: ").lower()
@@ -526,7 +921,7 @@ def batch_coin(cookies: Dict) -> None:
                         
                         try:
                             # 发送投币请求
-                            response = requests.post(coin_url, data=data, cookies=cookies, headers=headers)
+                            response = http_post(coin_url, data=data, cookies=cookies, headers=headers)
                             result = response.json()
                             
                             if result['code'] == 0:
@@ -538,9 +933,6 @@ def batch_coin(cookies: Dict) -> None:
                                 print("停止投币操作")
                                 break  # 投币失败就停止
                             
-                            # 添加延时，避免请求过快
-                            time.sleep(2)
-                            
                         except Exception as e:
                             print(f"\n投币过程出错: {str(e)}")
                             print("停止投币操作")
@@ -550,7 +942,7 @@ def batch_coin(cookies: Dict) -> None:
                 
                 # 获取当前硬币数
                 nav_url = 'https://api.bilibili.com/x/web-interface/nav'
-                nav_resp = requests.get(nav_url, cookies=cookies, headers=headers)
+                nav_resp = http_get(nav_url, cookies=cookies, headers=headers)
                 nav_data = nav_resp.json()
                 
                 if nav_data['code'] == 0:
@@ -633,10 +1025,6 @@ def extract_bvid(url_or_bvid: str) -> str:
 def get_video_bvids() -> None:
     """获取视频BV号并保存到文件"""
     bvids = []
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Referer': 'https://www.bilibili.com',
-    }
     
     print("请输入B站视频URL�����BV号，每行一���，输入q��束：")
     while True:
@@ -648,7 +1036,6 @@ def get_video_bvids() -> None:
         if input_text.startswith('BV'):
             bvid = input_text
             bvids.append(bvid)
-            get_video_info(bvid, headers)
             continue
             
         # 如果输入的是URL
@@ -659,43 +1046,281 @@ def get_video_bvids() -> None:
         bvid = extract_bvid(input_text)
         if bvid:
             bvids.append(bvid)
-            get_video_info(bvid, headers)
         else:
             print("无法从URL中提���BV号！")
     
+    # 输入完成后一次性并发获取全部视频信息
+    show_video_infos(bvids)
+    
     if bvids:
         with open('bvid.txt', 'w', encoding='utf-8') as f:
             f.write('\n'.join(bvids))
         print(f"已保存 {len(bvids)} 个BV号到 bvid.txt")
 
+# 视频元数据缓存：内存LRU + SQLite磁盘缓存，同一视频在有效期内只请求一次view接口
+METADATA_CACHE_FILE = 'metadata_cache.db'
+METADATA_CACHE_TTL = 600       # 有效期（秒）
+METADATA_CACHE_SIZE = 512      # 内存中最多保留的条目数
+
+class MetadataCache:
+    """带有效期和LRU淘汰的两级缓存，内存未命中时查SQLite，写入时两级同时更新"""
+    
+    def __init__(self, path: str = METADATA_CACHE_FILE, ttl: float = METADATA_CACHE_TTL,
+                 max_entries: int = METADATA_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                               'expires_at REAL NOT NULL)')
+            self._conn.execute('DELETE FROM cache WHERE expires_at < ?', (time.time(),))
+    
+    def get(self, key: str):
+        """读取缓存，不存在或已过期时返回None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    return entry[1]
+                del self._memory[key]
+            
+            row = self._conn.execute('SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?',
+                                     (key, now)).fetchone()
+            if row is None:
+                return None
+            value = json.loads(row[0])
+            self._remember(key, row[1], value)
+            return value
+    
+    def put(self, keys: list, value) -> None:
+        """以多个键（如BV号和AV号）写入同一条数据"""
+        expires_at = time.time() + self.ttl
+        text = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            for key in keys:
+                self._remember(key, expires_at, value)
+            with self._conn:
+                self._conn.executemany('INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                                       [(key, text, expires_at) for key in keys])
+    
+    def _remember(self, key: str, expires_at: float, value) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+_metadata_cache = None
+_metadata_cache_lock = threading.Lock()
+
+def get_metadata_cache() -> MetadataCache:
+    """获取全进程共用的元数据缓存"""
+    global _metadata_cache
+    with _metadata_cache_lock:
+        if _metadata_cache is None:
+            _metadata_cache = MetadataCache()
+        return _metadata_cache
+
+def cache_video_view(info: dict) -> None:
+    """把view接口返回的data同时按BV号和AV号写入缓存"""
+    get_metadata_cache().put([f"bv:{info['bvid']}", f"av:{info['aid']}"], info)
+
+def get_video_view(bvid: str = None, aid: int = None, cookies: Dict = None) -> dict:
+    """获取视频详细信息（/x/web-interface/view），优先读取缓存
+    
+    Args:
+        bvid (str): BV号
+        aid (int): AV号，未提供bvid时使用
+        cookies (Dict): cookies信息
+        
+    Returns:
+        dict: 接口返回的完整JSON（code、message、data），命中缓存时code为0
+    """
+    key = f"bv:{bvid}" if bvid else f"av:{aid}"
+    cached = get_metadata_cache().get(key)
+    if cached is not None:
+        return {'code': 0, 'message': '0', 'data': cached}
+    
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Referer': 'https://www.bilibili.com',
+    }
+    params = {'bvid': bvid} if bvid else {'aid': aid}
+    data = http_get('https://api.bilibili.com/x/web-interface/view', params=params,
+                    headers=headers, cookies=cookies).json()
+    if data['code'] == 0:
+        cache_video_view(data['data'])
+    return data
+
+def print_video_info(bvid: str, info: dict, comment_count: int) -> None:
+    """显示视频信息"""
+    print(f"\n视频信息 - {bvid}:")
+    print(f"标题: {info['title']}")
+    print(f"UP主: {info['owner']['name']}")
+    print(f"播放量: {info['stat']['view']}")
+    print(f"点赞数: {info['stat']['like']}")
+    print(f"投币数: {info['stat']['coin']}")
+    print(f"收藏数: {info['stat']['favorite']}")
+    print(f"分享数: {info['stat']['share']}")
+    print(f"评论数: {comment_count}")
+    print(f"发布时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(info['pubdate']))}")  # 修复括号
+    print(f"视频简介: {info['desc'][:100]}..." if len(info['desc']) > 100 else f"视频简介: {info['desc']}")
+    print("-" * 50)
+
 def get_video_info(bvid: str, headers: dict, show_info: bool = True) -> list:
     """获取并显示视频信息"""
     try:
-        video_url = f'https://api.bilibili.com/x/web-interface/view?bvid={bvid}'
-        response = requests.get(video_url, headers=headers)
-        data = response.json()
+        data = get_video_view(bvid)
         
         if data['code'] == 0:
             info = data['data']
             if show_info:  # 只在需要时显示信息
-                print(f"\n视频信息 - {bvid}:")
-                print(f"标题: {info['title']}")
-                print(f"UP主: {info['owner']['name']}")
-                print(f"播放量: {info['stat']['view']}")
-                print(f"点赞数: {info['stat']['like']}")
-                print(f"投币数: {info['stat']['coin']}")
-                print(f"收藏数: {info['stat']['favorite']}")
-                print(f"分享数: {info['stat']['share']}")
-                comment_count = get_comment_count(bvid)
-                print(f"评论数: {comment_count}")
-                print(f"发布时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(info['pubdate']))}")  # 修复括号
-                print(f"视频简介: {info['desc'][:100]}..." if len(info['desc']) > 100 else f"视频简介: {info['desc']}")
-                print("-" * 50)
+                print_video_info(bvid, info, get_comment_count(bvid))
             return info.get('pages', [])
     except Exception as e:
         print(f"获取视频 {bvid} 信息失败: {str(e)}")
     return []
 
+class AsyncBiliClient:
+    """只读接口的异步客户端，用于批量查询视频/评论/直播间信息
+    
+    安装了httpx时使用httpx.AsyncClient，否则把同步的http_get放到线程池中执行。
+    并发数由信号量控制，风控（412/-352）和服务器错误时退避重试。
+    
+    用法:
+        async with AsyncBiliClient(concurrency=16) as client:
+            infos = await client.gather(client.video_view(bvid) for bvid in bvids)
+    """
+    
+    def __init__(self, cookies: Dict = None, concurrency: int = 16):
+        self.cookies = cookies or {}
+        self.concurrency = max(1, concurrency)
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Referer': 'https://www.bilibili.com',
+        }
+        self._semaphore = None
+        self._client = None
+        self._executor = None
+    
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        if httpx is not None:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                cookies=self.cookies,
+                timeout=NETWORK_CONFIG['timeout'],
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._client is not None:
+            await self._client.aclose()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+    
+    async def get_json(self, url: str, params: dict = None) -> dict:
+        """请求接口并返回解析后的JSON"""
+        max_retries = NETWORK_CONFIG['max_retries']
+        async with self._semaphore:
+            limiter = get_rate_limiter(url)
+            for attempt in range(max_retries + 1):
+                if self._client is not None:
+                    await asyncio.sleep(limiter.reserve())
+                    response = await self._client.get(url, params=params)
+                    if _is_risk_control(response):
+                        limiter.on_throttle()
+                    else:
+                        limiter.on_success()
+                else:
+                    # http_get自带重试，这里只需执行一次
+                    loop = asyncio.get_running_loop()
+                    response = await loop.run_in_executor(
+                        self._executor,
+                        lambda: http_get(url, params=params, headers=self.headers, cookies=self.cookies)
+                    )
+                    return response.json()
+                
+                if attempt >= max_retries or not _should_retry(response, 'GET'):
+                    return response.json()
+                delay = min(NETWORK_CONFIG['backoff_max'], NETWORK_CONFIG['backoff_base'] * 2 ** attempt)
+                await asyncio.sleep(delay / 2 + random.uniform(0, delay / 2))
+    
+    async def video_view(self, bvid: str = None, aid: int = None) -> dict:
+        """视频详细信息 /x/web-interface/view"""
+        params = {'bvid': bvid} if bvid else {'aid': aid}
+        return await self.get_json('https://api.bilibili.com/x/web-interface/view', params)
+    
+    async def reply_count(self, aid: int) -> dict:
+        """视频评论总数 /x/v2/reply/count"""
+        return await self.get_json('https://api.bilibili.com/x/v2/reply/count', {'type': 1, 'oid': aid})
+    
+    async def reply_hot(self, aid: int, ps: int = 20, pn: int = 1) -> dict:
+        """视频热门评论 /x/v2/reply/hot"""
+        return await self.get_json('https://api.bilibili.com/x/v2/reply/hot',
+                                   {'type': 1, 'oid': aid, 'ps': ps, 'pn': pn})
+    
+    async def live_room_info(self, room_id: int) -> dict:
+        """直播间信息 /room/v1/Room/get_info"""
+        return await self.get_json('https://api.live.bilibili.com/room/v1/Room/get_info', {'room_id': room_id})
+    
+    async def live_room_init(self, room_id: int) -> dict:
+        """直播间短号转长号及直播状态 /room/v1/Room/room_init"""
+        return await self.get_json('https://api.live.bilibili.com/room/v1/Room/room_init', {'id': room_id})
+    
+    @staticmethod
+    async def gather(coroutines) -> list:
+        """并发执行多个请求，单个请求失败时对应位置返回异常对象而不是中断全部"""
+        return await asyncio.gather(*coroutines, return_exceptions=True)
+
+def fetch_video_infos(bvids: list, cookies: Dict = None, concurrency: int = 16) -> dict:
+    """并发获取多个视频的详细信息
+    
+    Returns:
+        dict: BV号 -> 视频信息（data字段），获取失败的BV号对应错误信息字符串
+    """
+    cache = get_metadata_cache()
+    infos = {}
+    for bvid in bvids:
+        cached = cache.get(f"bv:{bvid}")
+        if cached is not None:
+            infos[bvid] = cached
+    missing = [bvid for bvid in dict.fromkeys(bvids) if bvid not in infos]
+    
+    async def run():
+        async with AsyncBiliClient(cookies, concurrency) as client:
+            return await client.gather(client.video_view(bvid) for bvid in missing)
+    
+    if missing:
+        for bvid, data in zip(missing, asyncio.run(run())):
+            if isinstance(data, Exception):
+                infos[bvid] = str(data)
+            elif data.get('code') != 0:
+                infos[bvid] = data.get('message', '未知错误')
+            else:
+                infos[bvid] = data['data']
+                cache_video_view(data['data'])
+    return infos
+
+def show_video_infos(bvids: list, cookies: Dict = None) -> None:
+    """并发获取并按原顺序显示多个视频的信息"""
+    if not bvids:
+        return
+    print(f"正在获取 {len(bvids)} 个视频的信息...")
+    infos = fetch_video_infos(bvids, cookies)
+    for bvid in bvids:
+        info = infos[bvid]
+        if isinstance(info, str):
+            print(f"获取视频 {bvid} 信息失败: {info}")
+        else:
+            print_video_info(bvid, info, info['stat'].get('reply', 0))
+
 def batch_like(cookies: Dict) -> None:
     """批量点赞功能"""
     print("\n" + "="*50)
@@ -722,9 +1347,8 @@ def batch_like(cookies: Dict) -> None:
             return
         
         print(f"从文件中提取到 {len(bvids)} 个BV号:")
-        # 获取每个视频的信息
-        for bvid in bvids:
-            get_video_info(bvid, headers)
+        # 并发获取每个视频的信息
+        show_video_infos(bvids, cookies)
         
         # 询问是否继续点赞
         choice = input("\n是否开���批量点赞？(y/n) [y]: ").lower()
@@ -750,7 +1374,7 @@ def batch_like(cookies: Dict) -> None:
                     
                     try:
                         # 发送点赞请求
-                        response = requests.post(like_url, data=data, cookies=cookies, headers=headers)
+                        response = http_post(like_url, data=data, cookies=cookies, headers=headers)
                         result = response.json()
                         
                         if result['code'] == 0:
@@ -761,9 +1385,6 @@ def batch_like(cookies: Dict) -> None:
                             print("��止点赞操作")
                             break  # 点������������������失败就停��
                         
-                        # 添加延时，避免请求过���
-                        time.sleep(2)
-                        
                     except Exception as e:
                         print(f"\n点赞过程出错: {str(e)}")
                         print("停止点赞操作")
@@ -776,193 +1397,946 @@ def batch_like(cookies: Dict) -> None:
     
     print("="*50 + "\n")
 
-def download_single_audio(url: str, cookies: Dict):
-    """下载单个音频"""
-    max_retries = 3
-    retry_count = 0
+def run_ytdlp_download(url: str, output_dir: str = "音频", limit_rate: int = 0, show_progress: bool = True) -> tuple:
+    """调用yt-dlp下载单个音频
     
-    while retry_count < max_retries:
-        try:
-            cmd = [
-                'yt-dlp',
-                '--cookies', 'cookies.txt',
-                '-f', 'ba[ext=m4a]/ba',  # 优先选择m4a格式
-                '--no-playlist',
-                '--no-check-certificates',
-                '--progress',
-                '--newline',
-                '--socket-timeout', '30',  # 添加超时设置
-                '--retries', '3',  # 添加重试设置
-                '-o', os.path.join("音频", "%(title)s.%(ext)s"),
-                url
-            ]
-        
-        print("开始下载音频...")
-        
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            encoding='utf-8',
-            errors='replace',
-            bufsize=1,
-            universal_newlines=True
-        )
-        
-        downloaded_file = None
-        pbar = None
-        total_size = None
-        
-        # 用于解析下载进度的正则表达式
-        progress_pattern = re.compile(r'\[download\]\s+(\d+(?:\.\d+)?)%\s+of\s+~?\s*(\d+(?:\.\d+)?)([KMG]?)iB.*?ETA\s+([\d:]+|Unknown)')
-        
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-                
-            if output:
-                output = output.strip()
-                
-                # 获取文件名
-                if '[download] Destination:' in output:
-                    downloaded_file = output.split('[download] Destination:', 1)[1].strip()
-                elif 'has already been downloaded' in output:
-                    downloaded_file = output.split('[download] ', 1)[1].split(' has already', 1)[0].strip()
-                
-                # 解析进度信息
-                match = progress_pattern.search(output)
-                if match:
-                    percentage, size, unit, eta = match.groups()
-                    
-                    # 计算总大小（转换为字节）
-                    if total_size is None:
-                        multiplier = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
-                        total_size = int(float(size) * multiplier[unit])
-                        # 创建进度条
-                        pbar = tqdm(
-                            total=total_size,
-                            unit='B',
-                            unit_scale=True,
-                            desc="下载进度",
-                            ncols=80,
-                            bar_format='{desc}: {percentage:3.1f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]'
-                        )
-                    
-                    # 更新进度条
-                    if pbar:
-                        current = int(total_size * float(percentage) / 100)
-                        pbar.n = current
-                        pbar.refresh()
-                
-                # 其他输出信息
-                elif not output.startswith('[download]'):
-                    print(output)
-        
-        # 关闭进度条
-        if pbar:
-            pbar.close()
+    Args:
+        url (str): 视频链接
+        output_dir (str): 保存目录
+        limit_rate (int): 下载限速（字节/秒），0表示不限速
+        show_progress (bool): 是否显示进度条和yt-dlp的其他输出
         
-        # 查下载结果
-        if process.returncode == 0:
-            print("\n下载完成！")
-            
-            if downloaded_file and os.path.exists(downloaded_file):
-                print(f"找到音频文件: {downloaded_file}")
-                if input("是否转换为MP3格式？(y/n) [y]: ").lower() in ['', 'y']:
-                    if find_ffmpeg():
-                        convert_to_mp3(downloaded_file)
-                    else:
-                        print("未找到ffmpeg，无法转换为MP3格式")
-            else:
-                print(f"警告：无法找到下载的文件")
-                m4a_files = [f for f in os.listdir('.') if f.endswith('.m4a')]
-                if m4a_files:
-                    print(f"在当前目录找到��下.m4a文件：")
-                    for i, file in enumerate(m4a_files, 1):
-                        print(f"{i}. {file}")
-                    choice = input("请选择要转换的文件编号（输入q取消）[1]: ")
-                    if not choice:
-                        choice = '1'
-                    if choice.isdigit() and 1 <= int(choice) <= len(m4a_files):
-                            if find_ffmpeg():
-                                convert_to_mp3(m4a_files[int(choice)-1])
-                            else:
-                                print("未找到ffmpeg，无法转换为MP3格式")
-            return True  # 下载成功
-        else:
-            error = process.stderr.read()
-            print(f"下载失败！错误信息：\n{error}")
-            retry_count += 1
-            if retry_count < max_retries:
-                print(f"正在进行第 {retry_count + 1} 次重试...")
-                time.sleep(2)  # 等待2秒后重试
-            else:
-                print("已达到最大重试次数，下载失败")
-                return False
-            
-    except FileNotFoundError:
-        print("错误：请先安装 yt-dlp")
-        print("可以使用以下命令安装：")
-        print("pip install yt-dlp")
-        return False
-    except Exception as e:
-        print(f"发生错误: {str(e)}")
-        retry_count += 1
-        if retry_count < max_retries:
-            print(f"正在进行第 {retry_count + 1} 次重试...")
-            time.sleep(2)
-        else:
-            print("已达到最大重试次数，下载失败")
-            return False
-
-def create_required_directories():
-    """创建程序所需的文件夹"""
-    required_dirs = [
-        "弹幕",                    # 存放视频弹幕文件
-        os.path.join("弹幕", "直播弹幕"),  # 存放直播弹幕文件
-        "评论",                    # 存放评论文件
-        "音频",                    # 存放下载的音频文件
-        "举报",                    # 存放举报相关文件
-        os.path.join("举报", "图片"),  # 存放举报附件图片
-        os.path.join("举报", "记录"),  # 存放举报记录
+    Returns:
+        tuple: (是否成功, 下载的文件路径, 错误信息)
+    """
+    cmd = [
+        'yt-dlp',
+        '--cookies', 'cookies.txt',
+        '-f', 'ba[ext=m4a]/ba',  # 优先选择m4a格式
+        '--no-playlist',
+        '--no-check-certificates',
+        '--progress' if show_progress else '--no-progress',
+        '--newline',
+        '--socket-timeout', '30',  # 添加超时设置
+        '--retries', '3',  # 添加重试设置
+        '-o', os.path.join(output_dir, "%(title)s.%(ext)s"),
     ]
+    if limit_rate > 0:
+        cmd += ['--limit-rate', str(limit_rate)]
+    cmd.append(url)
     
-    for directory in required_dirs:
-        if not os.path.exists(directory):
-            try:
-                os.makedirs(directory)
-                print(f"创建文件夹: {directory}")
-            except Exception as e:
-                print(f"创建文件夹 {directory} 时出错: {str(e)}")
-
-def main():
-    # 创建必要的文件夹
-    create_required_directories()
-    
-    # 检查cookies.txt是否存在
-    if not os.path.exists('cookies.txt'):  # 直接���查当前目录
-        print("错误：找���到cookies.txt��件！")
-        print("请确保cookies.txt文件存在且包含有效的cookies信息")
-        return
-    
-    # 加载cookies
-    cookies = load_cookies_from_file()
-    if not cookies:
-        print("��误：无法从cookies.txt加载有效的cookies")
-        return
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        encoding='utf-8',
+        errors='replace',
+        bufsize=1,
+        universal_newlines=True
+    )
     
-    # 获取并显示用户信息
-    get_user_info(cookies)
+    downloaded_file = None
+    pbar = None
+    total_size = None
     
-    # 创建LiveRoom实例
-    live_room = LiveRoom()
+    # 用于解析下载进度的正则表达式
+    progress_pattern = re.compile(r'\[download\]\s+(\d+(?:\.\d+)?)%\s+of\s+~?\s*(\d+(?:\.\d+)?)([KMG]?)iB.*?ETA\s+([\d:]+|Unknown)')
     
     while True:
-        choice = show_menu()
-        
-        if choice == '1':
-            # 举报麦片
+        output = process.stdout.readline()
+        if output == '' and process.poll() is not None:
+            break
+            
+        if output:
+            output = output.strip()
+            
+            # 获取文件名
+            if '[download] Destination:' in output:
+                downloaded_file = output.split('[download] Destination:', 1)[1].strip()
+            elif 'has already been downloaded' in output:
+                downloaded_file = output.split('[download] ', 1)[1].split(' has already', 1)[0].strip()
+            
+            if not show_progress:
+                continue
+            
+            # 解析进度信息
+            match = progress_pattern.search(output)
+            if match:
+                percentage, size, unit, eta = match.groups()
+                
+                # 计算总大小（转换为字节）
+                if total_size is None:
+                    multiplier = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3}
+                    total_size = int(float(size) * multiplier[unit])
+                    # 创建进度条
+                    pbar = tqdm(
+                        total=total_size,
+                        unit='B',
+                        unit_scale=True,
+                        desc="下载进度",
+                        ncols=80,
+                        bar_format='{desc}: {percentage:3.1f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]'
+                    )
+                
+                # 更新进度条
+                if pbar:
+                    current = int(total_size * float(percentage) / 100)
+                    pbar.n = current
+                    pbar.refresh()
+            
+            # 其他输出信息
+            elif not output.startswith('[download]'):
+                print(output)
+    
+    # 关闭进度条
+    if pbar:
+        pbar.close()
+    
+    if process.returncode == 0:
+        return True, downloaded_file, ''
+    return False, downloaded_file, process.stderr.read()
+
+def load_ytdlp_module():
+    """导入yt_dlp模块，未安装时返回None"""
+    try:
+        import yt_dlp
+        return yt_dlp
+    except ImportError:
+        return None
+
+# 每个线程复用自己的YoutubeDL实例，避免每个条目重复初始化提取器
+_ytdlp_local = threading.local()
+
+def get_ytdlp_instance(yt_dlp, output_dir: str, limit_rate: int):
+    """获取当前线程的YoutubeDL实例（按保存目录和限速缓存）"""
+    instances = getattr(_ytdlp_local, 'instances', None)
+    if instances is None:
+        instances = _ytdlp_local.instances = {}
+    
+    key = (output_dir, limit_rate)
+    if key not in instances:
+        def progress_hook(d):
+            # 分发给当前正在下载的条目
+            hook = getattr(_ytdlp_local, 'hook', None)
+            if hook:
+                hook(d)
+        
+        options = {
+            'cookiefile': 'cookies.txt',
+            'format': 'ba[ext=m4a]/ba',  # 优先选择m4a格式
+            'noplaylist': True,
+            'nocheckcertificate': True,
+            'socket_timeout': 30,
+            'retries': 3,
+            'outtmpl': os.path.join(output_dir, "%(title)s.%(ext)s"),
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'progress_hooks': [progress_hook],
+        }
+        if limit_rate > 0:
+            options['ratelimit'] = limit_rate
+        instances[key] = yt_dlp.YoutubeDL(options)
+    return instances[key]
+
+def run_ytdlp_api_download(url: str, output_dir: str = "音频", limit_rate: int = 0, show_progress: bool = True,
+                           stream_info: dict = None) -> tuple:
+    """在当前进程内通过yt_dlp的Python API下载单个音频
+    
+    与run_ytdlp_download参数和返回值相同，但不再为每个条目启动新进程，
+    进度来自progress hook的实际字节数。
+    
+    Args:
+        stream_info (dict): 传入时写入下载的音质（quality），供写入下载存档
+        
+    Returns:
+        tuple: (是否成功, 下载的文件路径, 错误信息)
+    """
+    yt_dlp = load_ytdlp_module()
+    if yt_dlp is None:
+        raise ImportError("未安装yt_dlp模块")
+    
+    ydl = get_ytdlp_instance(yt_dlp, output_dir, limit_rate)
+    state = {'file': None, 'pbar': None}
+    
+    def hook(d):
+        if d.get('filename'):
+            state['file'] = d['filename']
+        if not show_progress or d['status'] != 'downloading':
+            return
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        if state['pbar'] is None and total:
+            state['pbar'] = tqdm(
+                total=int(total),
+                unit='B',
+                unit_scale=True,
+                desc="下载进度",
+                ncols=80,
+                bar_format='{desc}: {percentage:3.1f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]'
+            )
+        if state['pbar'] is not None:
+            if total and int(total) != state['pbar'].total:
+                state['pbar'].total = int(total)
+            state['pbar'].n = d.get('downloaded_bytes', 0)
+            state['pbar'].refresh()
+    
+    _ytdlp_local.hook = hook
+    try:
+        info = ydl.extract_info(url, download=True)
+    except yt_dlp.utils.DownloadError as e:
+        return False, state['file'], str(e)
+    finally:
+        _ytdlp_local.hook = None
+        if state['pbar'] is not None:
+            state['pbar'].close()
+    
+    # 已下载过的文件不会触发下载进度，从返回信息中取实际路径
+    downloads = (info or {}).get('requested_downloads') or []
+    if downloads and downloads[0].get('filepath'):
+        state['file'] = downloads[0]['filepath']
+    remember_duration(state['file'], (info or {}).get('duration'))
+    if stream_info is not None:
+        stream_info['quality'] = str((info or {}).get('format_id') or '')
+    return True, state['file'], ''
+
+def download_with_ytdlp(url: str, output_dir: str = "音频", limit_rate: int = 0,
+                        show_progress: bool = True, backend: str = 'auto', stream_info: dict = None) -> tuple:
+    """按指定后端下载单个音频
+    
+    Args:
+        backend (str): 'api' 使用进程内yt_dlp，'subprocess' 启动yt-dlp命令，
+            'auto' 在已安装yt_dlp模块时使用API，否则回退到命令行
+        stream_info (dict): 见run_ytdlp_api_download，命令行方式不填写
+            
+    Returns:
+        tuple: (是否成功, 下载的文件路径, 错误信息)
+    """
+    if backend == 'api' or (backend == 'auto' and load_ytdlp_module() is not None):
+        return run_ytdlp_api_download(url, output_dir, limit_rate, show_progress, stream_info)
+    return run_ytdlp_download(url, output_dir, limit_rate, show_progress)
+
+# 下载存档：记录已下载的音频，重复运行时无需任何网络请求即可跳过
+ARCHIVE_FILE = 'download_archive.db'
+_archive_lock = threading.Lock()
+_archive_conn = None
+
+ARCHIVE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS downloads (
+        bvid TEXT NOT NULL,
+        cid INTEGER NOT NULL,
+        quality TEXT NOT NULL,
+        page INTEGER NOT NULL,
+        page_count INTEGER NOT NULL,
+        filepath TEXT NOT NULL,
+        downloaded_at REAL NOT NULL,
+        PRIMARY KEY (bvid, page, quality)
+    )
+'''
+
+def _migrate_archive(conn: sqlite3.Connection) -> None:
+    """旧版存档以(bvid, cid, quality)为主键，yt-dlp后端拿不到cid时各分P会互相覆盖，改为按分P记录"""
+    columns = conn.execute('PRAGMA table_info(downloads)').fetchall()
+    primary_key = [name for _, name, _, _, _, pk in sorted(columns, key=lambda c: c[5]) if pk]
+    if not columns or primary_key == ['bvid', 'page', 'quality']:
+        return
+    with conn:
+        conn.execute('ALTER TABLE downloads RENAME TO downloads_old')
+        conn.execute(ARCHIVE_SCHEMA)
+        conn.execute('INSERT OR REPLACE INTO downloads SELECT bvid, cid, quality, page, page_count, filepath, '
+                     'downloaded_at FROM downloads_old ORDER BY downloaded_at')
+        conn.execute('DROP TABLE downloads_old')
+
+def get_archive_connection(path: str = ARCHIVE_FILE) -> sqlite3.Connection:
+    """打开（必要时创建）下载存档数据库，整个进程共用一个连接"""
+    global _archive_conn
+    with _archive_lock:
+        if _archive_conn is None:
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            _migrate_archive(conn)
+            conn.execute(ARCHIVE_SCHEMA)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_downloads_page ON downloads (bvid, page)')
+            conn.commit()
+            _archive_conn = conn
+        return _archive_conn
+
+def fill_page_details(bvid: str, page_num: int, stream_info: dict, cookies: Dict = None) -> None:
+    """yt-dlp返回的信息中没有cid和分P数，从视频信息（通常已在缓存中）补全到stream_info"""
+    if stream_info.get('cid') and stream_info.get('page_count'):
+        return
+    try:
+        data = get_video_view(bvid, cookies=cookies)
+        if data['code'] != 0:
+            return
+        info = data['data']
+        pages = info.get('pages') or []
+        page = pages[page_num - 1] if 1 <= page_num <= len(pages) else {'cid': info.get('cid')}
+        stream_info['cid'] = stream_info.get('cid') or page.get('cid')
+        stream_info['page_count'] = len(pages) or 1
+    except (requests.RequestException, KeyError, ValueError) as e:
+        logger.debug(f"获取 {bvid} 分P信息失败: {str(e)}")
+
+def resolve_archived_file(filepath: str) -> str:
+    """返回存档文件的实际位置，格式转换后扩展名可能已改变，文件已不存在时返回空字符串"""
+    if os.path.exists(filepath):
+        return filepath
+    stem = os.path.splitext(filepath)[0]
+    for extension in ('.mp3', '.m4a', '.flac', '.aac'):
+        if os.path.exists(stem + extension):
+            return stem + extension
+    return ''
+
+def archive_lookup(bvid: str, page: int = 1) -> dict:
+    """查询某个分P是否已下载过（只查本地数据库）
+    
+    Returns:
+        dict: 存档记录（含实际文件路径），未下载或文件已被删除时返回None
+    """
+    conn = get_archive_connection()
+    with _archive_lock:
+        rows = conn.execute(
+            'SELECT cid, quality, page_count, filepath FROM downloads WHERE bvid = ? AND page = ? '
+            'ORDER BY downloaded_at DESC',
+            (bvid, page)
+        ).fetchall()
+    for cid, quality, page_count, filepath in rows:
+        actual_file = resolve_archived_file(filepath)
+        if actual_file:
+            return {'bvid': bvid, 'cid': cid, 'quality': quality, 'page': page,
+                    'page_count': page_count, 'file': actual_file}
+    return None
+
+def archive_record(bvid: str, page: int, filepath: str, cid: int = 0, quality: str = '',
+                   page_count: int = 0) -> None:
+    """下载成功后写入存档，单条记录在一个事务内完成
+    
+    Args:
+        cid (int): 分P的cid，未知时为0
+        quality (str): 下载的音质代码
+        page_count (int): 视频的分P数，未知时为0
+    """
+    cid, quality, page_count = int(cid or 0), str(quality or ''), int(page_count or 0)
+    conn = get_archive_connection()
+    with _archive_lock, conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO downloads (bvid, cid, quality, page, page_count, filepath, downloaded_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (bvid, cid, quality, page, page_count, filepath, time.time())
+        )
+
+# DASH伴音音质代码，数值越大音质越好
+AUDIO_QUALITY_NAMES = {
+    30216: "64K",
+    30232: "132K",
+    30280: "192K",
+    30250: "杜比全景声",
+    30251: "Hi-Res无损",
+}
+
+def get_dash_audio_streams(bvid: str, cid: int, cookies: Dict = None) -> list:
+    """通过playurl接口获取视频的全部DASH伴音流，按音质从高到低排序
+    
+    Args:
+        bvid (str): 视频BV号
+        cid (int): 分P的cid
+        cookies (Dict): cookies信息，无损/杜比音轨需要大会员登录
+        
+    Returns:
+        list: 伴音流信息，包含id、base_url、backup_url、bandwidth、codecs等字段
+    """
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Referer': 'https://www.bilibili.com',
+    }
+    params = encode_wbi({
+        'bvid': bvid,
+        'cid': cid,
+        'fnval': 4048,  # 所有DASH流，包含杜比和无损音轨
+        'fnver': 0,
+        'fourk': 1,
+    }, cookies)
+    
+    url = 'https://api.bilibili.com/x/player/wbi/playurl'
+    response = http_get(url, params=params, cookies=cookies, headers=headers, timeout=30)
+    data = response.json()
+    if data['code'] != 0:
+        raise RuntimeError(f"获取播放地址失败：{data['message']}")
+    
+    dash = (data.get('data') or {}).get('dash') or {}
+    streams = list(dash.get('audio') or [])
+    if (dash.get('dolby') or {}).get('audio'):
+        streams.extend(dash['dolby']['audio'])
+    if (dash.get('flac') or {}).get('audio'):
+        streams.append(dash['flac']['audio'])
+    
+    # 无损 > 杜比 > 普通伴音按码率
+    priority = {30251: 2, 30250: 1}
+    streams.sort(key=lambda s: (priority.get(s['id'], 0), s.get('bandwidth', 0)), reverse=True)
+    return streams
+
+def sanitize_filename(name: str) -> str:
+    """去掉文件名中Windows不允许的字符"""
+    return re.sub(r'[\\/:*?"<>|\r\n]+', '_', name).strip() or 'untitled'
+
+def download_stream_ranged(urls: list, filepath: str, headers: dict, connections: int = 4,
+                           chunk_size: int = 4 * 1024 * 1024, limit_rate: int = 0,
+                           show_progress: bool = True) -> int:
+    """多连接分块下载单个文件，支持断点续传
+    
+    下载中的数据写入 filepath + '.part'，已完成的分块记录在 '.part.json' 中，
+    中断后再次调用会跳过已完成的分块。服务器不支持Range时退化为单连接下载。
+    
+    Args:
+        urls (list): 主地址和备用地址，依次尝试
+        filepath (str): 最终保存路径
+        headers (dict): 请求头（需要包含Referer）
+        connections (int): 并发连接数
+        chunk_size (int): 每个分块的字节数
+        limit_rate (int): 下载限速（字节/秒），0表示不限速
+        show_progress (bool): 是否显示进度条
+        
+    Returns:
+        int: 文件大小（字节）
+    """
+    part_file = filepath + '.part'
+    state_file = part_file + '.json'
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(connections, 1))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(headers)
+    
+    # 探测文件大小，并找到第一个可用的地址
+    total_size = 0
+    supports_range = False
+    errors = []
+    for url in urls:
+        try:
+            with session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=30) as resp:
+                if resp.status_code == 206 and '/' in resp.headers.get('Content-Range', ''):
+                    total_size = int(resp.headers['Content-Range'].rsplit('/', 1)[1])
+                    supports_range = True
+                elif resp.status_code == 200:
+                    total_size = int(resp.headers.get('Content-Length', 0))
+                else:
+                    errors.append(f"HTTP {resp.status_code}")
+                    continue
+            break
+        except requests.RequestException as e:
+            errors.append(str(e))
+    else:
+        raise RuntimeError(f"所有下载地址均不可用: {'; '.join(errors)}")
+    
+    chunks = []
+    if supports_range and total_size > 0:
+        chunks = [(start, min(start + chunk_size, total_size) - 1) for start in range(0, total_size, chunk_size)]
+    
+    # 读取续传状态，文件大小或分块方式不一致时重新下载
+    done = set()
+    if chunks and os.path.exists(part_file) and os.path.exists(state_file):
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('size') == total_size and state.get('chunk_size') == chunk_size:
+                done = set(state.get('done', []))
+        except (OSError, ValueError):
+            done = set()
+    if not done:
+        with open(part_file, 'wb') as f:
+            if total_size:
+                f.truncate(total_size)
+    
+    lock = threading.Lock()
+    rate_state = {'start': time.time(), 'bytes': 0}
+    pbar = None
+    if show_progress:
+        pbar = tqdm(
+            total=total_size or None,
+            initial=sum(chunks[i][1] - chunks[i][0] + 1 for i in done),
+            unit='B',
+            unit_scale=True,
+            desc="下载进度",
+            ncols=80,
+            bar_format='{desc}: {percentage:3.1f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]'
+        )
+    
+    def on_data(length: int):
+        with lock:
+            if pbar is not None:
+                pbar.update(length)
+            if limit_rate > 0:
+                rate_state['bytes'] += length
+                expected = rate_state['bytes'] / limit_rate
+                delay = expected - (time.time() - rate_state['start'])
+        if limit_rate > 0 and delay > 0:
+            time.sleep(delay)
+    
+    def fetch_chunk(index: int):
+        start, end = chunks[index]
+        last_error = None
+        for url in urls:
+            try:
+                with session.get(url, headers={'Range': f'bytes={start}-{end}'}, stream=True, timeout=30) as resp:
+                    if resp.status_code != 206:
+                        raise RuntimeError(f"HTTP {resp.status_code}")
+                    received = 0
+                    with open(part_file, 'r+b') as f:
+                        f.seek(start)
+                        for data in resp.iter_content(chunk_size=64 * 1024):
+                            f.write(data)
+                            received += len(data)
+                            on_data(len(data))
+                    if received != end - start + 1:
+                        raise RuntimeError(f"分块 {index} 数据不完整")
+                with lock:
+                    done.add(index)
+                    with open(state_file, 'w', encoding='utf-8') as f:
+                        json.dump({'size': total_size, 'chunk_size': chunk_size, 'done': sorted(done)}, f)
+                return
+            except (requests.RequestException, RuntimeError) as e:
+                last_error = e
+        raise RuntimeError(f"分块 {index} 下载失败: {str(last_error)}")
+    
+    try:
+        if chunks:
+            pending = [i for i in range(len(chunks)) if i not in done]
+            with ThreadPoolExecutor(max_workers=max(1, min(connections, len(pending) or 1))) as executor:
+                for future in as_completed([executor.submit(fetch_chunk, i) for i in pending]):
+                    future.result()
+        else:
+            # 服务器不支持Range，只能单连接从头下载
+            last_error = None
+            for url in urls:
+                try:
+                    with session.get(url, stream=True, timeout=30) as resp:
+                        resp.raise_for_status()
+                        with open(part_file, 'wb') as f:
+                            for data in resp.iter_content(chunk_size=64 * 1024):
+                                f.write(data)
+                                on_data(len(data))
+                    last_error = None
+                    break
+                except requests.RequestException as e:
+                    last_error = e
+            if last_error is not None:
+                raise RuntimeError(f"下载失败: {str(last_error)}")
+    finally:
+        if pbar is not None:
+            pbar.close()
+        session.close()
+    
+    os.replace(part_file, filepath)
+    if os.path.exists(state_file):
+        os.remove(state_file)
+    return os.path.getsize(filepath)
+
+def download_audio_native(url: str, cookies: Dict, output_dir: str = "音频", limit_rate: int = 0,
+                          show_progress: bool = True, connections: int = 4, stream_info: dict = None) -> tuple:
+    """不经过yt-dlp，直接从playurl接口取最佳DASH伴音并分块下载
+    
+    Args:
+        stream_info (dict): 传入时写入cid、音质（quality）和分P数（page_count），供写入下载存档
+        
+    Returns:
+        tuple: (是否成功, 下载的文件路径, 错误信息)，与run_ytdlp_download一致
+    """
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Referer': 'https://www.bilibili.com',
+    }
+    
+    bvid = extract_bvid(url)
+    if not bvid:
+        return False, None, "无法识别BV号"
+    page_match = re.search(r'[?&]p=(\d+)', url)
+    page_num = int(page_match.group(1)) if page_match else 1
+    
+    try:
+        data = get_video_view(bvid, cookies=cookies)
+        if data['code'] != 0:
+            return False, None, f"获取视频信息失败：{data['message']}"
+        info = data['data']
+        pages = info.get('pages') or []
+        if not 1 <= page_num <= max(len(pages), 1):
+            return False, None, f"分P编号超出范围: P{page_num}"
+        page = pages[page_num - 1] if pages else {'cid': info['cid'], 'part': ''}
+        
+        streams = get_dash_audio_streams(bvid, page['cid'], cookies)
+        if not streams:
+            return False, None, "该视频没有可用的伴音流"
+        stream = streams[0]
+        
+        title = info['title'] if len(pages) <= 1 else f"{info['title']} P{page_num} {page['part']}"
+        filepath = os.path.join(output_dir, sanitize_filename(title) + '.m4a')
+        remember_duration(filepath, page.get('duration') or info.get('duration'))
+        if stream_info is not None:
+            stream_info.update(cid=page['cid'], quality=str(stream['id']), page_count=len(pages))
+        if os.path.exists(filepath):
+            return True, filepath, ''
+        
+        os.makedirs(output_dir, exist_ok=True)
+        if show_progress:
+            print(f"音质: {AUDIO_QUALITY_NAMES.get(stream['id'], stream['id'])} ({stream.get('codecs', '')})")
+        urls = [stream.get('base_url') or stream.get('baseUrl')] + list(stream.get('backup_url') or stream.get('backupUrl') or [])
+        download_stream_ranged([u for u in urls if u], filepath, headers, connections,
+                               limit_rate=limit_rate, show_progress=show_progress)
+        return True, filepath, ''
+    except Exception as e:
+        return False, None, str(e)
+
+def download_audio_file(url: str, cookies: Dict, output_dir: str = "音频", limit_rate: int = 0,
+                        show_progress: bool = True, backend: str = 'auto', use_archive: bool = True) -> tuple:
+    """下载单个音频文件，backend为'native'时直接请求DASH流，其余交给download_with_ytdlp
+    
+    use_archive为True时先查下载存档，已下载过的分P直接返回存档中的文件，不发起任何网络请求。
+    
+    Returns:
+        tuple: (是否成功, 下载的文件路径, 错误信息)
+    """
+    bvid = extract_bvid(url)
+    page_match = re.search(r'[?&]p=(\d+)', url)
+    page_num = int(page_match.group(1)) if page_match else 1
+    if use_archive and bvid:
+        archived = archive_lookup(bvid, page_num)
+        if archived:
+            if show_progress:
+                print(f"已下载过，跳过: {archived['file']}")
+            return True, archived['file'], ''
+    
+    stream_info = {}
+    if backend == 'native':
+        result = download_audio_native(url, cookies, output_dir, limit_rate, show_progress, stream_info=stream_info)
+    else:
+        result = download_with_ytdlp(url, output_dir, limit_rate, show_progress, backend, stream_info)
+    
+    success, downloaded_file, _ = result
+    if use_archive and bvid and success and downloaded_file and os.path.exists(downloaded_file):
+        fill_page_details(bvid, page_num, stream_info, cookies)
+        archive_record(bvid, page_num, downloaded_file, **stream_info)
+    return result
+
+def download_single_audio(url: str, cookies: Dict, backend: str = 'auto'):
+    """下载单个音频"""
+    max_retries = 3
+    retry_count = 0
+    
+    while retry_count < max_retries:
+        try:
+            print("开始下载音频...")
+            success, downloaded_file, error = download_audio_file(url, cookies, backend=backend)
+            
+            # 检查下载结果
+            if success:
+                print("\n下载完成！")
+                
+                if downloaded_file and os.path.exists(downloaded_file):
+                    print(f"找到音频文件: {downloaded_file}")
+                    output_format = input("请选择输出格式 mp3/m4a/flac/copy（copy为保持原始编码不重新编码，n为不转换）[mp3]: ").strip().lower() or 'mp3'
+                    if output_format in OUTPUT_FORMATS:
+                        if find_ffmpeg():
+                            convert_to_mp3(downloaded_file, output_format=output_format)
+                        else:
+                            print("未找到ffmpeg，无法转换为MP3格式")
+                else:
+                    print(f"警告：无法找到下载的文件")
+                    m4a_files = [f for f in os.listdir('.') if f.endswith('.m4a')]
+                    if m4a_files:
+                        print(f"在当前目录找到以下.m4a文件：")
+                        for i, file in enumerate(m4a_files, 1):
+                            print(f"{i}. {file}")
+                        choice = input("请选择要转换的文件编号（输入q取消）[1]: ")
+                        if not choice:
+                            choice = '1'
+                        if choice.isdigit() and 1 <= int(choice) <= len(m4a_files):
+                                if find_ffmpeg():
+                                    convert_to_mp3(m4a_files[int(choice)-1])
+                                else:
+                                    print("未找到ffmpeg，无法转换为MP3格式")
+                return True  # 下载成功
+            else:
+                print(f"下载失败！错误信息：\n{error}")
+                retry_count += 1
+                if retry_count < max_retries:
+                    print(f"正在进行第 {retry_count + 1} 次重试...")
+                    time.sleep(2)  # 等待2秒后重试
+                else:
+                    print("已达到最大重试次数，下载失败")
+                    return False
+                
+        except FileNotFoundError:
+            print("错误：请先安装 yt-dlp")
+            print("可以使用以下命令安装：")
+            print("pip install yt-dlp")
+            return False
+        except ImportError:
+            print("错误：未安装yt_dlp模块，请使用 pip install yt-dlp 安装")
+            return False
+        except Exception as e:
+            print(f"发生错误: {str(e)}")
+            retry_count += 1
+            if retry_count < max_retries:
+                print(f"正在进行第 {retry_count + 1} 次重试...")
+                time.sleep(2)
+            else:
+                print("已达到最大重试次数，下载失败")
+                return False
+    return False
+
+def parse_rate(rate: str) -> int:
+    """解析带宽字符串（如 500K、4M、1.5M），返回字节/秒，空值返回0"""
+    if not rate:
+        return 0
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?)(?:i?B)?\s*', str(rate), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"无效的带宽设置: {rate}")
+    number, unit = match.groups()
+    multiplier = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3}
+    return int(float(number) * multiplier[unit.upper()])
+
+def download_audio_item(bvid: str, cookies: Dict, limit_rate: int = 0, max_retries: int = 3,
+                        backend: str = 'auto', use_archive: bool = True) -> dict:
+    """无交互下载单个BV号的音频，返回该条目的下载结果"""
+    url = f"https://www.bilibili.com/video/{bvid}"
+    result = {'bvid': bvid, 'success': False, 'file': None, 'error': '', 'attempts': 0, 'elapsed': 0.0}
+    start_time = time.time()
+    
+    for attempt in range(1, max_retries + 1):
+        result['attempts'] = attempt
+        try:
+            success, downloaded_file, error = download_audio_file(url, cookies, limit_rate=limit_rate,
+                                                                  show_progress=False, backend=backend,
+                                                                  use_archive=use_archive)
+        except (FileNotFoundError, ImportError):
+            result['error'] = "未安装yt-dlp"
+            break
+        except Exception as e:
+            success, downloaded_file, error = False, None, str(e)
+        
+        if success:
+            result['success'] = True
+            result['file'] = downloaded_file
+            result['error'] = ''
+            break
+        
+        # 只保留最后一行错误信息，避免汇总时刷屏
+        result['error'] = error.strip().splitlines()[-1] if error.strip() else "未知错误"
+        if attempt < max_retries:
+            time.sleep(2 * attempt)
+    
+    result['elapsed'] = time.time() - start_time
+    return result
+
+def batch_download_audio(cookies: Dict, filename: str = 'bvid.txt', max_workers: int = 4,
+                         limit_rate: str = None, max_retries: int = 3, backend: str = 'auto',
+                         output_format: str = None, transcode_workers: int = None,
+                         use_archive: bool = True) -> list:
+    """并发批量下载文件中所有BV号的音频（无交互）
+    
+    指定output_format时为两段式流水线：每个下载完成的文件立即交给独立的转码线程池，
+    网络下载和ffmpeg编码同时进行，不再互相等待。
+    
+    Args:
+        cookies (Dict): cookies信息
+        filename (str): BV号/链接列表文件，每行一个
+        max_workers (int): 同时下载的数量
+        limit_rate (str): 全局带宽上限（如 8M），平均分配给每个下载任务
+        max_retries (int): 每个条目的最大尝试次数
+        backend (str): 下载后端，见download_audio_file
+        output_format (str): 下载完成后转换的格式（见OUTPUT_FORMATS，转换成功后删除原文件），None为不转换
+        transcode_workers (int): 同时转码的数量，默认为CPU核心数
+        use_archive (bool): 是否跳过下载存档中已有的条目
+        
+    Returns:
+        list: 每个条目的下载结果
+    """
+    if not os.path.exists(filename):
+        print(f"错误：找不到{filename}文件！")
+        print(f"请创建{filename}文件并在其中每行写入一个视频链接")
+        return []
+    
+    # 去重并保持原有顺序
+    bvids = list(dict.fromkeys(extract_bvid_from_file(filename)))
+    if not bvids:
+        print("错误：无法从文件中提取有效的BV号！")
+        return []
+    total = len(bvids)
+    
+    # 先查本地存档，已下载过的条目不进入下载队列
+    results = []
+    if use_archive:
+        pending = []
+        for bvid in bvids:
+            archived = archive_lookup(bvid)
+            if archived:
+                results.append({'bvid': bvid, 'success': True, 'file': archived['file'], 'error': '',
+                                'attempts': 0, 'elapsed': 0.0, 'skipped': True})
+            else:
+                pending.append(bvid)
+        if results:
+            print(f"\n下载存档中已有 {len(results)} 个，跳过")
+        bvids = pending
+        if not bvids:
+            print_batch_summary(results, total, 0)
+            return results
+    
+    max_workers = max(1, min(max_workers, len(bvids) or 1))
+    total_rate = parse_rate(limit_rate)
+    # yt-dlp只支持单进程限速，把全局上限平均分给每个并发任务
+    per_item_rate = total_rate // max_workers if total_rate else 0
+    
+    if output_format and output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    ffmpeg = ''
+    if output_format:
+        ffmpeg = find_ffmpeg()
+        if not ffmpeg:
+            print("未找到ffmpeg，将只下载不转换")
+    transcode_workers = max(1, transcode_workers or os.cpu_count() or 1)
+    
+    save_cookies(cookies)
+    os.makedirs("音频", exist_ok=True)
+    
+    print(f"\n共 {len(bvids)} 个BV号待下载，并发数: {max_workers}" +
+          (f"，带宽上限: {limit_rate}" if total_rate else "") +
+          (f"，转码并发数: {transcode_workers}" if ffmpeg else ""))
+    
+    start_time = time.time()
+    
+    # ffmpeg在子进程中运行，线程池只负责调度，转码可以真正占满多个核心
+    transcoder = ThreadPoolExecutor(max_workers=transcode_workers) if ffmpeg else None
+    transcode_futures = {}
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(download_audio_item, bvid, cookies, per_item_rate, max_retries, backend, use_archive): bvid
+            for bvid in bvids
+        }
+        with tqdm(total=len(bvids), desc="批量下载", ncols=80) as pbar:
+            try:
+                for future in as_completed(futures):
+                    result = future.result()
+                    results.append(result)
+                    if result['success']:
+                        tqdm.write(f"✅ {result['bvid']} -> {os.path.basename(result['file'] or '')}")
+                        if transcoder and result['file']:
+                            future = transcoder.submit(transcode_audio, result['file'], ffmpeg, output_format)
+                            transcode_futures[future] = result
+                    else:
+                        tqdm.write(f"❌ {result['bvid']}: {result['error']}")
+                    pbar.update(1)
+            except KeyboardInterrupt:
+                tqdm.write("\n用户中断，正在取消未开始的任务...")
+                for future in futures:
+                    future.cancel()
+    
+    if transcoder:
+        # 下载阶段结束后，等待还在排队或进行中的转码任务
+        try:
+            pending = [f for f in transcode_futures if not f.done()]
+            if pending:
+                print(f"下载完成，等待 {len(pending)} 个转码任务...")
+            for future in as_completed(transcode_futures):
+                result = transcode_futures[future]
+                success, mp3_file, error = future.result()
+                if success:
+                    result['file'] = mp3_file
+                else:
+                    result['convert_error'] = error
+                    tqdm.write(f"⚠️ {result['bvid']} 格式转换失败: {error}")
+        except KeyboardInterrupt:
+            print("\n用户中断，正在取消未开始的转码任务...")
+            for future in transcode_futures:
+                future.cancel()
+        finally:
+            transcoder.shutdown(wait=True)
+    
+    print_batch_summary(results, total, time.time() - start_time)
+    return results
+
+def print_batch_summary(results: list, total: int, elapsed: float) -> None:
+    """打印批量下载汇总，并把失败的BV号写入文件方便重试"""
+    succeeded = [r for r in results if r['success']]
+    failed = [r for r in results if not r['success']]
+    
+    print("\n" + "="*50)
+    print("# 批量下载汇总")
+    print("="*50)
+    print(f"总数: {total}")
+    print(f"成功: {len(succeeded)}")
+    skipped = [r for r in succeeded if r.get('skipped')]
+    if skipped:
+        print(f"  其中已在存档中跳过: {len(skipped)}")
+    print(f"失败: {len(failed)}")
+    convert_failed = [r for r in succeeded if r.get('convert_error')]
+    if convert_failed:
+        print(f"格式转换失败: {len(convert_failed)}")
+    if total > len(results):
+        print(f"未完成: {total - len(results)}")
+    minutes, seconds = divmod(int(elapsed), 60)
+    print(f"总耗时: {minutes}分{seconds}秒")
+    
+    if failed:
+        print("\n失败列表:")
+        for r in failed:
+            print(f"- {r['bvid']} (尝试 {r['attempts']} 次): {r['error']}")
+        
+        failed_file = 'bvid_failed.txt'
+        try:
+            with open(failed_file, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(r['bvid'] for r in failed))
+            print(f"\n失败的BV号已保存到 {failed_file}，可用 -f {failed_file} 重新下载")
+        except Exception as e:
+            print(f"保存失败列表时出错: {str(e)}")
+    print("="*50 + "\n")
+
+def create_required_directories():
+    """创建程序所需的文件夹"""
+    required_dirs = [
+        "弹幕",                    # 存放视频弹幕文件
+        os.path.join("弹幕", "直播弹幕"),  # 存放直播弹幕文件
+        LIVE_VIDEO_DIR,            # 存放直播录制文件
+        "评论",                    # 存放评论文件
+        "音频",                    # 存放下载的音频文件
+        "举报",                    # 存放举报相关文件
+        os.path.join("举报", "图片"),  # 存放举报附件图片
+        os.path.join("举报", "记录"),  # 存放举报记录
+    ]
+    
+    for directory in required_dirs:
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+                print(f"创建文件夹: {directory}")
+            except Exception as e:
+                print(f"创建文件夹 {directory} 时出错: {str(e)}")
+
+def main():
+    # 创建必要的文件夹
+    create_required_directories()
+    
+    # 检查cookies.txt是否存在
+    if not os.path.exists('cookies.txt'):  # 直接���查当前目录
+        print("错误：找���到cookies.txt��件！")
+        print("请确保cookies.txt文件存在且包含有效的cookies信息")
+        return
+    
+    # 加载cookies
+    cookies = load_cookies_from_file()
+    if not cookies:
+        print("��误：无法从cookies.txt加载有效的cookies")
+        return
+    
+    # 获取并显示用户信息
+    get_user_info(cookies)
+    
+    # 创建LiveRoom实例
+    live_room = LiveRoom(cookies)
+    
+    while True:
+        choice = show_menu()
+        
+        if choice == '1':
+            # 举报麦片
             show_maipi_menu(cookies)
         
         elif choice == '2':
@@ -975,6 +2349,25 @@ def main():
         
         elif choice == '4':
             # 下载视频音频
+            print("\n1. 逐个输入链接下载")
+            print("2. 批量下载bvid.txt中的视频（并发，无需确认）")
+            mode = input("请选择 [1]: ").strip()
+            print("\n下载方式：")
+            print("1. yt-dlp")
+            print("2. 直接下载最高音质伴音（不依赖yt-dlp，支持断点续传）")
+            backend = 'native' if input("请选择 [1]: ").strip() == '2' else 'auto'
+            if mode == '2':
+                workers = input("请输入同时下载数量 [4]: ").strip()
+                workers = int(workers) if workers.isdigit() and int(workers) > 0 else 4
+                limit_rate = input("请输入总带宽上限（如 8M，直接回车不限速）: ").strip()
+                output_format = input(f"下载后转换格式（{'/'.join(OUTPUT_FORMATS)}，直接回车不转换）: ").strip().lower()
+                try:
+                    batch_download_audio(cookies, 'bvid.txt', workers, limit_rate or None, backend=backend,
+                                         output_format=output_format or None)
+                except ValueError as e:
+                    print(str(e))
+                continue
+
             while True:
                 print("\n请输入B站视频URL或BV号 (输入q返回主菜单):")
                 input_text = input().strip()
@@ -984,7 +2377,7 @@ def main():
                     
                 # 如果输入的是BV号
                 if input_text.startswith('BV'):
-                    download_audio(input_text, cookies)
+                    download_audio(input_text, cookies, backend)
                     continue
                     
                 # 如果输���的是URL
@@ -992,7 +2385,7 @@ def main():
                     print("请输入有效的B站视频链接或BV号！")
                     continue
                     
-                download_audio(input_text, cookies)
+                download_audio(input_text, cookies, backend)
         
         elif choice == '5':
             # 获取视频BV号
@@ -1027,19 +2420,17 @@ def main():
                 
             if bvid:
                 try:
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                        'Referer': 'https://www.bilibili.com',
-                    }
-                    video_url = f'https://api.bilibili.com/x/web-interface/view?bvid={bvid}'
-                    response = requests.get(video_url, headers=headers)
-                    data = response.json()
+                    data = get_video_view(bvid)
                     if data['code'] == 0:
                         cid = data['data']['cid']
-                        segment = input("请输入要获取第几个6分钟段的弹幕 (1-n) [1]: ").strip()
+                        segment = input("请输入要获取第几个6分钟段的弹幕 (1-n，输入a获取全部) [1]: ").strip()
                         if not segment:
                             segment = "1"
-                        if segment.isdigit():
+                        if segment.lower() == 'a':
+                            pages = data['data'].get('pages') or []
+                            duration = pages[0]['duration'] if pages else data['data']['duration']
+                            get_danmaku(cid, bvid, 0, cookies, duration)
+                        elif segment.isdigit():
                             get_danmaku(cid, bvid, int(segment), cookies)  # 传入cookies参数
                         else:
                             print("请输入有效的数字！")
@@ -1122,13 +2513,14 @@ def main():
                     continue  # 继���显示直播菜单
                 
                 elif live_choice == '4':
-                    room_input = input("请输入直播间号或直播间链接: ").strip()
-                    live_room.get_room_base_info([room_input])
+                    room_input = input("请输入直播间号或直播间链接（多个用逗号或空格分隔）: ").strip()
+                    live_room.get_room_base_info(parse_id_list(room_input))
                     input("\n按回车继续...")  # 添加这一行
                     continue  # 继续显示直播菜单
                 
                 elif live_choice == '5':
-                    live_room.get_batch_live_status([room_input])
+                    uid_input = input("请输入主播UID（多个用逗号或空格分隔）: ").strip()
+                    live_room.get_batch_live_status(parse_id_list(uid_input))
                     input("\n按回车继续...")  # 添加���一行
                     continue  # 继续��示直播菜单
                 
@@ -1169,19 +2561,17 @@ def main():
                 
             if bvid:
                 try:
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                        'Referer': 'https://www.bilibili.com',
-                    }
-                    video_url = f'https://api.bilibili.com/x/web-interface/view?bvid={bvid}'
-                    response = requests.get(video_url, headers=headers)
-                    data = response.json()
+                    data = get_video_view(bvid)
                     if data['code'] == 0:
                         cid = data['data']['cid']
-                        segment = input("请输入要获取第几个6分钟段的弹幕 (1-n) [1]: ").strip()
+                        segment = input("请输入要获取第几个6分钟段的弹幕 (1-n，输入a获取全部) [1]: ").strip()
                         if not segment:
                             segment = "1"
-                        if segment.isdigit():
+                        if segment.lower() == 'a':
+                            pages = data['data'].get('pages') or []
+                            duration = pages[0]['duration'] if pages else data['data']['duration']
+                            get_danmaku(cid, bvid, 0, cookies, duration)
+                        elif segment.isdigit():
                             get_danmaku(cid, bvid, int(segment), cookies)  # 传入cookies参数
                         else:
                             print("请输入有效的数字！")
@@ -1259,28 +2649,107 @@ def main():
             print("\n感谢使用！再见！")
             break
 
+# BV号与AV号互转（算法见 docs/misc/bvid_desc.md），纯本地计算，不需要请求接口
+BV_XOR_CODE = 23442827791579
+BV_MASK_CODE = 2251799813685247
+BV_MAX_AID = 1 << 51
+BV_ALPHABET = 'FcwAPNKTMug3GV5Lj7EJnHpWsx4tb8haYeviqBz6rkCy12mUSDQX9RdoZf'
+BV_ENCODE_MAP = (8, 7, 0, 5, 1, 3, 2, 4, 6)
+# 解码查表：BV号第3位之后每个位置的 字符 -> 该字符在base58中的位值
+_BV_DECODE_TABLES = [None] * len(BV_ENCODE_MAP)
+for _i, _pos in enumerate(reversed(BV_ENCODE_MAP)):
+    _BV_DECODE_TABLES[_pos] = {c: idx * 58 ** (len(BV_ENCODE_MAP) - 1 - _i) for idx, c in enumerate(BV_ALPHABET)}
+del _i, _pos
+_BV_INVALID_DIGIT = 58 ** len(BV_ENCODE_MAP)
+
+def av2bv_many(aids: list) -> list:
+    """批量AV号转BV号：整列一起逐位取base58余数，无效的AV号（非正整数或超出范围）结果为None"""
+    tmps = []
+    for aid in aids:
+        try:
+            aid = int(aid)
+        except (TypeError, ValueError):
+            aid = 0
+        tmps.append((BV_MAX_AID | aid) ^ BV_XOR_CODE if 0 < aid < BV_MAX_AID else None)
+    codes = [[''] * len(BV_ENCODE_MAP) if tmp is not None else None for tmp in tmps]
+    for pos in BV_ENCODE_MAP:
+        for code, tmp in zip(codes, tmps):
+            if code is not None:
+                code[pos] = BV_ALPHABET[tmp % 58]
+        tmps = [tmp // 58 if tmp is not None else None for tmp in tmps]
+    return ['BV1' + ''.join(code) if code is not None else None for code in codes]
+
+def bv2av_many(bvids: list) -> list:
+    """批量BV号转AV号：每个位置对整列查一次解码表再累加，无效的BV号结果为None"""
+    bvids = [str(bvid) for bvid in bvids]
+    valid = [len(bvid) == 12 and bvid[:3].upper() == 'BV1' for bvid in bvids]
+    codes = [bvid[3:] for bvid, ok in zip(bvids, valid) if ok]
+    totals = [0] * len(codes)
+    for pos, table in enumerate(_BV_DECODE_TABLES):
+        # 不在字母表中的字符取一个比任何合法累加值都大的数，最后统一判为无效
+        totals = list(map(operator.add, totals, [table.get(code[pos], _BV_INVALID_DIGIT) for code in codes]))
+    aids = iter((total & BV_MASK_CODE) ^ BV_XOR_CODE if total < _BV_INVALID_DIGIT else None for total in totals)
+    return [next(aids) if ok else None for ok in valid]
+
+def av2bv(aid: int) -> str:
+    """AV号转BV号"""
+    bvid = av2bv_many([aid])[0]
+    if bvid is None:
+        raise ValueError(f"无效的AV号: {aid}")
+    return bvid
+
+def bv2av(bvid: str) -> int:
+    """BV号转AV号"""
+    aid = bv2av_many([bvid])[0]
+    if aid is None:
+        raise ValueError(f"无效的BV号: {bvid}")
+    return aid
+
+def convert_video_ids(ids: list) -> list:
+    """批量互转BV号和AV号，每项可以是BV号、av开头的AV号或纯数字
+    
+    BV号和AV号各自整列转换（bv2av_many/av2bv_many），再按原顺序组合结果。
+    
+    Returns:
+        list: (原始输入, 转换结果)，无法识别的输入结果为空字符串
+    """
+    texts = [str(raw).strip() for raw in ids]
+    is_bv = [text[:2].upper() == 'BV' for text in texts]
+    aids = iter(bv2av_many([text for text, bv in zip(texts, is_bv) if bv]))
+    bvids = iter(av2bv_many([text[2:] if text[:2].lower() == 'av' else text
+                             for text, bv in zip(texts, is_bv) if not bv]))
+    results = []
+    for text, bv in zip(texts, is_bv):
+        if bv:
+            aid = next(aids)
+            results.append((text, f"av{aid}" if aid is not None else ''))
+        else:
+            results.append((text, next(bvids) or ''))
+    return results
+
+def convert_video_ids_file(input_file: str, output_file: str = None) -> int:
+    """转换文件中的所有BV号/AV号（每行一个），结果写入output_file或直接打印
+    
+    Returns:
+        int: 无法识别的行数
+    """
+    with open(input_file, 'r', encoding='utf-8') as f:
+        ids = [line.strip() for line in f if line.strip()]
+    results = convert_video_ids(ids)
+    lines = [f"{src}\t{dst}" for src, dst in results]
+    if output_file:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        print(f"已转换 {len(results)} 个，结果保存到 {output_file}")
+    else:
+        print('\n'.join(lines))
+    return sum(1 for _, dst in results if not dst)
+
 def bv_to_av(bvid: str) -> str:
     """将BV号转换为AV号"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Referer': 'https://www.bilibili.com',
-    }
-    
     try:
-        # 使用B站API获取视信息
-        video_url = f'https://api.bilibili.com/x/web-interface/view?bvid={bvid}'
-        response = requests.get(video_url, headers=headers)
-        data = response.json()
-        
-        if data['code'] == 0:
-            # 从返回数据中获���aid（AV号）
-            av_number = data['data']['aid']
-            return str(av_number)  # 直接返回数字部分
-        else:
-            print(f"获取AV号失败：{data['message']}")
-            return ""
-            
-    except Exception as e:
+        return str(bv2av(bvid))  # 直接返回数字部分
+    except ValueError as e:
         print(f"转换过程出错: {str(e)}")
         return ""
 
@@ -1345,7 +2814,7 @@ def like_danmaku(dmid: str, oid: str, cookies: Dict) -> bool:
         
         # 发送点赞请求
         url = 'https://api.bilibili.com/x/v2/dm/thumbup/add'
-        response = requests.post(url, data=data, cookies=cookies, headers=headers)
+        response = http_post(url, data=data, cookies=cookies, headers=headers)
         result = response.json()
         
         if result['code'] == 0:
@@ -1369,106 +2838,784 @@ def like_danmaku(dmid: str, oid: str, cookies: Dict) -> bool:
         print(f"点赞弹幕时出错: {str(e)}")
         return False
 
-def get_danmaku(cid: str, bvid: str, segment_index: int = 1, cookies: Dict = None) -> None:
-    """获取视频弹幕"""
+DANMAKU_SEGMENT_SECONDS = 360  # seg.so每段包含6分钟的弹幕
+# 时长未知时连续遇到这么多个空分段才认为已到结尾（中间可能有较长的无弹幕片段）
+DANMAKU_MAX_EMPTY_SEGMENTS = 10
+
+_protobuf_backend_logged = False
+
+def protobuf_backend():
+    """返回当前protobuf使用的解析后端
+    
+    Returns:
+        str: 'upb'（protobuf>=4.21默认的C实现）、'cpp' 或 'python'（纯Python实现，解析大分段很慢）；
+             未安装protobuf时为None
+    """
     try:
-        import google.protobuf.text_format as text_format
-        from bilibili.community.service.dm.v1 import dm_pb2 as Danmaku
+        from google.protobuf.internal import api_implementation
+    except ImportError:
+        return None
+    return api_implementation.Type()
+
+def load_dm_pb2():
+    """导入弹幕protobuf定义，缺少依赖时打印安装提示并返回None"""
+    global _protobuf_backend_logged
+    try:
+        from bilibili.community.service.dm.v1 import dm_pb2
     except ImportError:
         print("错误：缺少必要的库，请先安装：")
         print("pip install protobuf")
         print("同时需要编译proto文件生成dm_pb2.py")
-        return
+        return None
+    if not _protobuf_backend_logged:
+        _protobuf_backend_logged = True
+        backend = protobuf_backend()
+        logger.debug(f"protobuf解析后端: {backend}")
+        if backend == 'python':
+            logger.warning("protobuf正在使用纯Python实现，解析弹幕较慢，"
+                           "建议升级: pip install -U protobuf（或取消PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION=python）")
+    return dm_pb2
+
+class DanmakuSegmentView:
+    """一个seg.so分段的只读列式视图
+    
+    upb/cpp后端解析后的字段仍保存在C结构中，只有被访问的字段才会转成Python对象。
+    只需要部分字段时用column/columns按列取值，不必为每条弹幕构造全部字段。
+    
+    用法:
+        view = fetch_danmaku_segment_view(cid, 1)
+        columns = view.columns('progress', 'content')
+    """
+    
+    def __init__(self, data: bytes, dm_pb2=None):
+        dm_pb2 = dm_pb2 or load_dm_pb2()
+        self._message = dm_pb2.DmSegMobileReply()
+        self._message.ParseFromString(data)
+        self._elems = self._message.elems
+        self._columns = {}
+    
+    def __len__(self) -> int:
+        return len(self._elems)
+    
+    def __iter__(self):
+        return iter(self._elems)
+    
+    def __getitem__(self, index):
+        return self._elems[index]
+    
+    def column(self, field: str) -> list:
+        """取一个字段的全部值，结果会缓存"""
+        if field not in self._columns:
+            self._columns[field] = [getattr(elem, field) for elem in self._elems]
+        return self._columns[field]
+    
+    def columns(self, *fields) -> dict:
+        """取多个字段，返回 字段名 -> 值列表"""
+        return {field: self.column(field) for field in (fields or DANMAKU_EXPORT_FIELDS)}
+    
+    def order(self) -> list:
+        """按(progress, id)排序后的下标"""
+        progress, ids = self.column('progress'), self.column('id')
+        return sorted(range(len(self._elems)), key=lambda i: (progress[i], ids[i]))
 
-    url = 'https://api.bilibili.com/x/v2/dm/web/seg.so'
+def fetch_danmaku_segment_view(cid, segment_index: int, dm_pb2=None) -> DanmakuSegmentView:
+    """获取单个6分钟分段的弹幕，返回列式视图
+    
+    Raises:
+        RuntimeError: 请求失败
+    """
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Referer': 'https://www.bilibili.com'
+    }
     params = {
-        'type': 1,              
-        'oid': cid,            
-        'segment_index': segment_index  
+        'type': 1,
+        'oid': cid,
+        'segment_index': segment_index
     }
+    resp = http_get('https://api.bilibili.com/x/v2/dm/web/seg.so', params=params, headers=headers)
+    if resp.status_code != 200:
+        raise RuntimeError(f"获取第{segment_index}段弹幕失败: HTTP {resp.status_code}")
+    return DanmakuSegmentView(resp.content, dm_pb2)
+
+def fetch_danmaku_segment(cid, segment_index: int, dm_pb2=None) -> list:
+    """获取单个6分钟分段的弹幕
+    
+    Returns:
+        list: DanmakuElem列表
+        
+    Raises:
+        RuntimeError: 请求失败
+    """
+    return list(fetch_danmaku_segment_view(cid, segment_index, dm_pb2))
+
+def iter_danmaku_segments(cid, duration: int, max_workers: int = 8, dm_pb2=None):
+    """按分段顺序逐段产出弹幕，分段并发获取
     
+    Args:
+        cid: 分P的cid
+        duration (int): 分P时长（秒），用于计算分段数；未知时传0，逐段获取直到连续
+            DANMAKU_MAX_EMPTY_SEGMENTS个空分段
+        max_workers (int): 同时请求的分段数
+        
+    Yields:
+        list: 每个分段的DanmakuElem列表（段内按progress排序）
+    """
+    dm_pb2 = dm_pb2 or load_dm_pb2()
+    sort_key = lambda elem: (elem.progress, elem.id)
+    if duration and duration > 0:
+        segment_count = max(1, -(-int(duration) // DANMAKU_SEGMENT_SECONDS))
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, segment_count))) as executor:
+            # map按提交顺序返回结果，后面的分段可以先下载完，等前面的分段写出后再产出
+            for elems in executor.map(lambda index: fetch_danmaku_segment(cid, index, dm_pb2),
+                                      range(1, segment_count + 1)):
+                yield sorted(elems, key=sort_key)
+    else:
+        segment_index = 1
+        empty_run = 0
+        while empty_run < DANMAKU_MAX_EMPTY_SEGMENTS:
+            elems = fetch_danmaku_segment(cid, segment_index, dm_pb2)
+            segment_index += 1
+            if not elems:
+                empty_run += 1
+                continue
+            # 中间的空分段照常产出，结尾的空分段不产出
+            for _ in range(empty_run):
+                yield []
+            empty_run = 0
+            yield sorted(elems, key=sort_key)
+
+def fetch_all_danmaku(cid, duration: int, max_workers: int = 8, dm_pb2=None) -> list:
+    """并发获取整个视频（分P）所有分段的弹幕，按出现时间合并
+    
+    Args:
+        cid: 分P的cid
+        duration (int): 分P时长（秒），用于计算分段数；未知时传0，见iter_danmaku_segments
+        max_workers (int): 同时请求的分段数
+        
+    Returns:
+        list: 按progress排序、按弹幕ID去重后的DanmakuElem列表
+    """
+    merged = {}
+    for elems in iter_danmaku_segments(cid, duration, max_workers, dm_pb2):
+        for elem in elems:
+            merged[elem.id] = elem
+    return sorted(merged.values(), key=lambda elem: (elem.progress, elem.id))
+
+def fetch_danmaku_columns(cid, duration: int, fields=('progress', 'content'), max_workers: int = 8,
+                          dm_pb2=None) -> dict:
+    """并发获取整个分P的弹幕，只取需要的字段，按出现时间排列
+    
+    Args:
+        cid: 分P的cid
+        duration (int): 分P时长（秒），需大于0
+        fields: 需要的字段名
+        max_workers (int): 同时请求的分段数
+        
+    Returns:
+        dict: 字段名 -> 值列表
+    """
+    dm_pb2 = dm_pb2 or load_dm_pb2()
+    fields = list(fields)
+    segment_count = max(1, -(-int(duration) // DANMAKU_SEGMENT_SECONDS))
+    merged = {field: [] for field in fields}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, segment_count))) as executor:
+        for view in executor.map(lambda index: fetch_danmaku_segment_view(cid, index, dm_pb2),
+                                 range(1, segment_count + 1)):
+            order = view.order()
+            for field, values in view.columns(*fields).items():
+                merged[field].extend(values[i] for i in order)
+    return merged
+
+# 导出的弹幕字段，与DanmakuElem字段同名
+DANMAKU_EXPORT_FIELDS = ['id', 'progress', 'mode', 'fontsize', 'color', 'midHash', 'content', 'ctime', 'weight', 'pool']
+DANMAKU_EXPORT_FORMATS = ['jsonl', 'csv', 'parquet']
+DANMAKU_ARROW_SCHEMA = pa.schema([
+    ('id', pa.int64()), ('progress', pa.int32()), ('mode', pa.int32()), ('fontsize', pa.int32()),
+    ('color', pa.uint32()), ('midHash', pa.string()), ('content', pa.string()), ('ctime', pa.int64()),
+    ('weight', pa.int32()), ('pool', pa.int32()),
+]) if pa is not None else None
+
+def danmaku_columns(elems: list) -> dict:
+    """把DanmakuElem列表转成按字段存放的列"""
+    return {field: [getattr(elem, field) for elem in elems] for field in DANMAKU_EXPORT_FIELDS}
+
+# 旧版XML弹幕接口返回的弹幕，字段与DanmakuElem同名，可直接交给导出和ASS转换
+DanmakuRecord = namedtuple('DanmakuRecord', DANMAKU_EXPORT_FIELDS)
+
+def parse_danmaku_xml(content: bytes):
+    """逐条解析list.so返回的XML弹幕
+    
+    <d p="出现时间(秒),模式,字号,颜色,发送时间,弹幕池,发送者midHash,弹幕ID,屏蔽等级">内容</d>
+    
+    Yields:
+        DanmakuRecord: 一条弹幕
+    """
+    if not content.lstrip().startswith(b'<'):
+        # 接口返回的是不带zlib头的deflate数据，requests没有自动解压时手动解压
+        content = zlib.decompress(content, -zlib.MAX_WBITS)
+    for _, node in ET.iterparse(io.BytesIO(content)):
+        if node.tag != 'd':
+            continue
+        attrs = node.get('p', '').split(',')
+        if len(attrs) >= 8:
+            yield DanmakuRecord(
+                id=int(attrs[7]),
+                progress=int(float(attrs[0]) * 1000),
+                mode=int(attrs[1]),
+                fontsize=int(attrs[2]),
+                color=int(attrs[3]),
+                midHash=attrs[6],
+                content=node.text or '',
+                ctime=int(attrs[4]),
+                weight=int(attrs[8]) if len(attrs) > 8 and attrs[8] else 0,
+                pool=int(attrs[5]),
+            )
+        node.clear()
+
+def fetch_danmaku_xml(cid) -> list:
+    """通过旧版XML接口一次性获取弹幕，不依赖protobuf
+    
+    接口只返回当前弹幕池中的一部分（数量受视频弹幕上限限制），适合作为seg.so的后备。
+    
+    Returns:
+        list: 按progress排序的DanmakuRecord列表
+        
+    Raises:
+        RuntimeError: 请求失败
+    """
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
         'Referer': 'https://www.bilibili.com'
     }
+    resp = http_get('https://api.bilibili.com/x/v1/dm/list.so', params={'oid': cid}, headers=headers)
+    if resp.status_code != 200:
+        raise RuntimeError(f"获取XML弹幕失败: HTTP {resp.status_code}")
+    try:
+        elems = list(parse_danmaku_xml(resp.content))
+    except (ET.ParseError, zlib.error) as e:
+        raise RuntimeError(f"解析XML弹幕失败: {str(e)}")
+    return sorted(elems, key=lambda elem: (elem.progress, elem.id))
+
+class RowWriter:
+    """把行数据流式写入JSONL/CSV文件，弹幕和评论导出共用
+    
+    文件始终以二进制方式打开并按UTF-8编码写出，CSV只在新建文件时写入BOM和表头，
+    续写时截断到指定长度后接着写，保证两种导出的编码和BOM处理一致。
+    """
+    
+    def __init__(self, filepath: str, fmt: str, fields: list, resume_size: int = None):
+        """
+        Args:
+            filepath (str): 输出文件
+            fmt (str): jsonl或csv
+            fields (list): 列名，也是每行数据的顺序
+            resume_size (int): 续写已有文件，先截断到该长度丢掉写了一半的内容；None或0表示新建
+        """
+        if fmt not in ('jsonl', 'csv'):
+            raise ValueError(f"不支持的行格式: {fmt}")
+        self.fmt = fmt
+        self.fields = list(fields)
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if resume_size:
+            self._file = open(filepath, 'r+b')
+            self._file.truncate(resume_size)
+            self._file.seek(resume_size)
+        else:
+            self._file = open(filepath, 'wb')
+            if fmt == 'csv':
+                # BOM让Excel能正确识别CSV中的中文
+                self._file.write(codecs.BOM_UTF8)
+                self.write_rows([self.fields])
+    
+    def write_rows(self, rows) -> None:
+        """写入一批行（与fields同序的序列），整批格式化后一次写出"""
+        if self.fmt == 'csv':
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            data = buffer.getvalue()
+        else:
+            data = ''.join(json.dumps(dict(zip(self.fields, row)), ensure_ascii=False) + '\n' for row in rows)
+        self._file.write(data.encode('utf-8'))
+    
+    def position(self) -> int:
+        """已写入的文件长度"""
+        self._file.flush()
+        return self._file.tell()
+    
+    def flush(self) -> None:
+        """把已写入的内容落盘"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+    
+    def close(self) -> None:
+        self._file.close()
+
+class DanmakuExporter:
+    """把弹幕逐段写入JSONL/CSV/Parquet文件，每个分段先在内存中组成列再一次性写出
+    
+    用法:
+        with DanmakuExporter('弹幕/BVxxx.csv') as exporter:
+            for elems in iter_danmaku_segments(cid, duration):
+                exporter.write(elems)
+    """
+    
+    def __init__(self, filepath: str, fmt: str = None, append: bool = False):
+        self.filepath = filepath
+        self.fmt = (fmt or os.path.splitext(filepath)[1].lstrip('.')).lower()
+        self.append = append
+        if self.fmt not in DANMAKU_EXPORT_FORMATS:
+            raise ValueError(f"不支持的导出格式: {self.fmt}，可选 {'/'.join(DANMAKU_EXPORT_FORMATS)}")
+        if self.fmt == 'parquet' and pa is None:
+            raise ValueError("导出Parquet需要安装pyarrow: pip install pyarrow")
+        if self.fmt == 'parquet' and append:
+            raise ValueError("Parquet文件不支持追加写入")
+        self.count = 0
+        self._rows = None
+        self._writer = None
+    
+    def __enter__(self):
+        if self.fmt == 'parquet':
+            directory = os.path.dirname(self.filepath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._writer = pq.ParquetWriter(self.filepath, DANMAKU_ARROW_SCHEMA)
+        else:
+            resume_size = os.path.getsize(self.filepath) if self.append and os.path.exists(self.filepath) else None
+            self._rows = RowWriter(self.filepath, self.fmt, DANMAKU_EXPORT_FIELDS, resume_size)
+        return self
+    
+    def write(self, elems: list) -> None:
+        """写入一个分段的弹幕"""
+        if not elems:
+            return
+        columns = danmaku_columns(elems)
+        if self.fmt == 'parquet':
+            self._writer.write_table(pa.table(columns, schema=DANMAKU_ARROW_SCHEMA))
+        else:
+            self._rows.write_rows(zip(*(columns[field] for field in DANMAKU_EXPORT_FIELDS)))
+        self.count += len(elems)
+    
+    def flush(self) -> None:
+        """把已写入的弹幕落盘（Parquet的行组在关闭时才完整，不支持）"""
+        if self._rows is not None:
+            self._rows.flush()
+    
+    def __exit__(self, exc_type, exc, tb):
+        if self._writer is not None:
+            self._writer.close()
+        if self._rows is not None:
+            self._rows.close()
+
+# ASS字幕参数，字号按B站默认的25号字缩放
+ASS_DEFAULTS = {
+    'width': 1920,
+    'height': 1080,
+    'font_name': 'Microsoft YaHei',
+    'font_size': 48,
+    'scroll_duration': 8.0,   # 滚动弹幕从右边进入到完全离开左边的时间（秒）
+    'static_duration': 4.0,   # 顶部/底部弹幕停留时间（秒）
+    'area': 0.8,              # 弹幕可占用的屏幕高度比例
+    'alpha': 0.2,             # 透明度，0为不透明
+}
+
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: {width}
+PlayResY: {height}
+WrapStyle: 2
+ScaledBorderAndShadow: yes
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Danmaku,{font_name},{font_size},&H{alpha:02X}FFFFFF,&H{alpha:02X}FFFFFF,&H{alpha:02X}000000,&H{alpha:02X}000000,0,0,0,0,100,100,0,0,1,1,0,7,0,0,0,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+def format_ass_time(seconds: float) -> str:
+    """秒数转为ASS时间 h:mm:ss.cc"""
+    centiseconds = int(round(max(seconds, 0) * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    return f"{hours}:{minutes:02d}:{centiseconds // 100:02d}.{centiseconds % 100:02d}"
+
+def estimate_text_width(text: str, font_size: float) -> float:
+    """估算文字渲染宽度，全角字符按一个字号宽，半角按一半"""
+    return sum(font_size if unicodedata.east_asian_width(ch) in 'WF' else font_size / 2 for ch in text)
+
+def escape_ass_text(text: str) -> str:
+    """转义ASS特殊字符，弹幕中的换行转为\\N"""
+    return (text.replace('\\', '\\\\').replace('{', '\\{').replace('}', '\\}')
+                .replace('\r', '').replace('\n', '\\N'))
+
+def iter_ass_events(elems, **options):
+    """把按progress排序的弹幕逐条转换为ASS事件行
+    
+    滚动弹幕按“前一条已完全进入屏幕、且新弹幕追上之前前一条已离开”的规则分配轨道，
+    顶部/底部弹幕按停留时间分配轨道；没有空闲轨道的弹幕直接丢弃，不会互相重叠。
+    只保存每条轨道的占用时间，elems可以是迭代器，内存占用与弹幕总数无关。
+    
+    Args:
+        elems: DanmakuElem或DanmakuRecord的可迭代对象，需按progress升序
+        **options: 覆盖ASS_DEFAULTS中的参数
+        
+    Yields:
+        str: Dialogue行（不含换行符）
+    """
+    opts = {**ASS_DEFAULTS, **options}
+    width, height = opts['width'], opts['height']
+    base_size = opts['font_size']
+    lane_count = max(1, int(height * opts['area'] // base_size))
+    # 滚动轨道记录(完全进入屏幕的时间, 离开屏幕的时间)，静止轨道记录消失时间
+    scroll_lanes = [(0.0, 0.0)] * lane_count
+    top_lanes = [0.0] * lane_count
+    bottom_lanes = [0.0] * lane_count
+    
+    def find_lanes(span, is_free):
+        for start in range(lane_count - span + 1):
+            if all(is_free(lane) for lane in range(start, start + span)):
+                return start
+        return None
+    
+    for elem in elems:
+        if elem.mode not in (1, 2, 3, 4, 5) or not elem.content:
+            continue  # 逆向、高级、代码和BAS弹幕无法用普通字幕表示
+        text = escape_ass_text(elem.content)
+        start = elem.progress / 1000
+        size = round(base_size * (elem.fontsize or 25) / 25)
+        span = max(1, -(-int(size) // int(base_size)))
+        text_width = estimate_text_width(elem.content, size)
+        color = elem.color & 0xFFFFFF
+        style = f"\\c&H{color & 0xFF:02X}{(color >> 8) & 0xFF:02X}{color >> 16:02X}&" if color != 0xFFFFFF else ""
+        if size != base_size:
+            style += f"\\fs{size:g}"
+        
+        if elem.mode in (1, 2, 3):
+            duration = opts['scroll_duration']
+            speed = (width + text_width) / duration
+            entered, reach_left = start + text_width / speed, start + width / speed
+            lane = find_lanes(span, lambda i: scroll_lanes[i][0] <= start and scroll_lanes[i][1] <= reach_left)
+            if lane is None:
+                continue
+            for i in range(lane, lane + span):
+                scroll_lanes[i] = (entered, start + duration)
+            y = lane * base_size
+            effect = f"{{\\an7\\move({width},{y:g},{-text_width:g},{y:g}){style}}}"
+        else:
+            duration = opts['static_duration']
+            lanes = top_lanes if elem.mode == 5 else bottom_lanes
+            lane = find_lanes(span, lambda i: lanes[i] <= start)
+            if lane is None:
+                continue
+            for i in range(lane, lane + span):
+                lanes[i] = start + duration
+            if elem.mode == 5:
+                effect = f"{{\\an8\\pos({width // 2},{lane * base_size:g}){style}}}"
+            else:
+                effect = f"{{\\an2\\pos({width // 2},{height - lane * base_size:g}){style}}}"
+        yield (f"Dialogue: 0,{format_ass_time(start)},{format_ass_time(start + duration)},"
+               f"Danmaku,,0,0,0,,{effect}{text}")
+
+def write_danmaku_ass(elems, filepath: str, **options) -> int:
+    """把弹幕流式写成ASS字幕文件
+    
+    Args:
+        elems: DanmakuElem或DanmakuRecord的可迭代对象，需按progress升序
+        filepath (str): 输出文件路径
+        **options: 覆盖ASS_DEFAULTS中的参数
+        
+    Returns:
+        int: 写入的弹幕条数（不含因无空闲轨道被丢弃的）
+    """
+    opts = {**ASS_DEFAULTS, **options}
+    directory = os.path.dirname(filepath)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    count = 0
+    # utf-8-sig让部分播放器正确识别中文
+    with open(filepath, 'w', encoding='utf-8-sig') as f:
+        f.write(ASS_HEADER.format(**{**opts, 'alpha': int(opts['alpha'] * 255)}))
+        for line in iter_ass_events(elems, **opts):
+            f.write(line + '\n')
+            count += 1
+    return count
+
+def export_danmaku(bvid: str, page: int = 1, output_file: str = None, fmt: str = None,
+                   max_workers: int = 8, use_xml: bool = False) -> tuple:
+    """无交互导出某个分P的全部弹幕
+    
+    Args:
+        bvid (str): BV号
+        page (int): 分P编号
+        output_file (str): 输出文件，默认 弹幕/{bvid}_P{page}.{格式}
+        fmt (str): jsonl/csv/parquet/ass，默认按输出文件扩展名判断，都没有时为jsonl
+        max_workers (int): 同时请求的分段数
+        use_xml (bool): 使用旧版XML接口一次性获取；未安装protobuf时自动使用
+        
+    Returns:
+        tuple: (导出的弹幕条数, 输出文件路径)
+    """
+    dm_pb2 = None if use_xml else load_dm_pb2()
+    if dm_pb2 is None and not use_xml:
+        logger.warning("缺少protobuf或dm_pb2，改用XML接口获取弹幕")
+    
+    data = get_video_view(bvid)
+    if data['code'] != 0:
+        raise RuntimeError(f"获取视频信息失败：{data['message']}")
+    pages = data['data'].get('pages') or [{'cid': data['data']['cid'], 'duration': data['data']['duration']}]
+    if not 1 <= page <= len(pages):
+        raise ValueError(f"分P编号超出范围: P{page}")
+    cid, duration = pages[page - 1]['cid'], pages[page - 1]['duration']
+    
+    if not output_file:
+        output_file = os.path.join("弹幕", f"{bvid}_P{page}.{fmt or 'jsonl'}")
+    elif not fmt and not os.path.splitext(output_file)[1]:
+        fmt = 'jsonl'
+    
+    if dm_pb2 is None:
+        segments = [fetch_danmaku_xml(cid)]
+    else:
+        segments = iter_danmaku_segments(cid, duration, max_workers, dm_pb2)
+    
+    if (fmt or os.path.splitext(output_file)[1].lstrip('.')).lower() == 'ass':
+        # 各分段按时间先后产出、段内已排序，拼起来仍然有序，可以边下载边写
+        return write_danmaku_ass(chain.from_iterable(segments), output_file), output_file
+    
+    with DanmakuExporter(output_file, fmt) as exporter:
+        for elems in segments:
+            exporter.write(elems)
+    return exporter.count, output_file
+
+DANMAKU_SYNC_DIR = os.path.join("弹幕", "同步")
+
+class DanmakuSyncIndex:
+    """某个cid已同步弹幕的ID索引
+    
+    ID保存在有序的int64数组中（{cid}.idx，每个ID占8字节），另记录已见过的最新发送时间。
+    发送时间晚于最新时间的弹幕一定是新的，其余的二分查找确认。
+    """
+    
+    def __init__(self, cid, directory: str = DANMAKU_SYNC_DIR):
+        self.cid = cid
+        self.index_file = os.path.join(directory, f"{cid}.idx")
+        self.meta_file = os.path.join(directory, f"{cid}.json")
+        self.ids = array('q')
+        self.latest_ctime = 0
+        self.meta = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'rb') as f:
+                self.ids.frombytes(f.read())
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+            self.latest_ctime = self.meta.get('latest_ctime', 0)
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def __contains__(self, dmid: int) -> bool:
+        i = bisect.bisect_left(self.ids, dmid)
+        return i < len(self.ids) and self.ids[i] == dmid
+    
+    def filter_new(self, elems: list) -> list:
+        """筛选出索引中没有的弹幕"""
+        seen = set()
+        new_elems = []
+        for elem in elems:
+            if elem.id in seen:
+                continue
+            if elem.ctime > self.latest_ctime or elem.id not in self:
+                seen.add(elem.id)
+                new_elems.append(elem)
+        return new_elems
+    
+    def add(self, elems: list) -> None:
+        """把弹幕ID合并进索引"""
+        if not elems:
+            return
+        new_ids = sorted(elem.id for elem in elems)
+        self.ids = array('q', heapq.merge(self.ids, new_ids))
+        self.latest_ctime = max(self.latest_ctime, max(elem.ctime for elem in elems))
+    
+    def save(self, **meta) -> None:
+        """写入索引文件，先写临时文件再替换，中断时不会留下损坏的索引"""
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+        self.meta.update(meta, cid=self.cid, latest_ctime=self.latest_ctime, count=len(self.ids),
+                         synced_at=int(time.time()))
+        for path, data, mode in ((self.index_file, self.ids.tobytes(), 'wb'),
+                                 (self.meta_file, json.dumps(self.meta, ensure_ascii=False, indent=2), 'w')):
+            temp_file = path + '.tmp'
+            with open(temp_file, mode, **({} if mode == 'wb' else {'encoding': 'utf-8'})) as f:
+                f.write(data)
+            os.replace(temp_file, path)
+
+def sync_danmaku(bvid: str, fmt: str = 'jsonl', directory: str = DANMAKU_SYNC_DIR, max_workers: int = 8) -> dict:
+    """增量同步视频所有分P的弹幕，只把新出现的弹幕追加到 {目录}/{bvid}_P{分P}.{格式}
+    
+    Returns:
+        dict: 分P编号 -> 新增弹幕条数
+    """
+    if fmt not in ('jsonl', 'csv'):
+        raise ValueError("增量同步只支持追加写入的jsonl或csv格式")
+    dm_pb2 = load_dm_pb2()
+    if dm_pb2 is None:
+        raise RuntimeError("缺少protobuf或dm_pb2，无法解析弹幕")
+    
+    data = get_video_view(bvid)
+    if data['code'] != 0:
+        raise RuntimeError(f"获取视频信息失败：{data['message']}")
+    pages = data['data'].get('pages') or [{'page': 1, 'cid': data['data']['cid'],
+                                             'duration': data['data']['duration']}]
+    
+    added = {}
+    for page in pages:
+        index = DanmakuSyncIndex(page['cid'], directory)
+        output_file = os.path.join(directory, f"{bvid}_P{page['page']}.{fmt}")
+        meta = {'bvid': bvid, 'page': page['page'], 'file': output_file}
+        with DanmakuExporter(output_file, fmt, append=True) as exporter:
+            for elems in iter_danmaku_segments(page['cid'], page['duration'], max_workers, dm_pb2):
+                new_elems = index.filter_new(elems)
+                if not new_elems:
+                    continue
+                # 每个分段先把弹幕写到磁盘再保存索引：中断后重新同步不会把已写入的弹幕再追加一遍
+                exporter.write(new_elems)
+                exporter.flush()
+                index.add(new_elems)
+                index.save(**meta)
+        index.save(**meta)
+        added[page['page']] = exporter.count
+    return added
+
+def sync_danmaku_batch(bvids: list, fmt: str = 'jsonl', directory: str = DANMAKU_SYNC_DIR,
+                       max_workers: int = 8) -> int:
+    """依次增量同步多个视频的弹幕并打印汇总
+    
+    Returns:
+        int: 同步失败的视频数
+    """
+    failed = 0
+    total_added = 0
+    for bvid in tqdm(bvids, desc="同步弹幕", ncols=80):
+        try:
+            added = sync_danmaku(bvid, fmt, directory, max_workers)
+        except (RuntimeError, ValueError, requests.RequestException) as e:
+            tqdm.write(f"❌ {bvid}: {str(e)}")
+            failed += 1
+            continue
+        total_added += sum(added.values())
+        tqdm.write(f"✅ {bvid}: 新增 {sum(added.values())} 条" +
+                   (f" ({', '.join(f'P{p}: {n}' for p, n in added.items())})" if len(added) > 1 else ""))
+    print(f"\n同步完成，共新增 {total_added} 条弹幕，失败 {failed} 个，文件保存在 {directory}")
+    return failed
+
+def get_danmaku(cid: str, bvid: str, segment_index: int = 1, cookies: Dict = None, duration: int = 0) -> None:
+    """获取视频弹幕
+    
+    Args:
+        cid (str): 分P的cid
+        bvid (str): BV号，用于保存文件名
+        segment_index (int): 第几个6分钟分段，0表示并发获取全部分段并按时间合并
+        cookies (Dict): cookies信息，点赞弹幕时需要
+        duration (int): 分P时长（秒），获取全部分段时用于计算分段数
+    """
+    dm_pb2 = load_dm_pb2()
+    if dm_pb2 is None and segment_index != 0:
+        return
 
     try:
-        resp = requests.get(url, params=params, headers=headers)
-        if resp.status_code == 200:
-            danmaku_seg = Danmaku.DmSegMobileReply()
-            danmaku_seg.ParseFromString(resp.content)
-            
-            danmaku_list = []
+        if segment_index == 0:
+            start_time = time.time()
+            try:
+                if dm_pb2 is None:
+                    raise RuntimeError("缺少protobuf")
+                elems = fetch_all_danmaku(cid, duration, dm_pb2=dm_pb2)
+            except RuntimeError as e:
+                # 分段接口不可用时，用XML接口一次请求拿到弹幕池中的弹幕
+                print(f"分段接口获取失败（{str(e)}），改用XML接口获取")
+                elems = fetch_danmaku_xml(cid)
+            print(f"\n获取到全部 {len(elems)} 条弹幕，用时 {time.time() - start_time:.1f} 秒")
+        else:
+            elems = fetch_danmaku_segment(cid, segment_index, dm_pb2)
+            print(f"\n获取到 {len(elems)} 条弹幕:")
+        print("-" * 50)
+        
+        danmaku_list = []
+        
+        for elem in elems:
+            seconds = elem.progress / 1000
+            minutes = int(seconds / 60)
+            seconds = int(seconds % 60)
+            
+            mode_types = {
+                1: "普通弹幕",
+                2: "普通弹幕",
+                3: "普通弹幕",
+                4: "底部弹幕",
+                5: "顶部弹幕",
+                6: "逆向弹幕",
+                7: "高级弹幕",
+                8: "代码弹幕",
+                9: "BAS弹幕"
+            }
+            mode_type = mode_types.get(elem.mode, "未知类型")
+            
+            hex_color = f"#{elem.color:06x}"
+            color_name = get_color_name(hex_color)
+            
+            danmaku_info = (
+                f"时间: {minutes:02d}:{seconds:02d}\n"
+                f"内容: {elem.content}\n"
+                f"类型: {mode_type}\n"
+                f"颜色: {color_name} ({hex_color})\n"
+                f"字号: {elem.fontsize}\n"
+                f"发送时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(elem.ctime))}\n"
+                f"弹幕ID: {elem.id}\n"  # 添加弹幕ID显示
+                f"{'-' * 50}"
+            )
             
-            print(f"\n获取到 {len(danmaku_seg.elems)} 条弹�����:")
-            print("-" * 50)
+            # 只打印一次弹幕信息
+            print(danmaku_info)
             
-            for elem in danmaku_seg.elems:
-                seconds = elem.progress / 1000
-                minutes = int(seconds / 60)
-                seconds = int(seconds % 60)
-                
-                mode_types = {
-                    1: "普通弹幕",
-                    2: "普通弹幕",
-                    3: "普通弹幕",
-                    4: "底部弹幕",
-                    5: "顶部弹幕",
-                    6: "逆向弹幕",
-                    7: "高级弹幕",
-                    8: "代码弹幕",
-                    9: "BAS弹幕"
-                }
-                mode_type = mode_types.get(elem.mode, "未知类型")
-                
-                hex_color = f"#{elem.color:06x}"
-                color_name = get_color_name(hex_color)
-                
-                danmaku_info = (
-                    f"时间: {minutes:02d}:{seconds:02d}\n"
-                    f"内容: {elem.content}\n"
-                    f"类型: {mode_type}\n"
-                    f"颜色: {color_name} ({hex_color})\n"
-                    f"字号: {elem.fontsize}\n"
-                    f"发送时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(elem.ctime))}\n"
-                    f"弹幕ID: {elem.id}\n"  # 添加弹幕ID显示
-                    f"{'-' * 50}"
-                )
-                
-                # 只打印一次弹幕信息
-                print(danmaku_info)
-                
-                # 询问是否点赞
+            # 询问是否点赞（获取全部分段时弹幕太多，不再逐条询问）
+            if segment_index != 0:
                 choice = input("是否点赞该弹幕？(y/n) [n]: ").lower()
                 if choice == 'y':
                     like_danmaku(str(elem.id), cid, cookies)
-                
-                danmaku_list.append(danmaku_info)
             
-            # 询问是否保存到文件
-            if danmaku_list:
-                choice = input("\n是否保存弹幕到文本文件？(y/n) [y]: ").lower()
-                if not choice or choice == 'y':
-                    danmaku_dir = "弹幕"
-                    if not os.path.exists(danmaku_dir):
-                        os.makedirs(danmaku_dir)
-                    
-                    filename = f"{bvid} {time.strftime('%Y-%m-%d %H-%M-%S', time.localtime())} 弹��.txt"
-                    filepath = os.path.join(danmaku_dir, filename)
-                    
-                    try:
-                        with open(filepath, 'w', encoding='utf-8') as f:
-                            f.write('\n'.join(danmaku_list))
-                        print(f"弹幕已保存到文件: {filepath}")
-                    except Exception as e:
-                        print(f"保存文件时出错: {str(e)}")
+            danmaku_list.append(danmaku_info)
+        
+        # 询问是否保存到文件
+        if danmaku_list:
+            choice = input("\n是否保存弹幕到文本文件？(y/n) [y]: ").lower()
+            if not choice or choice == 'y':
+                danmaku_dir = "弹幕"
+                if not os.path.exists(danmaku_dir):
+                    os.makedirs(danmaku_dir)
                 
-        else:
-            print(f"获取弹幕失败: HTTP {resp.status_code}")
+                filename = f"{bvid} {time.strftime('%Y-%m-%d %H-%M-%S', time.localtime())} 弹幕.txt"
+                filepath = os.path.join(danmaku_dir, filename)
+                
+                try:
+                    with open(filepath, 'w', encoding='utf-8') as f:
+                        f.write('\n'.join(danmaku_list))
+                    print(f"弹幕已保存到文件: {filepath}")
+                except Exception as e:
+                    print(f"保存文件时出错: {str(e)}")
+            
+            if segment_index == 0:
+                choice = input("是否同时保存为ASS字幕？(y/n) [n]: ").lower()
+                if choice == 'y':
+                    filepath = os.path.join("弹幕", f"{bvid}_{cid}.ass")
+                    count = write_danmaku_ass(elems, filepath)
+                    print(f"ASS字幕已保存到文件: {filepath}（{count}/{len(elems)} 条，其余因屏幕已满被省略）")
             
     except Exception as e:
         print(f"获取弹幕时出错: {str(e)}")
-        print("���误详细信息:")
+        print("错误详细信息:")
         import traceback
         traceback.print_exc()
 
@@ -1480,18 +3627,15 @@ def get_comment_count(bvid: str) -> int:
     }
     
     try:
-        # 获取视频aid
-        video_url = f'https://api.bilibili.com/x/web-interface/view?bvid={bvid}'
-        response = requests.get(video_url, headers=headers)
-        data = response.json()
+        # 由BV号直接算出aid
+        aid = bv2av(bvid)
         
-        if data['code'] == 0:
-            aid = data['data']['aid']
+        if aid:
             
             # 获取评论总数
             count_url = 'https://api.bilibili.com/x/v2/reply/count'
             params = {'type': 1, 'oid': aid}
-            count_response = requests.get(count_url, params=params, headers=headers)
+            count_response = http_get(count_url, params=params, headers=headers)
             count_data = count_response.json()
             
             return count_data['data']['count'] if count_data['code'] == 0 else 0
@@ -1500,6 +3644,116 @@ def get_comment_count(bvid: str) -> int:
     except:
         return 0
 
+# 评论导出字段：rpid为评论ID，root为所属主评论ID，parent为回复的评论ID，主评论的root/parent为0
+COMMENT_FIELDS = ['rpid', 'root', 'parent', 'oid', 'mid', 'uname', 'level', 'like', 'rcount', 'ctime', 'message']
+
+# 评论区排序方式：热度 / 时间
+COMMENT_SORT_MODES = {'hot': 3, 'time': 2}
+
+def comment_record(reply: dict) -> dict:
+    """把接口返回的一条评论整理为COMMENT_FIELDS字段"""
+    member = reply.get('member') or {}
+    return {
+        'rpid': reply['rpid'],
+        'root': reply.get('root', 0),
+        'parent': reply.get('parent', 0),
+        'oid': reply.get('oid', 0),
+        'mid': reply.get('mid') or int(member.get('mid') or 0),
+        'uname': member.get('uname', ''),
+        'level': (member.get('level_info') or {}).get('current_level', 0),
+        'like': reply.get('like', 0),
+        'rcount': reply.get('rcount', 0),
+        'ctime': reply.get('ctime', 0),
+        'message': (reply.get('content') or {}).get('message', ''),
+    }
+
+COMMENT_EXPORT_FORMATS = ['jsonl', 'csv', 'sqlite']
+
+class CommentExporter:
+    """把评论记录逐批写入JSONL/CSV/SQLite
+    
+    每批记录只格式化一次，通过同一个带缓冲的文件句柄（或一个SQLite事务）写出，
+    不在内存中保留已写出的评论，评论数量不受限制。SQLite按rpid去重写入。
+    
+    用法:
+        with CommentExporter('评论/BVxxx.csv') as exporter:
+            exporter.write(records)
+    """
+    
+    def __init__(self, filepath: str, fmt: str = None, resume_size: int = None):
+        """
+        Args:
+            filepath (str): 输出文件
+            fmt (str): jsonl/csv/sqlite，默认按扩展名判断（.db也视为sqlite）
+            resume_size (int): 续写已有文件，先截断到该长度丢掉写了一半的内容；None表示新建
+        """
+        self.filepath = filepath
+        ext = os.path.splitext(filepath)[1].lstrip('.').lower()
+        self.fmt = (fmt or ('sqlite' if ext == 'db' else ext)).lower()
+        if self.fmt not in COMMENT_EXPORT_FORMATS:
+            raise ValueError(f"不支持的导出格式: {self.fmt}，可选 {'/'.join(COMMENT_EXPORT_FORMATS)}")
+        self.resume_size = resume_size
+        self.count = 0
+        self._rows = None
+        self._conn = None
+    
+    def __enter__(self):
+        if self.fmt == 'sqlite':
+            directory = os.path.dirname(self.filepath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if self.resume_size is None and os.path.exists(self.filepath):
+                os.remove(self.filepath)
+            self._conn = sqlite3.connect(self.filepath)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS comments ('
+                'rpid INTEGER PRIMARY KEY, root INTEGER, parent INTEGER, oid INTEGER, mid INTEGER, '
+                'uname TEXT, level INTEGER, "like" INTEGER, rcount INTEGER, ctime INTEGER, message TEXT)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_comments_root ON comments(root)')
+        else:
+            self._rows = RowWriter(self.filepath, self.fmt, COMMENT_FIELDS, self.resume_size)
+        return self
+    
+    def write(self, records: list) -> None:
+        """写入一批评论记录（comment_record的结果）"""
+        if not records:
+            return
+        rows = [[record[field] for field in COMMENT_FIELDS] for record in records]
+        if self.fmt == 'sqlite':
+            with self._conn:
+                self._conn.executemany(
+                    f'INSERT OR REPLACE INTO comments VALUES ({",".join("?" * len(COMMENT_FIELDS))})', rows
+                )
+        else:
+            self._rows.write_rows(rows)
+        self.count += len(records)
+    
+    def position(self) -> int:
+        """已写入的文件长度，用于断点续写；SQLite按rpid去重，无需记录"""
+        if self._rows is None:
+            return 0
+        return self._rows.position()
+    
+    def __exit__(self, exc_type, exc, tb):
+        if self._conn is not None:
+            self._conn.close()
+        if self._rows is not None:
+            self._rows.close()
+
+def format_comment_text(record: dict) -> str:
+    """把评论记录格式化为终端显示和文本文件共用的文本块"""
+    return (
+        f"评论者: {record['uname']} (UID: {record['mid']})\n"
+        f"用户等级: {record['level']}\n"
+        f"点赞数: {record['like']}\n"
+        f"回复数: {record['rcount']}\n"
+        f"发布时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['ctime']))}\n"
+        f"评论内容: {record['message']}\n"
+        f"评论ID: {record['rpid']}\n"
+        f"{'-' * 50}"
+    )
+
 def get_hot_comments(bvid: str, ps: int = 20, pn: int = 1) -> None:
     """���取视频热门���论"""
     headers = {
@@ -1507,105 +3761,221 @@ def get_hot_comments(bvid: str, ps: int = 20, pn: int = 1) -> None:
         'Referer': 'https://www.bilibili.com',
     }
     
-    try:
-        # 首先取视频aid
-        video_url = f'https://api.bilibili.com/x/web-interface/view?bvid={bvid}'
-        response = requests.get(video_url, headers=headers)
-        data = response.json()
+    try:
+        # 由BV号直接算出aid
+        try:
+            aid = bv2av(bvid)
+        except ValueError:
+            print(f"无效的BV号: {bvid}")
+            return
+        
+        # 获取热评
+        hot_url = 'https://api.bilibili.com/x/v2/reply/hot'
+        params = {
+            'type': 1,  # 视频评论区
+            'oid': aid,  # 视频aid
+            'ps': ps,    # 每页评论数
+            'pn': pn     # 页码
+        }
+        
+        hot_response = http_get(hot_url, params=params, headers=headers)
+        hot_data = hot_response.json()
+        
+        if hot_data['code'] == 0:
+            # 查data字段是否存在
+            if 'data' not in hot_data or hot_data['data'] is None:
+                print("该视频暂无热评")
+                return
+                
+            # 检查replies字段是否存在
+            if 'replies' not in hot_data['data'] or not hot_data['data']['replies']:
+                print("该视频暂无热")
+                return
+                
+            page_info = hot_data['data'].get('page', {'acount': 0})
+            records = [comment_record(reply) for reply in hot_data['data']['replies']]
+            
+            print(f"\n获取到 {len(records)} 条热门评论（总评论数：{page_info.get('acount', 0)}）:")
+            print("="*50)
+            
+            # 每条评论只格式化一次，显示和保存文本文件共用
+            blocks = []
+            for record in records:
+                blocks.append(format_comment_text(record))
+                print(blocks[-1])
+            
+            # 询问是否保存到文件
+            choice = input("\n是否保存热评到文件？(y/n) [y]: ").lower()
+            if not choice or choice == 'y':
+                fmt = input(f"保存格式 txt/{'/'.join(COMMENT_EXPORT_FORMATS)} [txt]: ").strip().lower() or 'txt'
+                comment_dir = "评论"
+                os.makedirs(comment_dir, exist_ok=True)
+                
+                # 生成文件名（BV号 + 当前时间 + 评论后缀）
+                ext = 'db' if fmt == 'sqlite' else fmt
+                filename = f"{bvid} {time.strftime('%Y-%m-%d %H-%M-%S', time.localtime())} 评论.{ext}"
+                filepath = os.path.join(comment_dir, filename)
+                
+                try:
+                    if fmt == 'txt':
+                        with open(filepath, 'w', encoding='utf-8') as f:
+                            f.write(f"视频热门评论（总评论数：{page_info.get('acount', 0)}）\n" + "="*50 + "\n")
+                            f.write('\n'.join(blocks) + '\n')
+                    else:
+                        with CommentExporter(filepath, fmt) as exporter:
+                            exporter.write(records)
+                    print(f"热评已保存到文件: {filepath}")
+                except (OSError, ValueError, sqlite3.Error) as e:
+                    print(f"保存文件出错: {str(e)}")
+        else:
+            print(f"获取热评失败：{hot_data['message']}")
+            
+    except Exception as e:
+        print(f"获取热评时出错: {str(e)}")
+        print("请确保视频存在且有评论权限")
+
+def fetch_comment_page(oid: int, offset: str = '', mode: int = 3, cookies: Dict = None) -> dict:
+    """获取一页主评论（/x/v2/reply/wbi/main，游标翻页）
+    
+    Args:
+        oid (int): 视频aid
+        offset (str): 上一页返回的next_offset，第一页为空
+        mode (int): 3按热度，2按时间
+        
+    Returns:
+        dict: 接口返回的data
+        
+    Raises:
+        RuntimeError: 请求失败
+    """
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Referer': 'https://www.bilibili.com',
+    }
+    params = encode_wbi({
+        'oid': oid,
+        'type': 1,
+        'mode': mode,
+        'pagination_str': json.dumps({'offset': offset}, separators=(',', ':')),
+        'plat': 1,
+        'web_location': 1315875,
+    }, cookies)
+    data = http_get('https://api.bilibili.com/x/v2/reply/wbi/main', params=params,
+                    headers=headers, cookies=cookies).json()
+    if data['code'] != 0:
+        raise RuntimeError(f"获取评论失败：{data['message']}")
+    return data.get('data') or {}
+
+def fetch_sub_replies(oid: int, root: int, cookies: Dict = None, page_size: int = 20) -> list:
+    """获取一条主评论下的全部楼中楼回复（/x/v2/reply/reply，按页码翻页）
+    
+    Returns:
+        list: 评论记录列表，按接口顺序
+        
+    Raises:
+        RuntimeError: 请求失败
+    """
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Referer': 'https://www.bilibili.com',
+    }
+    records = []
+    pn = 1
+    while True:
+        params = encode_wbi({'oid': oid, 'type': 1, 'root': root, 'ps': page_size, 'pn': pn}, cookies)
+        data = http_get('https://api.bilibili.com/x/v2/reply/reply', params=params,
+                        headers=headers, cookies=cookies).json()
+        if data['code'] != 0:
+            raise RuntimeError(f"获取评论{root}的回复失败：{data['message']}")
+        replies = (data.get('data') or {}).get('replies') or []
+        records.extend(comment_record(reply) for reply in replies)
+        total = ((data.get('data') or {}).get('page') or {}).get('count', 0)
+        if not replies or pn * page_size >= total:
+            return records
+        pn += 1
+
+def crawl_comments(bvid: str, output_file: str = None, sort: str = 'hot', max_workers: int = 4,
+                   cookies: Dict = None, restart: bool = False, fmt: str = None) -> tuple:
+    """爬取视频完整评论区（主评论+全部楼中楼），逐页写入文件，中断后可从上次的游标继续
+    
+    每写完一页（含该页主评论的全部回复）就把下一页游标和已写入的文件长度记到
+    {output_file}.state.json；续爬时先把文件截断到记录的长度，丢掉写了一半的页。
+    
+    Args:
+        bvid (str): BV号
+        output_file (str): 输出文件，默认 评论/{bvid}_评论.jsonl
+        sort (str): hot按热度，time按时间
+        max_workers (int): 同时获取楼中楼回复的主评论数
+        cookies (Dict): cookies信息
+        restart (bool): 忽略已有进度重新爬取
+        fmt (str): jsonl/csv/sqlite，默认按输出文件扩展名判断，都没有时为jsonl
         
-        if data['code'] == 0:
-            aid = data['data']['aid']
-            
-            # 获取热评
-            hot_url = 'https://api.bilibili.com/x/v2/reply/hot'
-            params = {
-                'type': 1,  # 视频评论区
-                'oid': aid,  # 视频aid
-                'ps': ps,    # 每页评论数
-                'pn': pn     # 页码
+    Returns:
+        tuple: (已写入的评论条数, 输出文件路径)
+        
+    Raises:
+        ValueError: 续爬时排序方式与上次不同（游标只对原排序方式有效）
+    """
+    oid = bv2av(bvid)
+    if not output_file:
+        output_file = os.path.join("评论", f"{bvid}_评论.{'db' if fmt == 'sqlite' else fmt or 'jsonl'}")
+    elif not fmt and not os.path.splitext(output_file)[1]:
+        fmt = 'jsonl'
+    state_file = output_file + '.state.json'
+    state = {'bvid': bvid, 'sort': sort, 'next_offset': '', 'count': 0, 'size': 0, 'total': None, 'done': False}
+    if not restart and os.path.exists(state_file) and os.path.exists(output_file):
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state.update(json.load(f))
+        if state['sort'] != sort:
+            raise ValueError(f"{output_file} 上次按 {state['sort']} 排序爬取，游标不能用于 {sort} 排序；"
+                             f"请改用 --sort {state['sort']} 继续，或加 --restart 重新爬取")
+        if state['done']:
+            return state['count'], output_file
+        print(f"从上次中断处继续，已有 {state['count']} 条评论")
+    
+    def save_state():
+        temp_file = state_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(temp_file, state_file)
+    
+    resume_size = state['size'] if state['count'] else None
+    with CommentExporter(output_file, fmt, resume_size) as exporter, \
+            ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor, \
+            tqdm(desc=f"爬取评论 {bvid}", unit="条", initial=state['count'], total=state['total'], ncols=80) as pbar:
+        while True:
+            data = fetch_comment_page(oid, state['next_offset'], COMMENT_SORT_MODES[sort], cookies)
+            replies = data.get('replies') or []
+            if not state['next_offset']:
+                # 置顶评论只在第一页单独返回
+                replies = (data.get('top_replies') or []) + replies
+                state['total'] = pbar.total = ((data.get('cursor') or {}).get('all_count')) or None
+            
+            # 主评论按rpid去重，预览中的回复不全时并发获取完整楼中楼
+            unique = list({reply['rpid']: reply for reply in replies}.values())
+            futures = {
+                reply['rpid']: executor.submit(fetch_sub_replies, oid, reply['rpid'], cookies)
+                for reply in unique if reply.get('rcount', 0) > len(reply.get('replies') or [])
             }
+            records = []
+            for reply in unique:
+                records.append(comment_record(reply))
+                if reply['rpid'] in futures:
+                    records.extend(futures[reply['rpid']].result())
+                else:
+                    records.extend(comment_record(sub) for sub in reply.get('replies') or [])
             
-            hot_response = requests.get(hot_url, params=params, headers=headers)
-            hot_data = hot_response.json()
-            
-            if hot_data['code'] == 0:
-                # 查data字段是否存在
-                if 'data' not in hot_data or hot_data['data'] is None:
-                    print("该视频暂无热评")
-                    return
-                    
-                # 检查replies字段是否存在
-                if 'replies' not in hot_data['data'] or not hot_data['data']['replies']:
-                    print("该视频暂无热")
-                    return
-                    
-                page_info = hot_data['data'].get('page', {'acount': 0})
-                replies = hot_data['data']['replies']
-                
-                print(f"\n获取到 {len(replies)} 条热门评论（总评论数：{page_info.get('acount', 0)}）:")
-                print("="*50)
-                
-                for reply in replies:
-                    # 获取评论者信息
-                    member = reply['member']
-                    username = member['uname']  # 用户名
-                    user_level = member['level_info']['current_level']  # 用户等级
-                    user_id = member['mid']  # 用户ID
-                    
-                    # 获取评论内容
-                    content = reply['content']['message']
-                    # 获取点赞数
-                    like_count = reply['like']
-                    # 获取复数
-                    reply_count = reply['rcount']
-                    # 获取发布时间
-                    ctime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(reply['ctime']))
-                    
-                    print(f"评论者: {username} (UID: {user_id})")
-                    print(f"用���等级: {user_level}")
-                    print(f"点赞数: {like_count}")
-                    print(f"回复数: {reply_count}")
-                    print(f"发布时间: {ctime}")
-                    print(f"评论内容: {content}")
-                    print("-"*50)
-                
-                # 询问是否保存到文
-                choice = input("\n是否保热评到文本件？(y/n) [y]: ").lower()
-                if not choice or choice == 'y':
-                    # 创建评论文件夹（如果不存在）
-                    comment_dir = "评论"
-                    if not os.path.exists(comment_dir):
-                        os.makedirs(comment_dir)
-                    
-                    # 生成文件名（BV号 + 当前间 + 评论后）
-                    filename = f"{bvid} {time.strftime('%Y-%m-%d %H-%M-%S', time.localtime())} 评论.txt"
-                    # 完整文件路径
-                    filepath = os.path.join(comment_dir, filename)
-                    
-                    try:
-                        with open(filepath, 'w', encoding='utf-8') as f:
-                            f.write(f"视频热门评论（总评论数：{page_info.get('acount', 0)}）\n")
-                            f.write("="*50 + "\n")
-                            for reply in replies:
-                                member = reply['member']
-                                f.write(f"��论者: {member['uname']} (UID: {member['mid']})\n")
-                                f.write(f"��户等级: {member['level_info']['current_level']}\n")
-                                f.write(f"点赞数: {reply['like']}\n")
-                                f.write(f"回复数: {reply['rcount']}\n")
-                                f.write(f"发布时���: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(reply['ctime']))}\n")
-                                f.write(f"评论内容: {reply['content']['message']}\n")
-                                f.write("-"*50 + "\n")
-                        print(f"热评已保存到文件: {filepath}")
-                    except Exception as e:
-                        print(f"保存文件出: {str(e)}")
-            else:
-                print(f"获取热评失败：{hot_data['message']}")
-        else:
-            print(f"获取视频信息失败：{data['message']}")
+            exporter.write(records)
+            pbar.update(len(records))
             
-    except Exception as e:
-        print(f"获取热评时出错: {str(e)}")
-        print("请确保视频存在且有评论权限")
+            cursor = data.get('cursor') or {}
+            next_offset = (cursor.get('pagination_reply') or {}).get('next_offset', '')
+            state.update(next_offset=next_offset, count=state['count'] + len(records), size=exporter.position(),
+                         done=bool(cursor.get('is_end') or not replies or not next_offset))
+            save_state()
+            if state['done']:
+                break
+    return state['count'], output_file
 
 def get_ip_location():
     """获取IP地理位置信息"""
@@ -1628,7 +3998,7 @@ def get_ip_location():
             if choice == "1":
                 # 查询当前IP
                 url = 'https://api.bilibili.com/x/web-interface/zone'
-                response = requests.get(url, headers=headers)
+                response = http_get(url, headers=headers)
                 data = response.json()
                 
             elif choice == "2":
@@ -1636,7 +4006,7 @@ def get_ip_location():
                 ip = input("请输入要查询的IP地址: ").strip()
                 url = 'https://api.live.bilibili.com/ip_service/v1/ip_service/get_ip_addr'
                 params = {'ip': ip}
-                response = requests.get(url, params=params, headers=headers)
+                response = http_get(url, params=params, headers=headers)
                 data = response.json()
                 
             elif choice == "3":
@@ -1679,7 +4049,7 @@ def get_live_room_info(room_id: str) -> None:
     try:
         url = 'https://api.live.bilibili.com/room/v1/Room/get_info'
         params = {'room_id': room_id}
-        response = requests.get(url, params=params, headers=headers)
+        response = http_get(url, params=params, headers=headers)
         data = response.json()
         
         if data['code'] == 0:
@@ -1745,7 +4115,7 @@ def get_user_live_status(mid: str) -> None:
     try:
         url = 'https://api.live.bilibili.com/room/v1/Room/getRoomInfoOld'
         params = {'mid': mid}
-        response = requests.get(url, params=params, headers=headers)
+        response = http_get(url, params=params, headers=headers)
         data = response.json()
         
         if data['code'] == 0:
@@ -1795,7 +4165,7 @@ def get_room_init_info(room_id: str) -> None:
     try:
         url = 'https://api.live.bilibili.com/room/v1/Room/room_init'
         params = {'id': room_id}
-        response = requests.get(url, params=params, headers=headers)
+        response = http_get(url, params=params, headers=headers)
         data = response.json()
         
         if data['code'] == 0:
@@ -1855,7 +4225,7 @@ def get_anchor_info(uid: str) -> None:
     try:
         url = 'https://api.live.bilibili.com/live_user/v1/Master/info'
         params = {'uid': uid}
-        response = requests.get(url, params=params, headers=headers)
+        response = http_get(url, params=params, headers=headers)
         data = response.json()
         
         if data['code'] == 0:
@@ -1914,28 +4284,139 @@ def get_anchor_info(uid: str) -> None:
     except Exception as e:
         print(f"��������主播信息时出错: {str(e)}")
 
-def get_room_base_info(room_ids: list) -> None:
-    """获取多个直播间基本信息"""
+# 批量接口单次请求携带的ID数，超过时分多次请求
+LIVE_STATUS_BATCH_SIZE = 100
+LIVE_ROOM_INFO_BATCH_SIZE = 50
+
+def _chunked(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def fetch_live_status_by_uids(uids: list, batch_size: int = LIVE_STATUS_BATCH_SIZE) -> dict:
+    """批量获取主播直播间状态（get_status_info_by_uids），UID以重复的uids[]参数发送
+    
+    Returns:
+        dict: UID(str) -> 直播间状态，没有直播间的UID不在结果中
+        
+    Raises:
+        RuntimeError: 接口返回错误
+    """
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Referer': 'https://live.bilibili.com',
+    }
+    url = 'https://api.live.bilibili.com/room/v1/Room/get_status_info_by_uids'
+    result = {}
+    for chunk in _chunked(list(dict.fromkeys(str(uid) for uid in uids)), batch_size):
+        data = http_get(url, params=[('uids[]', uid) for uid in chunk], headers=headers).json()
+        if data['code'] != 0:
+            raise RuntimeError(f"获取直播间状态失败：{data['message']}")
+        # 全部UID都没有直播间时data是空列表
+        result.update(data['data'] or {})
+    return result
+
+def fetch_room_base_infos(room_ids: list, batch_size: int = LIVE_ROOM_INFO_BATCH_SIZE) -> dict:
+    """批量获取直播间基本信息（getRoomBaseInfo），房间号以重复的room_ids参数发送
+    
+    Returns:
+        dict: 房间号(str) -> 直播间信息
+        
+    Raises:
+        RuntimeError: 接口返回错误
+    """
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
         'Referer': 'https://live.bilibili.com',
     }
+    url = 'https://api.live.bilibili.com/xlive/web-room/v1/index/getRoomBaseInfo'
+    result = {}
+    for chunk in _chunked(list(dict.fromkeys(str(room_id) for room_id in room_ids)), batch_size):
+        params = [('req_biz', 'web_room_componet')] + [('room_ids', room_id) for room_id in chunk]
+        data = http_get(url, params=params, headers=headers).json()
+        if data['code'] != 0:
+            raise RuntimeError(f"获取直播间信息失败：{data['message']}")
+        result.update((data['data'] or {}).get('by_room_ids') or {})
+    return result
+
+class LiveStatusPoller:
+    """定时批量查询一组主播的直播状态，只产出状态变化
+    
+    一次请求可覆盖上百个主播。变化事件为dict，type为：
+        live    开播（首次查询时已在直播的也会产出，emit_initial=False时不产出）
+        offline 下播（包括转为轮播）
+        title   直播中修改了标题
+    
+    用法:
+        poller = LiveStatusPoller(uids, interval=60)
+        for change in poller.watch():
+            print(change['type'], change['uname'])
+    """
     
+    def __init__(self, uids: list, interval: float = 60, emit_initial: bool = True):
+        self.uids = [str(uid) for uid in uids]
+        self.interval = interval
+        self.emit_initial = emit_initial
+        self.states = {}
+    
+    def poll_once(self) -> list:
+        """查询一次，返回与上次相比的变化"""
+        first = not self.states
+        changes = []
+        for uid, info in fetch_live_status_by_uids(self.uids).items():
+            live = info.get('live_status') == 1
+            previous = self.states.get(uid)
+            change = {
+                'uid': uid,
+                'uname': info.get('uname', ''),
+                'room_id': info.get('room_id'),
+                'title': info.get('title', ''),
+                'live_time': info.get('live_time', 0),
+                'time': time.time(),
+            }
+            if previous is None:
+                if live and (self.emit_initial or not first):
+                    changes.append({**change, 'type': 'live'})
+            elif live != previous['live']:
+                changes.append({**change, 'type': 'live' if live else 'offline'})
+            elif live and change['title'] != previous['title']:
+                changes.append({**change, 'type': 'title', 'old_title': previous['title']})
+            self.states[uid] = {'live': live, 'title': change['title'], 'room_id': change['room_id']}
+        return changes
+    
+    def watch(self):
+        """按间隔持续查询，逐个产出状态变化；单次查询失败只记录日志"""
+        while True:
+            started = time.time()
+            try:
+                yield from self.poll_once()
+            except (RuntimeError, requests.RequestException, ValueError) as e:
+                logger.warning(f"查询直播状态失败: {str(e)}")
+            time.sleep(max(0, self.interval - (time.time() - started)))
+
+def format_live_change(change: dict) -> str:
+    """把直播状态变化格式化为一行文本"""
+    when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(change['time']))
+    who = f"{change['uname']} (UID: {change['uid']}, 房间号: {change['room_id']})"
+    if change['type'] == 'live':
+        return f"[{when}] 🔴 开播: {who} {change['title']}"
+    if change['type'] == 'offline':
+        return f"[{when}] ⚫ 下播: {who}"
+    return f"[{when}] ✏️ 改标题: {who} {change['old_title']} -> {change['title']}"
+
+def parse_id_list(text: str) -> list:
+    """把用逗号、空格分隔的多个ID拆分成列表"""
+    return [item for item in re.split(r'[\s,，]+', text.strip()) if item]
+
+def get_room_base_info(room_ids: list) -> None:
+    """获取多个直播间基本信息"""
     try:
-        url = 'https://api.live.bilibili.com/xlive/web-room/v1/index/getRoomBaseInfo'
-        params = {
-            'req_biz': 'web_room_componet',
-        }
-        # 添加多个房间号
-        for room_id in room_ids:
-            params[f'room_ids'] = room_id
-            
-        response = requests.get(url, params=params, headers=headers)
-        data = response.json()
+        try:
+            rooms_info = fetch_room_base_infos(room_ids)
+        except RuntimeError as e:
+            print(str(e))
+            return
         
-        if data['code'] == 0:
-            rooms_info = data['data']['by_room_ids']
-            
+        if rooms_info:
             for room_id, room_info in rooms_info.items():
                 print(f"\n直播间 {room_id} 基本信息:")
                 print("="*50)
@@ -1977,31 +4458,21 @@ def get_room_base_info(room_ids: list) -> None:
                 print("="*50)
             
         else:
-            print(f"获取直播间信息失败：{data['message']}")
+            print("没有查到这些直播间的信息")
             
     except Exception as e:
         print(f"获取直播间信息时出错: {str(e)}")
 
 def get_batch_live_status(uids: list) -> None:
     """批量查询直播间状态"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Referer': 'https://live.bilibili.com',
-    }
-    
     try:
-        url = 'https://api.live.bilibili.com/room/v1/Room/get_status_info_by_uids'
-        # 构造请求参数
-        params = {}
-        for i, uid in enumerate(uids):
-            params[f'uids[]'] = uid
-            
-        response = requests.get(url, params=params, headers=headers)
-        data = response.json()
+        try:
+            rooms_info = fetch_live_status_by_uids(uids)
+        except RuntimeError as e:
+            print(str(e))
+            return
         
-        if data['code'] == 0:
-            rooms_info = data['data']
-            
+        if rooms_info:
             for uid, room_info in rooms_info.items():
                 print(f"\n主播 {room_info['uname']} (UID: {uid}) 的直播状态:")
                 print("="*50)
@@ -2043,7 +4514,7 @@ def get_batch_live_status(uids: list) -> None:
                 print("="*50)
             
         else:
-            print(f"获取直播间状态失败：{data['message']}")
+            print("这些用户都没有直播间")
             
     except Exception as e:
         print(f"获取直播间状态时出错: {str(e)}")
@@ -2055,12 +4526,10 @@ def get_live_history_danmaku(room_id: str) -> None:
         'Referer': 'https://live.bilibili.com'
     }
     
-    seen_msgs = set()  # 添加这行来定义 seen_msgs
-    
     try:
         url = 'https://api.live.bilibili.com/xlive/web-room/v1/dM/gethistory'
         params = {'roomid': room_id}
-        response = requests.get(url, params=params, headers=headers)
+        response = http_get(url, params=params, headers=headers)
         data = response.json()
         
         if data['code'] == 0:
@@ -2104,29 +4573,30 @@ def get_live_history_danmaku(room_id: str) -> None:
                 filename = f"{room_id} {time.strftime('%Y-%m-%d %H-%M-%S', time.localtime())} 历史弹幕.txt"
                 filepath = os.path.join(danmaku_dir, filename)
                 
+                # 两个列表可能包含同一条弹幕，写入时去重
+                deduper = LiveMessageDeduper()
+                collected = 0
                 try:
                     with open(filepath, 'w', encoding='utf-8') as f:
-                        if admin_msgs:
-                            f.write("管理员弹幕:\n")
-                            f.write("-"*30 + "\n")
-                            for msg in admin_msgs:
+                        for title, msgs in (("管理员弹幕", admin_msgs), ("普通用户弹幕", room_msgs)):
+                            if not msgs:
+                                continue
+                            f.write(f"{title}:\n" + "-"*30 + "\n")
+                            for msg in msgs:
+                                if deduper.seen((msg['timeline'], msg['uid'], msg['text'])):
+                                    continue
+                                collected += 1
                                 f.write(f"时间: {msg['timeline']}\n")
                                 f.write(f"用户: {msg['nickname']} (UID: {msg['uid']})\n")
                                 if msg['medal']:
                                     f.write(f"勋章: {msg['medal'][1]} {msg['medal'][0]}级\n")
                                 f.write(f"内容: {msg['text']}\n")
                                 f.write("-"*30 + "\n")
-                                f.flush()  # 立即写入文件
-                            
-                            time.sleep(10)
-                        
-                    print(f"\n监完成，共收集到 {len(seen_msgs)} 条弹幕")
-                    print(f"弹幕已保存到文件: {filepath}")
                     
-                except KeyboardInterrupt:
-                    print("\n用户停止监听")
-                    print(f"已收集到 {len(seen_msgs)} 条弹幕")
+                    print(f"\n共保存 {collected} 条弹幕")
                     print(f"弹幕已保存到文件: {filepath}")
+                except OSError as e:
+                    print(f"保存文件时出错: {str(e)}")
         
         else:
             print(f"获取历史弹幕失败：{data['message']}")
@@ -2165,7 +4635,7 @@ def get_room_play_info(room_id: str) -> None:
             'dolby': '5',
             'panorama': '1'
         }
-        response = requests.get(url, params=params, headers=headers)
+        response = http_get(url, params=params, headers=headers)
         data = response.json()
         
         if data['code'] == 0:
@@ -2234,96 +4704,1033 @@ def get_room_play_info(room_id: str) -> None:
     except Exception as e:
         print(f"获取直播间播放信息时出错: {str(e)}")
 
-def get_room_anchor_info(room_id: str) -> None:
-    """获取直播间主播详细信息"""
+def get_room_anchor_info(room_id: str) -> None:
+    """获取直播间主播详细信息"""
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Referer': 'https://live.bilibili.com',
+    }
+    
+    try:
+        url = 'https://api.live.bilibili.com/live_user/v1/UserInfo/get_anchor_in_room'
+        params = {'roomid': room_id}
+        response = http_get(url, params=params, headers=headers)
+        data = response.json()
+        
+        if data['code'] == 0:
+            if 'data' in data and data['data']:
+                anchor_data = data['data']
+                info = anchor_data['info']
+                level = anchor_data['level']
+                
+                print("\n主播详细信息:")
+                print("="*50)
+                
+                # 基本信息
+                print("基本信息:")
+                print(f"UID: {info['uid']}")
+                print(f"用户名: {info['uname']}")
+                print(f"头像: {info['face']}")
+                print(f"排名: {info['rank']}")
+                print(f"平台用户等级: {info['platform_user_level']}")
+                
+                # 认证状态
+                print(f"\n认证状态:")
+                print(f"手机认证: {'已认证' if info['mobile_verify'] == 1 else '未认证'}")
+                print(f"身份认证: {'已认证' if info['identification'] == 1 else '未认证'}")
+                
+                # 官方认证信息
+                if info['official_verify']['type'] != -1:
+                    verify_type = "认证" if info['official_verify']['type'] == 0 else "机构认证"
+                    print(f"认证类型: {verify_type}")
+                    print(f"认证说明: {info['official_verify']['desc']}")
+                
+                # 性别
+                gender_map = {
+                    -1: "保密",
+                    0: "女",
+                    1: "男"
+                }
+                print(f"性别: {gender_map.get(info['gender'], '未知')}")
+                
+                # 等级信息
+                print("\n等级信息:")
+                master_level = level['master_level']
+                print(f"主播等级: {master_level['level']}")
+                print(f"用户等级: {level['user_level']}")
+                print(f"主播积分: {master_level['anchor_score']}")
+                if master_level['upgrade_score'] > 0:
+                    print(f"升级还需: {master_level['upgrade_score']}")
+                
+                # 消费信息
+                print("\n消费信息:")
+                print(f"消费金额: {level['cost']}")
+                print(f"充值金额: {level['rcost']}")
+                
+                # VIP信息
+                print("\nVIP状态:")
+                if level['vip'] == 1:
+                    print(f"VIP到期时间: {level['vip_time']}")
+                else:
+                    print("不是VIP")
+                if level['svip'] == 1:
+                    print(f"SVIP到期时间: {level['svip_time']}")
+                else:
+                    print("不是SVIP")
+                
+                # SAN值
+                print(f"\nSAN值: {anchor_data['san']}/12")
+                
+                print("="*50)
+            else:
+                print("未找到主播信息")
+        else:
+            print(f"获取主播信息失败：{data['message']}")
+                
+    except Exception as e:
+        print(f"获取主播信息时出错: {str(e)}")
+
+class LiveMessageDeduper:
+    """有界的消息去重器，只记住最近window秒内出现过的消息
+    
+    每条消息只保存64位哈希和出现时间，放在固定容量的环形数组里，写满后覆盖最旧的一条；
+    另用dict按哈希查找所在位置。内存只取决于capacity，与录制时长无关。
+    """
+    
+    def __init__(self, window: float = 300, capacity: int = 65536):
+        self.window = window
+        self.capacity = capacity
+        self._hashes = array('q', [0]) * capacity
+        self._times = array('d', [0.0]) * capacity
+        self._slots = {}
+        self._next = 0
+    
+    def __len__(self) -> int:
+        return len(self._slots)
+    
+    def seen(self, key, now: float = None) -> bool:
+        """key在时间窗口内出现过返回True，否则记下并返回False
+        
+        Args:
+            key: 消息ID或可哈希的元组，如 (时间, UID, 内容)，不必拼接成字符串
+            now (float): 当前时间，默认time.monotonic()
+        """
+        digest = hash(key)
+        now = time.monotonic() if now is None else now
+        slot = self._slots.get(digest)
+        if slot is not None and now - self._times[slot] <= self.window:
+            return True
+        slot = self._next
+        evicted = self._hashes[slot]
+        if self._slots.get(evicted) == slot:
+            del self._slots[evicted]
+        self._hashes[slot] = digest
+        self._times[slot] = now
+        self._slots[digest] = slot
+        self._next = (slot + 1) % self.capacity
+        return False
+
+def live_event_key(event: dict):
+    """直播事件的去重键：优先用消息ID，弹幕没有ID时用(发送时间, UID, 内容)，其他事件不去重"""
+    msg_id = event.get('msg_id')
+    if msg_id:
+        return msg_id
+    if event.get('cmd', '').startswith('DANMU_MSG'):
+        info = event['info']
+        return (info[0][4], info[2][0], info[1])
+    return None
+
+# 直播信息流协议：每个包由16字节大端包头（总长度、包头长度、协议版本、操作码、序号）和正文组成
+LIVE_PACKET_HEADER = struct.Struct('>IHHII')
+LIVE_PROTO_JSON = 0      # 正文为JSON
+LIVE_PROTO_INT = 1       # 心跳回复和认证，正文为整数或JSON
+LIVE_PROTO_ZLIB = 2      # 正文为zlib压缩的多个包
+LIVE_PROTO_BROTLI = 3    # 正文为brotli压缩的多个包
+LIVE_OP_HEARTBEAT = 2
+LIVE_OP_HEARTBEAT_REPLY = 3
+LIVE_OP_MESSAGE = 5
+LIVE_OP_AUTH = 7
+LIVE_OP_AUTH_REPLY = 8
+LIVE_DEFAULT_HOST = {'host': 'broadcastlv.chat.bilibili.com', 'port': 2243}
+
+def pack_live_packet(operation: int, body=b'', protover: int = LIVE_PROTO_INT) -> bytes:
+    """打包一个信息流数据包，body为dict时编码为JSON"""
+    if isinstance(body, dict):
+        body = json.dumps(body, separators=(',', ':')).encode('utf-8')
+    return LIVE_PACKET_HEADER.pack(LIVE_PACKET_HEADER.size + len(body), LIVE_PACKET_HEADER.size,
+                                   protover, operation, 1) + body
+
+def unpack_live_packets(data: bytes):
+    """拆分一段数据中的全部数据包，压缩包解压后继续拆分
+    
+    Yields:
+        tuple: (操作码, 正文bytes)
+    """
+    offset = 0
+    while offset + LIVE_PACKET_HEADER.size <= len(data):
+        length, header_length, protover, operation, _ = LIVE_PACKET_HEADER.unpack_from(data, offset)
+        if length < header_length:
+            break
+        body = data[offset + header_length:offset + length]
+        offset += length
+        if operation == LIVE_OP_MESSAGE and protover == LIVE_PROTO_ZLIB:
+            yield from unpack_live_packets(zlib.decompress(body))
+        elif operation == LIVE_OP_MESSAGE and protover == LIVE_PROTO_BROTLI:
+            yield from unpack_live_packets(brotli.decompress(body))
+        else:
+            yield operation, body
+
+def get_live_real_room_id(room_id) -> int:
+    """直播间短号转为真实房间号"""
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Referer': 'https://live.bilibili.com',
+    }
+    data = http_get('https://api.live.bilibili.com/room/v1/Room/room_init',
+                    params={'id': room_id}, headers=headers).json()
+    if data['code'] != 0:
+        raise RuntimeError(f"获取直播间{room_id}信息失败：{data['message']}")
+    return data['data']['room_id']
+
+def get_live_danmu_info(room_id, cookies: Dict = None) -> dict:
+    """获取连接信息流所需的token和服务器列表（getDanmuInfo）
+    
+    Returns:
+        dict: 接口返回的data，包含token和host_list
+    """
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Referer': f'https://live.bilibili.com/{room_id}',
+    }
+    params = encode_wbi({'id': room_id, 'type': 0, 'web_location': '444.8'}, cookies)
+    data = http_get('https://api.live.bilibili.com/xlive/web-room/v1/index/getDanmuInfo',
+                    params=params, headers=headers, cookies=cookies).json()
+    if data['code'] != 0:
+        raise RuntimeError(f"获取直播间{room_id}信息流token失败：{data['message']}")
+    return data['data']
+
+def parse_danmu_msg(event: dict) -> dict:
+    """把DANMU_MSG事件整理为与gethistory接口相近的字段"""
+    info = event['info']
+    meta = info[0]
+    extra = meta[15].get('extra') if len(meta) > 15 and isinstance(meta[15], dict) else None
+    return {
+        'id': json.loads(extra).get('id_str', '') if extra else '',
+        'timestamp': meta[4] / 1000,
+        'uid': info[2][0],
+        'nickname': info[2][1],
+        'text': info[1],
+        'medal': info[3][:2] if info[3] else [],
+    }
+
+def format_live_event(event: dict) -> str:
+    """把常见的直播事件格式化为文本，其他事件返回None"""
+    cmd = event.get('cmd', '')
+    data = event.get('data') or {}
+    if cmd.startswith('DANMU_MSG'):
+        msg = parse_danmu_msg(event)
+        lines = [f"时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(msg['timestamp']))}",
+                 f"用户: {msg['nickname']} (UID: {msg['uid']})"]
+        if msg['medal']:
+            lines.append(f"勋章: {msg['medal'][1]} {msg['medal'][0]}级")
+        lines.append(f"内容: {msg['text']}")
+    elif cmd == 'SEND_GIFT':
+        lines = [f"时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data.get('timestamp', time.time())))}",
+                 f"礼物: {data.get('uname')} (UID: {data.get('uid')}) {data.get('action', '投喂')} "
+                 f"{data.get('giftName')} x{data.get('num', 1)}"]
+    elif cmd == 'SUPER_CHAT_MESSAGE':
+        user = data.get('user_info') or {}
+        lines = [f"时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data.get('start_time', time.time())))}",
+                 f"醒目留言: {user.get('uname')} (UID: {data.get('uid')}) ￥{data.get('price')}",
+                 f"内容: {data.get('message')}"]
+    elif cmd == 'GUARD_BUY':
+        lines = [f"时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data.get('start_time', time.time())))}",
+                 f"上舰: {data.get('username')} (UID: {data.get('uid')}) 开通 {data.get('gift_name')} x{data.get('num', 1)}"]
+    else:
+        return None
+    return '\n'.join(lines) + '\n' + '-' * 30
+
+def print_live_event(event: dict) -> None:
+    """把弹幕、礼物、醒目留言和上舰事件打印到终端"""
+    text = format_live_event(event)
+    if text:
+        print(text)
+
+class LiveEventFileSink:
+    """把直播事件写入文件，txt为可读文本（只写常见事件），jsonl为原始事件
+    
+    写入经过文件缓冲，每秒最多刷新一次，不会每条弹幕都触发一次磁盘写。
+    """
+    
+    def __init__(self, filepath: str, fmt: str = 'txt', flush_interval: float = 1.0):
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.filepath = filepath
+        self.fmt = fmt
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._file = open(filepath, 'a', encoding='utf-8')
+        self._last_flush = time.monotonic()
+    
+    def __call__(self, event: dict) -> None:
+        if self.fmt == 'jsonl':
+            self.write_line(json.dumps(event, ensure_ascii=False, separators=(',', ':')))
+        else:
+            text = format_live_event(event)
+            if text is not None:
+                self.write_line(text)
+    
+    def write_line(self, line: str) -> None:
+        """写入一条已格式化的记录"""
+        self._file.write(line + '\n')
+        self.count += 1
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_interval:
+            self._file.flush()
+            self._last_flush = now
+    
+    def close(self) -> None:
+        self._file.close()
+
+class LiveDanmakuClient:
+    """直播间信息流客户端，实时接收弹幕、礼物等全部事件
+    
+    通过TCP连接信息流服务器，认证后每30秒发送一次心跳；收到的事件（解压并解析JSON后）
+    依次交给sinks中的每个回调，回调可以是普通函数或协程函数。
+    
+    用法:
+        client = LiveDanmakuClient(room_id, cookies, sinks=[print_live_event])
+        asyncio.run(client.run(duration=1800))
+    """
+    
+    def __init__(self, room_id, cookies: Dict = None, sinks: list = None, heartbeat_interval: float = 30,
+                 deduper: LiveMessageDeduper = None):
+        self.room_id = int(room_id)
+        self.cookies = cookies or {}
+        self.sinks = list(sinks or [])
+        self.heartbeat_interval = heartbeat_interval
+        # 服务器偶尔会重复推送同一条消息，重连后也可能重发，按消息ID在时间窗口内去重
+        self.deduper = deduper or LiveMessageDeduper()
+        self.popularity = 0
+        self.event_count = 0
+        self._writer = None
+    
+    def add_sink(self, sink) -> None:
+        """添加一个事件回调"""
+        self.sinks.append(sink)
+    
+    async def _emit(self, event: dict) -> None:
+        for sink in self.sinks:
+            try:
+                result = sink(event)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.warning(f"直播间{self.room_id}事件处理出错: {str(e)}")
+    
+    async def connect(self) -> tuple:
+        """获取token、连接服务器并完成认证
+        
+        Returns:
+            tuple: (StreamReader, StreamWriter)
+            
+        Raises:
+            RuntimeError: 获取token失败或认证被拒绝
+            ConnectionError: 所有服务器都无法连接
+        """
+        loop = asyncio.get_running_loop()
+        self.room_id = await loop.run_in_executor(None, get_live_real_room_id, self.room_id)
+        info = await loop.run_in_executor(None, get_live_danmu_info, self.room_id, self.cookies)
+        
+        reader = writer = None
+        for host in (info.get('host_list') or []) + [LIVE_DEFAULT_HOST]:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(host['host'], host.get('port', 2243)), NETWORK_CONFIG['timeout']
+                )
+                break
+            except (OSError, asyncio.TimeoutError) as e:
+                logger.warning(f"连接信息流服务器 {host['host']} 失败: {str(e)}")
+        if writer is None:
+            raise ConnectionError(f"直播间{self.room_id}的信息流服务器都无法连接")
+        
+        auth = {
+            'uid': int(self.cookies.get('DedeUserID') or 0),
+            'roomid': self.room_id,
+            'protover': LIVE_PROTO_BROTLI if brotli is not None else LIVE_PROTO_ZLIB,
+            'platform': 'web',
+            'type': 2,
+            'key': info.get('token', ''),
+        }
+        if self.cookies.get('buvid3'):
+            auth['buvid'] = self.cookies['buvid3']
+        writer.write(pack_live_packet(LIVE_OP_AUTH, auth))
+        await writer.drain()
+        for operation, body in await asyncio.wait_for(self._read_packets(reader), NETWORK_CONFIG['timeout']):
+            if operation == LIVE_OP_AUTH_REPLY and json.loads(body or b'{}').get('code', 0) != 0:
+                writer.close()
+                raise RuntimeError(f"直播间{self.room_id}信息流认证失败: {body.decode('utf-8', 'replace')}")
+        self._writer = writer
+        return reader, writer
+    
+    @staticmethod
+    async def _read_packets(reader) -> list:
+        header = await reader.readexactly(LIVE_PACKET_HEADER.size)
+        length = LIVE_PACKET_HEADER.unpack(header)[0]
+        body = await reader.readexactly(max(0, length - LIVE_PACKET_HEADER.size))
+        return list(unpack_live_packets(header + body))
+    
+    async def _heartbeat(self, writer) -> None:
+        while True:
+            writer.write(pack_live_packet(LIVE_OP_HEARTBEAT, b'[object Object]'))
+            await writer.drain()
+            await asyncio.sleep(self.heartbeat_interval)
+    
+    async def _receive(self, reader) -> None:
+        while True:
+            for operation, body in await self._read_packets(reader):
+                if operation == LIVE_OP_HEARTBEAT_REPLY:
+                    self.popularity = int.from_bytes(body[:4], 'big')
+                elif operation == LIVE_OP_MESSAGE:
+                    event = json.loads(body)
+                    key = live_event_key(event)
+                    if key is not None and self.deduper.seen(key):
+                        continue
+                    self.event_count += 1
+                    await self._emit(event)
+    
+    async def run(self, duration: float = None) -> None:
+        """连接并持续接收事件，直到到达时长、服务器断开或调用close()
+        
+        Args:
+            duration (float): 接收时长（秒），None表示一直接收
+        """
+        reader, writer = await self.connect()
+        heartbeat = asyncio.ensure_future(self._heartbeat(writer))
+        try:
+            await asyncio.wait_for(self._receive(reader), duration)
+        except asyncio.TimeoutError:
+            pass
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.info(f"直播间{self.room_id}信息流连接已断开: {str(e)}")
+        finally:
+            heartbeat.cancel()
+            self.close()
+    
+    def close(self) -> None:
+        """断开连接，run()随之返回"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+LIVE_RECORD_DIR = os.path.join("弹幕", "直播弹幕")
+
+class RotatingLiveEventSink(LiveEventFileSink):
+    """按直播间写入事件，文件超过大小上限或跨天时切换到新文件
+    
+    文件保存在 {目录}/{房间号}/{房间号}_{开始时间}.{格式}
+    """
+    
+    def __init__(self, room_id, directory: str = LIVE_RECORD_DIR, fmt: str = 'jsonl',
+                 max_bytes: int = 64 * 1024 * 1024, flush_interval: float = 1.0):
+        self.room_id = room_id
+        self.directory = os.path.join(directory, str(room_id))
+        self.max_bytes = max_bytes
+        self._size = 0
+        self._day = time.strftime('%Y%m%d')
+        super().__init__(self._new_path(fmt), fmt, flush_interval)
+    
+    def _new_path(self, fmt: str) -> str:
+        base = os.path.join(self.directory, f"{self.room_id}_{time.strftime('%Y%m%d_%H%M%S')}")
+        filepath, index = f"{base}.{fmt}", 1
+        while os.path.exists(filepath):
+            filepath, index = f"{base}_{index}.{fmt}", index + 1
+        return filepath
+    
+    def rotate(self) -> None:
+        """关闭当前文件，开始写新文件"""
+        self._file.close()
+        self.filepath = self._new_path(self.fmt)
+        self._file = open(self.filepath, 'a', encoding='utf-8')
+        self._size = 0
+        self._day = time.strftime('%Y%m%d')
+    
+    def write_line(self, line: str) -> None:
+        if self._size >= self.max_bytes or time.strftime('%Y%m%d') != self._day:
+            self.rotate()
+        super().write_line(line)
+        self._size += len(line.encode('utf-8')) + 1
+
+def load_live_watchlist(filename: str) -> list:
+    """读取直播间关注列表，每行一个房间号或直播间链接，#开头为注释
+    
+    Returns:
+        list: 房间号列表（按文件顺序去重）
+    """
+    room_ids = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            room_id = extract_room_id(line) if 'live.bilibili.com' in line else line
+            if room_id.isdigit():
+                room_ids.append(int(room_id))
+    return list(dict.fromkeys(room_ids))
+
+class LiveDanmakuRecorder:
+    """在一个事件循环中同时录制多个直播间的信息流
+    
+    每个直播间一个协程，连接断开或失败后按指数退避重连；关注列表文件修改后，
+    新增的直播间立即开始录制，删除的直播间停止录制。
+    
+    用法:
+        recorder = LiveDanmakuRecorder(cookies, watchlist='live_rooms.txt')
+        asyncio.run(recorder.run())
+    """
+    
+    def __init__(self, cookies: Dict = None, directory: str = LIVE_RECORD_DIR, fmt: str = 'jsonl',
+                 watchlist: str = None, max_bytes: int = 64 * 1024 * 1024, reload_interval: float = 10,
+                 backoff_base: float = 2, backoff_max: float = 300):
+        self.cookies = cookies or {}
+        self.directory = directory
+        self.fmt = fmt
+        self.watchlist = watchlist
+        self.max_bytes = max_bytes
+        self.reload_interval = reload_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.tasks = {}
+        self.clients = {}
+        self.sinks = {}
+        self.pinned = set()      # run()直接指定的房间号，不随关注列表增删
+        self._watchlist_mtime = None
+        self._stop_event = None
+    
+    def add_room(self, room_id: int) -> None:
+        """开始录制一个直播间，已在录制时忽略"""
+        if room_id not in self.tasks:
+            logger.info(f"开始录制直播间 {room_id} 的弹幕")
+            self.tasks[room_id] = asyncio.ensure_future(self._record_room(room_id))
+    
+    async def remove_room(self, room_id: int) -> None:
+        """停止录制一个直播间"""
+        task = self.tasks.pop(room_id, None)
+        if task is None:
+            return
+        logger.info(f"停止录制直播间 {room_id}")
+        client = self.clients.get(room_id)
+        if client is not None:
+            client.close()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    
+    async def _record_room(self, room_id: int) -> None:
+        loop = asyncio.get_running_loop()
+        sink = RotatingLiveEventSink(room_id, self.directory, self.fmt, self.max_bytes)
+        self.sinks[room_id] = sink
+        deduper = LiveMessageDeduper()
+        failures = 0
+        try:
+            while True:
+                client = LiveDanmakuClient(room_id, self.cookies, sinks=[sink], deduper=deduper)
+                self.clients[room_id] = client
+                started = loop.time()
+                try:
+                    await client.run()
+                except Exception as e:
+                    # 解压（zlib/brotli）、畸形消息等任何错误都只结束本次连接，退避后重连；
+                    # 取消录制时抛出的CancelledError不是Exception，不会被这里吞掉
+                    logger.warning(f"直播间 {room_id} 信息流出错: {type(e).__name__}: {str(e)}")
+                # 连接稳定运行过一分钟才视为恢复，否则退避时间逐次翻倍
+                failures = 0 if loop.time() - started > 60 else failures + 1
+                delay = min(self.backoff_max, self.backoff_base * 2 ** failures)
+                await asyncio.sleep(delay / 2 + random.uniform(0, delay / 2))
+        finally:
+            self.clients.pop(room_id, None)
+            self.sinks.pop(room_id, None)
+            sink.close()
+    
+    async def sync_watchlist(self) -> None:
+        """关注列表文件有变化时，按文件内容增删录制中的直播间"""
+        if not self.watchlist or not os.path.exists(self.watchlist):
+            return
+        mtime = os.path.getmtime(self.watchlist)
+        if mtime == self._watchlist_mtime:
+            return
+        self._watchlist_mtime = mtime
+        room_ids = set(load_live_watchlist(self.watchlist))
+        for room_id in list(self.tasks):
+            if room_id not in room_ids and room_id not in self.pinned:
+                await self.remove_room(room_id)
+        for room_id in room_ids:
+            self.add_room(room_id)
+    
+    def stop(self) -> None:
+        """请求停止录制，run()会关闭所有连接后返回"""
+        if self._stop_event is not None:
+            self._stop_event.set()
+    
+    def total_events(self) -> int:
+        """所有直播间已写入的消息数"""
+        return sum(sink.count for sink in self.sinks.values())
+    
+    async def run(self, room_ids: list = None, duration: float = None) -> None:
+        """录制给定直播间和关注列表中的直播间
+        
+        Args:
+            room_ids (list): 额外录制的房间号（不受关注列表增删影响）
+            duration (float): 录制时长（秒），None表示一直录制直到stop()
+        """
+        self._stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + duration if duration else None
+        self.pinned = {int(room_id) for room_id in room_ids or []}
+        for room_id in self.pinned:
+            self.add_room(room_id)
+        try:
+            while not self._stop_event.is_set():
+                await self.sync_watchlist()
+                timeout = self.reload_interval
+                if deadline is not None:
+                    timeout = min(timeout, deadline - loop.time())
+                    if timeout <= 0:
+                        break
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for room_id in list(self.tasks):
+                await self.remove_room(room_id)
+
+LIVE_VIDEO_DIR = "直播录制"
+
+# 同一清晰度下录制时优先选择的协议、格式和编码，越靠前越优先
+LIVE_PROTOCOL_PRIORITY = ['http_stream', 'http_hls']
+LIVE_FORMAT_PRIORITY = ['flv', 'fmp4', 'ts']
+LIVE_CODEC_PRIORITY = ['avc', 'hevc']
+
+def get_live_play_streams(room_id, qn: int = 10000, cookies: Dict = None) -> tuple:
+    """获取直播间当前可用的直播流地址（getRoomPlayInfo），按录制优先级排序
+    
+    Returns:
+        tuple: (直播状态, 候选流列表)；每个候选流为dict，包含protocol/format/codec/qn和urls（各CDN节点的完整地址）
+        
+    Raises:
+        RuntimeError: 接口返回错误
+    """
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
         'Referer': 'https://live.bilibili.com',
     }
+    params = {
+        'room_id': room_id,
+        'protocol': '0,1',    # http_stream,http_hls
+        'format': '0,1,2',    # flv,ts,fmp4
+        'codec': '0,1',       # AVC,HEVC
+        'qn': qn,
+        'platform': 'web',
+        'ptype': '8',
+        'dolby': '5',
+        'panorama': '1'
+    }
+    data = http_get('https://api.live.bilibili.com/xlive/web-room/v2/index/getRoomPlayInfo',
+                    params=params, headers=headers, cookies=cookies).json()
+    if data['code'] != 0:
+        raise RuntimeError(f"获取直播间{room_id}播放地址失败：{data['message']}")
+    room_info = data['data']
+    playurl = (room_info.get('playurl_info') or {}).get('playurl') or {}
     
-    try:
-        url = 'https://api.live.bilibili.com/live_user/v1/UserInfo/get_anchor_in_room'
-        params = {'roomid': room_id}
-        response = requests.get(url, params=params, headers=headers)
-        data = response.json()
+    def rank(name, priority):
+        return priority.index(name) if name in priority else len(priority)
+    
+    candidates = []
+    for stream in playurl.get('stream') or []:
+        for format_info in stream['format']:
+            for codec in format_info['codec']:
+                urls = [info['host'] + codec['base_url'] + info.get('extra', '') for info in codec.get('url_info') or []]
+                if urls:
+                    candidates.append({
+                        'protocol': stream['protocol_name'],
+                        'format': format_info['format_name'],
+                        'codec': codec['codec_name'],
+                        'qn': codec['current_qn'],
+                        'urls': urls,
+                    })
+    candidates.sort(key=lambda c: (-c['qn'], rank(c['protocol'], LIVE_PROTOCOL_PRIORITY),
+                                   rank(c['format'], LIVE_FORMAT_PRIORITY), rank(c['codec'], LIVE_CODEC_PRIORITY)))
+    return room_info.get('live_status', 0), candidates
+
+class LiveStreamRecorder:
+    """录制直播流到本地文件
+    
+    FLV流（http_stream）直接按块写盘；只有HLS流或只录音频时交给ffmpeg（-c copy / -vn -c:a copy）。
+    播放地址带有过期时间，每次连接前都重新获取；连接断开后自动重连并写入新的分段文件，
+    直到下播、达到时长或调用stop()。内存中只保留一个读取块，可以连续录制数小时。
+    文件保存在 {目录}/{房间号}/{房间号}_{开始时间}.{flv/ts/aac}
+    """
+    
+    def __init__(self, room_id, cookies: Dict = None, output_dir: str = LIVE_VIDEO_DIR, audio_only: bool = False,
+                 qn: int = 10000, chunk_size: int = 64 * 1024, retry_delay: float = 5, max_failures: int = 10,
+                 ffmpeg: str = None):
+        self.room_id = room_id
+        self.cookies = cookies or {}
+        self.output_dir = os.path.join(output_dir, str(room_id))
+        self.audio_only = audio_only
+        self.qn = qn
+        self.chunk_size = chunk_size
+        self.retry_delay = retry_delay
+        self.max_failures = max_failures
+        self.ffmpeg = ffmpeg
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Referer': 'https://live.bilibili.com/',
+        }
+        self.files = []
+        self.bytes_written = 0
+        self.started_at = None
+        self._stop_event = threading.Event()
+        self._deadline = None
+    
+    def stop(self) -> None:
+        """请求停止录制，record()会在当前读取块写完后返回"""
+        self._stop_event.set()
+    
+    @property
+    def stopped(self) -> bool:
+        return self._stop_event.is_set() or (self._deadline is not None and time.time() >= self._deadline)
+    
+    def average_rate(self) -> float:
+        """录制开始以来的平均码率（字节/秒）"""
+        if not self.started_at:
+            return 0.0
+        return self.bytes_written / max(time.time() - self.started_at, 1e-6)
+    
+    def _new_file(self, ext: str) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"{self.room_id}_{time.strftime('%Y%m%d_%H%M%S')}")
+        filepath, index = f"{base}.{ext}", 1
+        while os.path.exists(filepath):
+            filepath, index = f"{base}_{index}.{ext}", index + 1
+        return filepath
+    
+    def _record_http(self, urls: list) -> int:
+        """直接下载FLV流，返回本次写入的字节数"""
+        for url in urls:
+            try:
+                response = http_get(url, headers=self.headers, stream=True, timeout=(NETWORK_CONFIG['timeout'], 30))
+            except requests.RequestException as e:
+                logger.warning(f"连接直播流失败: {str(e)}")
+                continue
+            if response.status_code != 200:
+                response.close()
+                continue
+            filepath = self._new_file('flv')
+            written = 0
+            try:
+                with response, open(filepath, 'wb') as f:
+                    for chunk in response.iter_content(self.chunk_size):
+                        f.write(chunk)
+                        written += len(chunk)
+                        self.bytes_written += len(chunk)
+                        if self.stopped:
+                            break
+            except requests.RequestException as e:
+                logger.warning(f"直播间 {self.room_id} 直播流中断: {str(e)}")
+            finally:
+                self._finish_file(filepath)
+            return written
+        raise RuntimeError("所有直播流地址都无法连接")
+    
+    def _record_ffmpeg(self, urls: list) -> int:
+        """用ffmpeg拉流并直接复制音视频数据，返回本次写入的字节数
         
-        if data['code'] == 0:
-            if 'data' in data and data['data']:
-                anchor_data = data['data']
-                info = anchor_data['info']
-                level = anchor_data['level']
-                
-                print("\n主播详细信息:")
-                print("="*50)
-                
-                # 基本信息
-                print("基本信息:")
-                print(f"UID: {info['uid']}")
-                print(f"用户名: {info['uname']}")
-                print(f"头像: {info['face']}")
-                print(f"排名: {info['rank']}")
-                print(f"平台用户等级: {info['platform_user_level']}")
-                
-                # 认证状态
-                print(f"\n认证状态:")
-                print(f"手机认证: {'已认证' if info['mobile_verify'] == 1 else '未认证'}")
-                print(f"身份认证: {'已认证' if info['identification'] == 1 else '未认证'}")
-                
-                # 官方认证信息
-                if info['official_verify']['type'] != -1:
-                    verify_type = "认证" if info['official_verify']['type'] == 0 else "机构认证"
-                    print(f"认证类型: {verify_type}")
-                    print(f"认证说明: {info['official_verify']['desc']}")
-                
-                # 性别
-                gender_map = {
-                    -1: "保密",
-                    0: "女",
-                    1: "男"
-                }
-                print(f"性别: {gender_map.get(info['gender'], '未知')}")
-                
-                # 等级信息
-                print("\n等级信息:")
-                master_level = level['master_level']
-                print(f"主播等级: {master_level['level']}")
-                print(f"用户等级: {level['user_level']}")
-                print(f"主播积分: {master_level['anchor_score']}")
-                if master_level['upgrade_score'] > 0:
-                    print(f"升级还需: {master_level['upgrade_score']}")
-                
-                # 消费信息
-                print("\n消费信息:")
-                print(f"消费金额: {level['cost']}")
-                print(f"充值金额: {level['rcost']}")
-                
-                # VIP信息
-                print("\nVIP状态:")
-                if level['vip'] == 1:
-                    print(f"VIP到期时间: {level['vip_time']}")
-                else:
-                    print("不是VIP")
-                if level['svip'] == 1:
-                    print(f"SVIP到期时间: {level['svip_time']}")
+        与_record_http一样依次尝试各CDN节点：ffmpeg没写出任何数据就异常退出时换下一个节点。
+        """
+        ffmpeg = self.ffmpeg or find_ffmpeg()
+        if not ffmpeg:
+            raise RuntimeError("录制HLS流或只录音频需要安装ffmpeg")
+        error = "没有可用的直播流地址"
+        for url in urls:
+            size, returncode, error = self._run_ffmpeg(ffmpeg, url)
+            if size or returncode in (0, None) or self.stopped:
+                return size
+            logger.warning(f"直播间 {self.room_id} 拉流失败（{error}），尝试下一个节点")
+        raise RuntimeError(error)
+    
+    def _run_ffmpeg(self, ffmpeg: str, url: str) -> tuple:
+        """运行一次ffmpeg录制，返回(写入字节数, 退出码, 错误信息)"""
+        # ADTS和MPEG-TS都可以在任意位置截断，录制中断也不会损坏整个文件
+        filepath = self._new_file('aac' if self.audio_only else 'ts')
+        output_args = ['-vn', '-c:a', 'copy', '-f', 'adts'] if self.audio_only else ['-c', 'copy', '-f', 'mpegts']
+        cmd = [ffmpeg, '-nostdin', '-y', '-loglevel', 'error',
+               '-user_agent', self.headers['User-Agent'], '-headers', f"Referer: {self.headers['Referer']}\r\n",
+               '-rw_timeout', '30000000', '-i', url] + output_args + [filepath]
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr)
+            size = 0
+            while True:
+                try:
+                    process.wait(1)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                if self.stopped:
+                    process.terminate()  # ffmpeg收到SIGTERM后会写完文件尾再退出
+                    try:
+                        process.wait(10)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+                    break
+                if os.path.exists(filepath):
+                    new_size = os.path.getsize(filepath)
+                    self.bytes_written += new_size - size
+                    size = new_size
+            process.wait()
+            if os.path.exists(filepath):
+                self.bytes_written += os.path.getsize(filepath) - size
+                size = os.path.getsize(filepath)
+            stderr.seek(0)
+            error = stderr.read().decode('utf-8', 'replace').strip().splitlines()
+        self._finish_file(filepath)
+        return size, process.returncode, error[-1] if error else f"ffmpeg退出码 {process.returncode}"
+    
+    def _finish_file(self, filepath: str) -> None:
+        if os.path.exists(filepath) and os.path.getsize(filepath) == 0:
+            os.remove(filepath)
+        elif os.path.exists(filepath):
+            self.files.append(filepath)
+            logger.info(f"直播间 {self.room_id} 录制分段已保存: {filepath}")
+    
+    def record(self, duration: float = None) -> list:
+        """开始录制，直到下播、达到时长、调用stop()或连续失败max_failures次
+        
+        Args:
+            duration (float): 录制时长（秒），None表示录到下播
+            
+        Returns:
+            list: 录制的分段文件
+        """
+        self.started_at = time.time()
+        self._deadline = self.started_at + duration if duration else None
+        failures = 0
+        while not self.stopped:
+            try:
+                live_status, candidates = get_live_play_streams(self.room_id, self.qn, self.cookies)
+                if live_status != 1:
+                    logger.info(f"直播间 {self.room_id} 未在直播，停止录制")
+                    break
+                if not candidates:
+                    raise RuntimeError("没有可用的直播流")
+                candidate = candidates[0]
+                if self.audio_only or candidate['protocol'] != 'http_stream':
+                    written = self._record_ffmpeg(candidate['urls'])
                 else:
-                    print("不是SVIP")
-                
-                # SAN值
-                print(f"\nSAN值: {anchor_data['san']}/12")
-                
-                print("="*50)
-            else:
-                print("未找到主播信息")
-        else:
-            print(f"获取主播信息失败：{data['message']}")
-                
-    except Exception as e:
-        print(f"获取主播信息时出错: {str(e)}")
+                    written = self._record_http(candidate['urls'])
+                failures = 0 if written else failures + 1
+            except (RuntimeError, requests.RequestException, OSError, ValueError) as e:
+                failures += 1
+                logger.warning(f"直播间 {self.room_id} 录制出错: {str(e)}")
+            if failures >= self.max_failures:
+                logger.error(f"直播间 {self.room_id} 连续 {failures} 次录制失败，放弃录制")
+                break
+            if failures:
+                self._stop_event.wait(min(self.retry_delay * failures, 60))
+        return self.files
+
+# 估算新开始录制的直播间占用的带宽（字节/秒），录制满LIVE_RATE_SAMPLE_SECONDS后改用实测平均码率
+LIVE_VIDEO_ESTIMATED_RATE = 1024 * 1024
+LIVE_AUDIO_ESTIMATED_RATE = 32 * 1024
+LIVE_RATE_SAMPLE_SECONDS = 30
+
+def load_uid_list(filepath: str) -> list:
+    """从文件读取UID列表，每行一个或多个UID（逗号/空格分隔），#后为注释"""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return [uid for line in f for uid in parse_id_list(line.split('#', 1)[0]) if uid.isdigit()]
+
+class LiveAutoRecorder:
+    """监视一组主播，开播时自动录制直播流和弹幕，下播时停止
+    
+    开播/下播由LiveStatusPoller批量查询得到；每个直播间的直播流由LiveStreamRecorder在独立线程中录制，
+    弹幕由同一个LiveDanmakuRecorder事件循环（后台线程）录制。同时录制的直播间受两项预算限制：
+        带宽  所有录制中直播流的码率之和不超过max_bandwidth，超出时新开播的直播间排队等待
+        磁盘  本次写入总量不超过max_disk_bytes、剩余空间不低于min_free_bytes，超出时停止全部录制
+    
+    用法:
+        recorder = LiveAutoRecorder(uids, cookies, max_bandwidth=parse_rate('4M'))
+        recorder.run()
+    """
+    
+    def __init__(self, uids: list, cookies: Dict = None, output_dir: str = LIVE_VIDEO_DIR,
+                 danmaku_dir: str = LIVE_RECORD_DIR, interval: float = 60, audio_only: bool = False,
+                 qn: int = 10000, max_bandwidth: int = 0, max_disk_bytes: int = 0,
+                 min_free_bytes: int = 1024**3, record_danmaku: bool = True):
+        self.cookies = cookies or {}
+        self.output_dir = output_dir
+        self.danmaku_dir = danmaku_dir
+        self.interval = interval
+        self.audio_only = audio_only
+        self.qn = qn
+        self.max_bandwidth = max_bandwidth
+        self.max_disk_bytes = max_disk_bytes
+        self.min_free_bytes = min_free_bytes
+        self.record_danmaku = record_danmaku
+        if max_bandwidth and max_bandwidth < self.estimated_rate():
+            logger.warning(f"带宽预算 {max_bandwidth / 1024:.0f} KB/s 低于单个直播间的估计码率 "
+                           f"{self.estimated_rate() / 1024:.0f} KB/s，同一时间只会录制一个直播间")
+        self.poller = LiveStatusPoller(uids, interval)
+        self.live = {}           # uid -> 最近一次开播事件
+        self.recordings = {}     # uid -> (LiveStreamRecorder, 线程, 房间号)
+        self.finished_bytes = 0
+        self.files = []
+        self.disk_full = False
+        self.danmaku = None
+        self._danmaku_loop = None
+        self._danmaku_thread = None
+        self._danmaku_ready = threading.Event()
+        self._stop_event = threading.Event()
+    
+    def stop(self) -> None:
+        """请求停止，run()会停止全部录制后返回"""
+        self._stop_event.set()
+    
+    def estimated_rate(self, recorder: 'LiveStreamRecorder' = None) -> float:
+        """一个直播间占用的带宽（字节/秒）"""
+        estimate = LIVE_AUDIO_ESTIMATED_RATE if self.audio_only else LIVE_VIDEO_ESTIMATED_RATE
+        if recorder is None or not recorder.started_at or time.time() - recorder.started_at < LIVE_RATE_SAMPLE_SECONDS:
+            return estimate
+        return recorder.average_rate()
+    
+    def bandwidth_in_use(self) -> float:
+        return sum(self.estimated_rate(recorder) for recorder, _, _ in self.recordings.values())
+    
+    def bytes_written(self) -> int:
+        """本次已写入的直播流字节数（包括已结束的录制）"""
+        return self.finished_bytes + sum(recorder.bytes_written for recorder, _, _ in self.recordings.values())
+    
+    def _disk_exhausted(self) -> bool:
+        if self.max_disk_bytes and self.bytes_written() >= self.max_disk_bytes:
+            logger.error(f"已写入 {self.bytes_written() / 1024**3:.2f} GB，达到磁盘预算，停止全部录制")
+            return True
+        if self.min_free_bytes:
+            os.makedirs(self.output_dir, exist_ok=True)
+            free = shutil.disk_usage(self.output_dir).free
+            if free < self.min_free_bytes:
+                logger.error(f"剩余磁盘空间 {free / 1024**3:.2f} GB，低于下限，停止全部录制")
+                return True
+        return False
+    
+    async def _run_danmaku(self) -> None:
+        self._danmaku_loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(self.danmaku.run())
+        # 让run()先创建停止事件，再允许其他线程提交增删直播间的请求
+        await asyncio.sleep(0)
+        self._danmaku_ready.set()
+        await task
+    
+    def _danmaku_call(self, coro) -> None:
+        """在弹幕录制线程的事件循环中执行协程并等待完成"""
+        if self._danmaku_thread is None:
+            self.danmaku = LiveDanmakuRecorder(self.cookies, self.danmaku_dir)
+            self._danmaku_thread = threading.Thread(target=asyncio.run, args=(self._run_danmaku(),), daemon=True)
+            self._danmaku_thread.start()
+            self._danmaku_ready.wait()
+        asyncio.run_coroutine_threadsafe(coro, self._danmaku_loop).result()
+    
+    async def _add_danmaku_room(self, room_id: int) -> None:
+        self.danmaku.add_room(room_id)
+    
+    def _start(self, uid: str, change: dict) -> None:
+        room_id = int(change['room_id'])
+        recorder = LiveStreamRecorder(room_id, self.cookies, self.output_dir, self.audio_only, self.qn)
+        thread = threading.Thread(target=recorder.record, name=f"live-{room_id}", daemon=True)
+        self.recordings[uid] = (recorder, thread, room_id)
+        logger.info(f"{change['uname']} 开播，开始录制直播间 {room_id}")
+        thread.start()
+        if self.record_danmaku:
+            self._danmaku_call(self._add_danmaku_room(room_id))
+    
+    def _stop_recording(self, uid: str) -> None:
+        recorder, thread, room_id = self.recordings.pop(uid)
+        recorder.stop()
+        thread.join()
+        if self.record_danmaku and self.danmaku is not None:
+            self._danmaku_call(self.danmaku.remove_room(room_id))
+        self.finished_bytes += recorder.bytes_written
+        self.files.extend(recorder.files)
+        logger.info(f"直播间 {room_id} 录制结束，{len(recorder.files)} 个分段，{recorder.bytes_written / 1024**2:.1f} MB")
+    
+    def poll_once(self) -> list:
+        """查询一次直播状态并调整录制中的直播间，返回本次的状态变化"""
+        changes = self.poller.poll_once()
+        for change in changes:
+            if change['type'] == 'live':
+                self.live[change['uid']] = change
+            elif change['type'] == 'offline':
+                self.live.pop(change['uid'], None)
+                if change['uid'] in self.recordings:
+                    self._stop_recording(change['uid'])
+        # 录制线程自行结束（下播或连续失败）时回收；仍在直播的下次重新开始录制
+        for uid in [uid for uid, (_, thread, _) in self.recordings.items() if not thread.is_alive()]:
+            self._stop_recording(uid)
+        if self._disk_exhausted():
+            self.disk_full = True
+            for uid in list(self.recordings):
+                self._stop_recording(uid)
+            return changes
+        for uid, change in self.live.items():
+            if uid in self.recordings:
+                continue
+            # 预算只限制同时录制的数量，没有录制中的直播间时总是至少录制一个，预算再小也不会一个都不录
+            if self.recordings and self.max_bandwidth and \
+                    self.bandwidth_in_use() + self.estimated_rate() > self.max_bandwidth:
+                logger.warning(f"带宽预算不足，{change['uname']} (房间号: {change['room_id']}) 等待其他录制结束")
+                continue
+            self._start(uid, change)
+        return changes
+    
+    def close(self) -> None:
+        """停止全部录制和弹幕录制线程"""
+        for uid in list(self.recordings):
+            self._stop_recording(uid)
+        if self._danmaku_thread is not None:
+            self._danmaku_loop.call_soon_threadsafe(self.danmaku.stop)
+            self._danmaku_thread.join()
+            self._danmaku_thread = None
+    
+    def run(self, duration: float = None) -> list:
+        """持续监视直到stop()、达到时长或磁盘预算耗尽
+        
+        Args:
+            duration (float): 运行时长（秒），None表示一直运行
+            
+        Returns:
+            list: 录制的全部分段文件
+        """
+        deadline = time.time() + duration if duration else None
+        try:
+            while not self._stop_event.is_set() and not self.disk_full:
+                started = time.time()
+                try:
+                    for change in self.poll_once():
+                        print(format_live_change(change))
+                except (RuntimeError, requests.RequestException, ValueError) as e:
+                    logger.warning(f"查询直播状态失败: {str(e)}")
+                timeout = max(0, self.interval - (time.time() - started))
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.time())
+                    if timeout <= 0:
+                        break
+                self._stop_event.wait(timeout)
+        finally:
+            self.close()
+        return self.files
 
 class LiveRoom:
     """B站直播间相关功能类"""
     
-    def __init__(self):
+    def __init__(self, cookies: Dict = None):
+        self.cookies = cookies or {}
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Referer': 'https://live.bilibili.com',
@@ -2354,7 +5761,7 @@ class LiveRoom:
         try:
             url = 'https://api.live.bilibili.com/room/v1/Room/get_info'
             params = {'room_id': room_id}
-            response = requests.get(url, params=params, headers=self.headers)
+            response = http_get(url, params=params, headers=self.headers)
             data = response.json()
             
             if data['code'] == 0:
@@ -2419,7 +5826,7 @@ class LiveRoom:
         try:
             url = 'https://api.live.bilibili.com/live_user/v1/Master/info'
             params = {'uid': uid}
-            response = requests.get(url, params=params, headers=self.headers)
+            response = http_get(url, params=params, headers=self.headers)
             data = response.json()
             
             if data['code'] == 0:
@@ -2480,11 +5887,20 @@ class LiveRoom:
     
     def get_room_base_info(self, room_ids: list) -> None:
         """获取多个直播间基本信息"""
-        # 原get_room_base_info函数的内容
+        room_ids = [self._process_room_id(room_id) for room_id in room_ids]
+        room_ids = [room_id for room_id in room_ids if room_id.isdigit()]
+        if not room_ids:
+            print("请输入有效的直播间号或链接！")
+            return
+        get_room_base_info(room_ids)
         
     def get_batch_live_status(self, uids: list) -> None:
         """批量查询直播间状态"""
-        # 原get_batch_live_status函数的容
+        uids = [uid for uid in uids if uid.isdigit()]
+        if not uids:
+            print("请输入有效的用户UID！")
+            return
+        get_batch_live_status(uids)
         
     def get_history_danmaku(self, room_input: str) -> None:
         """获取直播间历史弹幕"""
@@ -2515,7 +5931,7 @@ class LiveRoom:
         try:
             url = 'https://api.live.bilibili.com/xlive/web-room/v1/dM/gethistory'
             params = {'roomid': room_id}
-            response = requests.get(url, params=params, headers=self.headers)
+            response = http_get(url, params=params, headers=self.headers)
             data = response.json()
             
             if data['code'] == 0:
@@ -2527,57 +5943,56 @@ class LiveRoom:
             print(f"获取最近弹幕时出错: {str(e)}")
 
     def _monitor_danmaku(self, room_id: str) -> None:
-        """持续监听直播间弹幕"""
+        """通过直播信息流实时监听直播间弹幕、礼物和醒目留言"""
         try:
-            duration = input("请输��监听时长（分钟）[30]: ").strip()
+            duration = input("请输入监听时长（分钟）[30]: ").strip()
             duration = int(duration) if duration.isdigit() else 30
-            interval = input("请输入获取间隔（秒）[10]: ").strip()
-            interval = int(interval) if interval.isdigit() else 10
             
-            print(f"\n开始监听直播间 {room_id} 的弹幕")
-            print(f"将持续监听 {duration} 分钟，每 {interval} 秒获取一次")
-            print("按Ctrl+C可以随时停止")
-            
-            # 创建文件
             danmaku_dir = os.path.join("弹幕", "直播弹幕")
-            if not os.path.exists(danmaku_dir):
-                os.makedirs(danmaku_dir)
-            
             filename = f"{room_id} {time.strftime('%Y-%m-%d %H-%M-%S', time.localtime())} 监听弹幕.txt"
             filepath = os.path.join(danmaku_dir, filename)
             
-            seen_msgs = set()  # 用于去重
-            start_time = time.time()
+            print(f"\n开始监听直播间 {room_id} 的弹幕，持续 {duration} 分钟")
+            print("按Ctrl+C可以随时停止")
             
-            with open(filepath, 'w', encoding='utf-8') as f:
-                try:
-                    while time.time() - start_time < duration * 60:
-                        new_msgs = self._fetch_danmaku(room_id)
-                        for msg in new_msgs:
-                            msg_id = f"{msg['timeline']}_{msg['nickname']}_{msg['text']}"
-                            if msg_id not in seen_msgs:
-                                seen_msgs.add(msg_id)
-                                # 写入文件
-                                f.write(f"时间: {msg['timeline']}\n")
-                                f.write(f"用户: {msg['nickname']} (UID: {msg['uid']})\n")
-                                if msg['medal']:
-                                    f.write(f"勋章: {msg['medal'][1]} {msg['medal'][0]}级\n")
-                                f.write(f"内容: {msg['text']}\n")
-                                f.write("-"*30 + "\n")
-                                f.flush()  # 立即写入文件
-                        
-                        time.sleep(interval)
-                    
-                    print(f"\n监完成，共收集到 {len(seen_msgs)} 条弹幕")
-                    print(f"弹幕已保存到文件: {filepath}")
-                    
-                except KeyboardInterrupt:
-                    print("\n用户停止监听")
-                    print(f"已收集到 {len(seen_msgs)} 条弹幕")
-                    print(f"弹幕已保存到文件: {filepath}")
+            sink = LiveEventFileSink(filepath)
+            client = LiveDanmakuClient(room_id, self.cookies, sinks=[sink, print_live_event])
+            try:
+                asyncio.run(client.run(duration * 60))
+                print(f"\n监听完成，共收集到 {sink.count} 条消息")
+            except KeyboardInterrupt:
+                print("\n用户停止监听")
+                print(f"已收集到 {sink.count} 条消息")
+            except (RuntimeError, ConnectionError, OSError) as e:
+                print(f"连接直播信息流失败（{str(e)}），改为每10秒获取一次最近弹幕")
+                self._poll_danmaku(room_id, duration, 10, sink)
+            finally:
+                sink.close()
+            print(f"弹幕已保存到文件: {filepath}")
                 
         except Exception as e:
             print(f"监听弹幕时出错: {str(e)}")
+    
+    def _poll_danmaku(self, room_id: str, duration: int, interval: int, sink: LiveEventFileSink) -> None:
+        """轮询gethistory接口获取最近弹幕，信息流不可用时的后备方式（只能拿到最近约10条）"""
+        deduper = LiveMessageDeduper()  # 每次返回的最近弹幕大部分与上次重复
+        start_time = time.time()
+        collected = 0
+        try:
+            while time.time() - start_time < duration * 60:
+                for msg in self._fetch_danmaku(room_id):
+                    if not deduper.seen((msg['timeline'], msg['uid'], msg['text'])):
+                        collected += 1
+                        lines = [f"时间: {msg['timeline']}", f"用户: {msg['nickname']} (UID: {msg['uid']})"]
+                        if msg['medal']:
+                            lines.append(f"勋章: {msg['medal'][1]} {msg['medal'][0]}级")
+                        lines.append(f"内容: {msg['text']}")
+                        sink.write_line('\n'.join(lines) + '\n' + '-' * 30)
+                time.sleep(interval)
+            print(f"\n监听完成，共收集到 {collected} 条弹幕")
+        except KeyboardInterrupt:
+            print("\n用户停止监听")
+            print(f"已收集到 {collected} 条弹幕")
 
     def _save_danmaku_to_file(self, room_id: str, data: dict) -> None:
         """保存弹幕到文件"""
@@ -2622,7 +6037,7 @@ class LiveRoom:
         """获取一次弹幕数据"""
         url = 'https://api.live.bilibili.com/xlive/web-room/v1/dM/gethistory'
         params = {'roomid': room_id}
-        response = requests.get(url, params=params, headers=self.headers)
+        response = http_get(url, params=params, headers=self.headers)
         data = response.json()
         
         if data['code'] == 0:
@@ -2669,7 +6084,7 @@ class LiveRoom:
                 'dolby': '5',
                 'panorama': '1'
             }
-            response = requests.get(url, params=params, headers=headers)
+            response = http_get(url, params=params, headers=headers)
             data = response.json()
             
             if data['code'] == 0:
@@ -2732,6 +6147,20 @@ class LiveRoom:
                 
                 print("="*50)
                 
+                if room_info['live_status'] == 1:
+                    choice = input("\n是否录制该直播间？(y/n) [n]: ").lower()
+                    if choice == 'y':
+                        audio_only = input("是否只录音频（需要ffmpeg）？(y/n) [n]: ").lower() == 'y'
+                        recorder = LiveStreamRecorder(room_info['room_id'], self.cookies, audio_only=audio_only)
+                        print("开始录制，按Ctrl+C停止")
+                        try:
+                            recorder.record()
+                        except KeyboardInterrupt:
+                            recorder.stop()
+                            print("\n用户停止录制")
+                        for filepath in recorder.files:
+                            print(f"已保存: {filepath}")
+                
             else:
                 print(f"获取直播间播放信息失败：{data['message']}")
                 
@@ -2752,7 +6181,7 @@ class LiveRoom:
         try:
             url = 'https://api.live.bilibili.com/live_user/v1/UserInfo/get_anchor_in_room'
             params = {'roomid': room_id}
-            response = requests.get(url, params=params, headers=headers)
+            response = http_get(url, params=params, headers=headers)
             data = response.json()
             
             if data['code'] == 0:
@@ -2882,7 +6311,7 @@ def send_old_fan_message(up_mid: str, content: str, cookies: Dict) -> bool:
         
         # 发送请求
         url = 'https://api.bilibili.com/x/v1/contract/add_message'
-        response = requests.post(url, data=data, cookies=cookies, headers=headers)
+        response = http_post(url, data=data, cookies=cookies, headers=headers)
         result = response.json()
         
         if result['code'] == 0:
@@ -2928,7 +6357,7 @@ def join_old_fan_plan(up_mid: str, cookies: Dict) -> bool:
         }
         
         url = 'https://api.bilibili.com/x/v1/contract/add_contract'
-        response = requests.post(url, data=data, cookies=cookies, headers=headers)
+        response = http_post(url, data=data, cookies=cookies, headers=headers)
         result = response.json()
         
         if result['code'] == 0:
@@ -2978,13 +6407,13 @@ def check_follow_status(up_mid: str, cookies: Dict) -> bool:
     try:
         # 获取关注状态
         url = f'https://api.bilibili.com/x/relation/stat?vmid={up_mid}'
-        response = requests.get(url, cookies=cookies, headers=headers)
+        response = http_get(url, cookies=cookies, headers=headers)
         data = response.json()
         
         if data['code'] == 0:
             # 获取UP主信息
             info_url = f'https://api.bilibili.com/x/space/acc/info?mid={up_mid}'
-            info_response = requests.get(info_url, headers=headers)
+            info_response = http_get(info_url, headers=headers)
             info_data = info_response.json()
             
             if info_data['code'] == 0:
@@ -2997,7 +6426,7 @@ def check_follow_status(up_mid: str, cookies: Dict) -> bool:
                 
                 # 检查关注状态
                 relation_url = f'https://api.bilibili.com/x/relation?fid={up_mid}'
-                relation_response = requests.get(relation_url, cookies=cookies, headers=headers)
+                relation_response = http_get(relation_url, cookies=cookies, headers=headers)
                 relation_data = relation_response.json()
                 
                 if relation_data['code'] == 0:
@@ -3048,7 +6477,7 @@ def follow_up(up_mid: str, cookies: Dict) -> bool:
         }
         
         url = 'https://api.bilibili.com/x/relation/modify'
-        response = requests.post(url, data=data, cookies=cookies, headers=headers)
+        response = http_post(url, data=data, cookies=cookies, headers=headers)
         result = response.json()
         
         if result['code'] == 0:
@@ -3089,7 +6518,7 @@ def report_video(aid: str, tid: str, desc: str, attach: str, cookies: Dict, vide
         cookies['Buid'] = headers['buid']
         
         url = 'https://api.bilibili.com/x/web-interface/appeal/v2/submit'
-        response = requests.post(url, data=data, cookies=cookies, headers=headers)
+        response = http_post(url, data=data, cookies=cookies, headers=headers)
         result = response.json()
         
         if result['code'] == 0:
@@ -3149,7 +6578,7 @@ def report_video_with_image(aid: str, tid: str, desc: str, image_url: str, cooki
         cookies['Buid'] = headers['buid']
         
         url = 'https://api.bilibili.com/x/web-interface/appeal/v2/submit'
-        response = requests.post(url, data=data, cookies=cookies, headers=headers)
+        response = http_post(url, data=data, cookies=cookies, headers=headers)
         result = response.json()
         
         if result['code'] == 0:
@@ -3193,7 +6622,7 @@ def get_report_types() -> dict:
     
     try:
         url = 'https://api.bilibili.com/x/web-interface/archive/appeal/tags'
-        response = requests.get(url, headers=headers)
+        response = http_get(url, headers=headers)
         data = response.json()
         
         if data['code'] == 0:
@@ -3217,14 +6646,7 @@ def show_report_menu(bvid: str, cookies: Dict) -> None:
     """显示举报菜单"""
     try:
         # 获取视频aid
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Referer': 'https://www.bilibili.com',
-        }
-        
-        video_url = f'https://api.bilibili.com/x/web-interface/view?bvid={bvid}'
-        response = requests.get(video_url, headers=headers)
-        data = response.json()
+        data = get_video_view(bvid)
         
         if data['code'] == 0:
             aid = str(data['data']['aid'])
@@ -3353,7 +6775,7 @@ def upload_report_image(image_path: str, cookies: Dict) -> str:
         
         url = 'https://member.bilibili.com/x/vu/web/cover/up'
         params = {'ts': int(time.time() * 1000)}
-        response = requests.post(url, params=params, data=data, cookies=cookies, headers=headers)
+        response = http_post(url, params=params, data=data, cookies=cookies, headers=headers)
         result = response.json()
         
         if result['code'] == 0:
@@ -3392,7 +6814,7 @@ def search_videos_request(keyword: str, cookies: Dict, page: int = 1, order: str
         
         # 使用新的搜索API
         url = 'https://api.bilibili.com/x/web-interface/wbi/search/all/v2'
-        response = requests.get(url, params=params, cookies=cookies, headers=headers)
+        response = http_get(url, params=params, cookies=cookies, headers=headers)
         data = response.json()
         
         if data['code'] == 0:
@@ -3505,13 +6927,7 @@ def show_search_menu(cookies: Dict) -> None:
                     download_audio(video['bvid'], cookies)
                 elif op == "2":
                     # 获取视频cid
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                        'Referer': 'https://www.bilibili.com',
-                    }
-                    video_url = f'https://api.bilibili.com/x/web-interface/view?bvid={video["bvid"]}'
-                    response = requests.get(video_url, headers=headers)
-                    data = response.json()
+                    data = get_video_view(video["bvid"])
                     if data['code'] == 0:
                         cid = data['data']['cid']
                         get_danmaku(cid, video['bvid'], 1, cookies)
@@ -3705,8 +7121,6 @@ def batch_report_videos(cookies: Dict) -> None:
                     fail_count += 1
                 
                 pbar.update(1)
-                # 添���延时，避免���求过快
-                time.sleep(2)
         
         print(f"\n批量举报完成！成功: {success_count}, 失败: {fail_count}")
 
@@ -3787,7 +7201,7 @@ def get_wbi_keys(cookies: Dict = None) -> tuple:
         
         url = 'https://api.bilibili.com/x/web-interface/nav'
         # 添加cookies参数
-        response = requests.get(url, cookies=cookies, headers=headers)
+        response = http_get(url, cookies=cookies, headers=headers)
         data = response.json()
         
         if data['code'] == 0:
@@ -3866,13 +7280,11 @@ def encode_wbi(params: dict, cookies: Dict = None) -> dict:
     wts = str(int(time.time()))
     params['wts'] = wts
     
-    # 按键名升序排序并拼接参数
-    sorted_params = dict(sorted(params.items()))
-    query = []
-    for k, v in sorted_params.items():
-        # URL编码,需要大写
-        query.append(f"{k}={requests.utils.quote(str(v), safe='').upper()}")
-    query = '&'.join(query)
+    # 过滤值中的 !'()* 字符（服务端签名时同样会去掉），按键名升序排序后URL编码；
+    # 只有百分号转义是大写的，值本身不能转大写，否则含小写字母的参数签名对不上
+    for k, v in params.items():
+        params[k] = re.sub(r"[!'()*]", '', str(v))
+    query = urlencode(sorted(params.items()))
     
     # 计算w_rid
     w_rid = hashlib.md5((query + mixin_key).encode()).hexdigest()
@@ -4046,7 +7458,6 @@ def show_maipi_menu(cookies: Dict) -> None:
                                 fail_count += 1
                             
                             pbar.update(1)
-                            time.sleep(2)
                     
                     # 保存新举报的BV号
                     if reported:
@@ -4087,7 +7498,7 @@ def search_videos(keyword: str, cookies: Dict, page: int = 1, order: str = 'tota
         
         # 使用搜索结果API而不是搜索请求API
         url = 'https://api.bilibili.com/x/web-interface/search/type'
-        response = requests.get(url, params=params, cookies=cookies, headers=headers)
+        response = http_get(url, params=params, cookies=cookies, headers=headers)
         data = response.json()
         
         if data['code'] == 0:
@@ -4117,7 +7528,261 @@ def search_videos(keyword: str, cookies: Dict, page: int = 1, order: str = 'tota
         print(f"搜索时出错: {str(e)}")
         return []
 
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """解析命令行参数，不带子命令时进入交互菜单"""
+    parser = argparse.ArgumentParser(description="B站工具箱")
+    subparsers = parser.add_subparsers(dest='command')
+    
+    batch_parser = subparsers.add_parser('batch-download', help='并发批量下载文件中所有BV号的音频')
+    batch_parser.add_argument('-f', '--file', default='bvid.txt', help='BV号/链接列表文件 (默认: bvid.txt)')
+    batch_parser.add_argument('-j', '--jobs', type=int, default=4, help='同时下载的数量 (默认: 4)')
+    batch_parser.add_argument('--limit-rate', default=None, help='全局带宽上限，如 500K、8M (默认不限速)')
+    batch_parser.add_argument('--retries', type=int, default=3, help='每个条目的最大尝试次数 (默认: 3)')
+    batch_parser.add_argument('--backend', choices=['auto', 'api', 'subprocess', 'native'], default='auto',
+                              help='下载后端: api为进程内yt_dlp, subprocess为yt-dlp命令, '
+                                   'native为直接多连接下载DASH伴音 (默认: auto)')
+    batch_parser.add_argument('--format', dest='output_format', choices=OUTPUT_FORMATS, default=None,
+                              help='下载完成后转换格式，与下载并行进行: mp3重新编码, '
+                                   'm4a/aac/flac/copy不重新编码直接封装 (默认不转换)')
+    batch_parser.add_argument('--mp3', dest='output_format', action='store_const', const='mp3',
+                              help='等同于 --format mp3')
+    batch_parser.add_argument('--force', action='store_true', help='忽略下载存档，重新下载所有条目')
+    batch_parser.add_argument('--transcode-jobs', type=int, default=None,
+                              help='同时转码的数量 (默认: CPU核心数)')
+    
+    dm_export_parser = subparsers.add_parser('danmaku-export', help='无交互导出视频全部弹幕为JSONL/CSV/Parquet/ASS字幕')
+    dm_export_parser.add_argument('bvid', help='视频BV号或链接')
+    dm_export_parser.add_argument('-p', '--page', type=int, default=1, help='分P编号 (默认: 1)')
+    dm_export_parser.add_argument('-o', '--output', default=None, help='输出文件 (默认: 弹幕/BV号_P分P.格式)')
+    dm_export_parser.add_argument('--format', choices=DANMAKU_EXPORT_FORMATS + ['ass'], default=None,
+                                  help='导出格式，默认按输出文件扩展名判断，否则为jsonl')
+    dm_export_parser.add_argument('-j', '--jobs', type=int, default=8, help='同时请求的弹幕分段数 (默认: 8)')
+    dm_export_parser.add_argument('--xml', action='store_true', help='使用旧版XML接口一次性获取（弹幕数受上限限制）')
+    
+    sync_parser = subparsers.add_parser('sync', help='增量同步视频弹幕，只追加新出现的弹幕')
+    sync_parser.add_argument('ids', nargs='*', help='视频BV号或链接')
+    sync_parser.add_argument('-f', '--file', default=None, help='关注列表文件，每行一个BV号/链接')
+    sync_parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl', help='保存格式 (默认: jsonl)')
+    sync_parser.add_argument('-d', '--dir', default=DANMAKU_SYNC_DIR, help=f'保存目录 (默认: {DANMAKU_SYNC_DIR})')
+    sync_parser.add_argument('-j', '--jobs', type=int, default=8, help='同时请求的弹幕分段数 (默认: 8)')
+    
+    comments_parser = subparsers.add_parser('comments', help='爬取视频完整评论区（含楼中楼）为JSONL/CSV/SQLite，可断点续爬')
+    comments_parser.add_argument('bvid', help='视频BV号或链接')
+    comments_parser.add_argument('-o', '--output', default=None, help='输出文件 (默认: 评论/BV号_评论.jsonl)')
+    comments_parser.add_argument('--sort', choices=list(COMMENT_SORT_MODES), default='hot', help='排序方式 (默认: hot)')
+    comments_parser.add_argument('-j', '--jobs', type=int, default=4, help='同时获取楼中楼回复的评论数 (默认: 4)')
+    comments_parser.add_argument('--restart', action='store_true', help='忽略上次的进度，重新爬取')
+    comments_parser.add_argument('--format', choices=COMMENT_EXPORT_FORMATS, default=None,
+                                 help='保存格式，默认按输出文件扩展名判断，否则为jsonl')
+    
+    live_record_parser = subparsers.add_parser('live-record', help='同时录制多个直播间的弹幕、礼物等实时消息')
+    live_record_parser.add_argument('rooms', nargs='*', help='直播间号或链接')
+    live_record_parser.add_argument('-w', '--watchlist', default=None,
+                                    help='直播间关注列表文件，每行一个房间号，修改后自动增删录制的直播间')
+    live_record_parser.add_argument('--format', choices=['jsonl', 'txt'], default='jsonl',
+                                    help='保存格式，jsonl为原始消息，txt只保存弹幕/礼物/醒目留言/上舰 (默认: jsonl)')
+    live_record_parser.add_argument('-d', '--dir', default=LIVE_RECORD_DIR, help=f'保存目录 (默认: {LIVE_RECORD_DIR})')
+    live_record_parser.add_argument('--max-size', type=int, default=64, help='单个文件大小上限（MB），超过后切换新文件 (默认: 64)')
+    live_record_parser.add_argument('--duration', type=float, default=None, help='录制时长（分钟），默认一直录制')
+    
+    live_status_parser = subparsers.add_parser('live-status', help='定时批量查询主播直播状态，只输出开播/下播/改标题')
+    live_status_parser.add_argument('uids', nargs='*', help='主播UID')
+    live_status_parser.add_argument('-f', '--file', default=None, help='UID列表文件，每行一个UID')
+    live_status_parser.add_argument('-i', '--interval', type=float, default=60, help='查询间隔（秒） (默认: 60)')
+    live_status_parser.add_argument('--once', action='store_true', help='只查询一次，输出正在直播的主播')
+    
+    live_stream_parser = subparsers.add_parser('live-stream', help='录制直播流（FLV直接保存，或用ffmpeg只录音频）')
+    live_stream_parser.add_argument('room', help='直播间号或链接')
+    live_stream_parser.add_argument('-o', '--output', default=LIVE_VIDEO_DIR, help=f'保存目录 (默认: {LIVE_VIDEO_DIR})')
+    live_stream_parser.add_argument('--audio-only', action='store_true', help='只录音频（ffmpeg -c:a copy，保存为.aac）')
+    live_stream_parser.add_argument('--qn', type=int, default=10000, help='清晰度代码 (默认: 10000 原画)')
+    live_stream_parser.add_argument('--duration', type=float, default=None, help='录制时长（分钟），默认录到下播')
+    
+    live_auto_parser = subparsers.add_parser('live-auto', help='监视主播直播状态，开播时自动录制直播流和弹幕')
+    live_auto_parser.add_argument('uids', nargs='*', help='主播UID')
+    live_auto_parser.add_argument('-f', '--file', default=None, help='UID列表文件，每行一个UID')
+    live_auto_parser.add_argument('-i', '--interval', type=float, default=60, help='查询间隔（秒） (默认: 60)')
+    live_auto_parser.add_argument('-o', '--output', default=LIVE_VIDEO_DIR, help=f'直播流保存目录 (默认: {LIVE_VIDEO_DIR})')
+    live_auto_parser.add_argument('--danmaku-dir', default=LIVE_RECORD_DIR, help=f'弹幕保存目录 (默认: {LIVE_RECORD_DIR})')
+    live_auto_parser.add_argument('--no-danmaku', action='store_true', help='不录制弹幕')
+    live_auto_parser.add_argument('--audio-only', action='store_true', help='只录音频（ffmpeg -c:a copy，保存为.aac）')
+    live_auto_parser.add_argument('--qn', type=int, default=10000, help='清晰度代码 (默认: 10000 原画)')
+    live_auto_parser.add_argument('--max-bandwidth', default=None, help='同时录制的总码率上限，如 4M (默认不限)')
+    live_auto_parser.add_argument('--max-disk', default=None, help='本次最多写入的数据量，如 50G (默认不限)')
+    live_auto_parser.add_argument('--min-free', default='1G', help='剩余磁盘空间下限 (默认: 1G)')
+    live_auto_parser.add_argument('--duration', type=float, default=None, help='运行时长（分钟），默认一直运行')
+    
+    bvav_parser = subparsers.add_parser('bvav', help='BV号与AV号互转（离线计算，不请求接口）')
+    bvav_parser.add_argument('ids', nargs='*', help='BV号或AV号（av170001 或 170001）')
+    bvav_parser.add_argument('-f', '--file', default=None, help='每行一个BV号/AV号的文件')
+    bvav_parser.add_argument('-o', '--output', default=None, help='结果保存文件（默认直接输出）')
+    
+    return parser.parse_args(argv)
+
+def run_cli(args: argparse.Namespace) -> int:
+    """执行命令行子命令，返回进程退出码"""
+    if args.command == 'bvav':
+        # 纯本地计算，不需要cookies和工作目录
+        failed = 0
+        if args.ids:
+            results = convert_video_ids(args.ids)
+            for src, dst in results:
+                print(f"{src}\t{dst}")
+            failed += sum(1 for _, dst in results if not dst)
+        if args.file:
+            if not os.path.exists(args.file):
+                print(f"错误：找不到{args.file}文件！")
+                return 2
+            failed += convert_video_ids_file(args.file, args.output)
+        return 1 if failed else 0
+    
+    if args.command == 'sync':
+        bvids = [bvid for bvid in map(extract_bvid, args.ids) if bvid]
+        if args.file:
+            if not os.path.exists(args.file):
+                print(f"错误：找不到{args.file}文件！")
+                return 2
+            bvids += extract_bvid_from_file(args.file)
+        bvids = list(dict.fromkeys(bvids))
+        if not bvids:
+            print("错误：没有可同步的BV号！")
+            return 2
+        return 1 if sync_danmaku_batch(bvids, args.format, args.dir, args.jobs) else 0
+    
+    if args.command == 'live-status':
+        uids = [uid for uid in args.uids if uid.isdigit()]
+        if args.file:
+            if not os.path.exists(args.file):
+                print(f"错误：找不到{args.file}文件！")
+                return 2
+            uids += load_uid_list(args.file)
+        if not uids:
+            print("错误：没有可查询的UID！")
+            return 2
+        poller = LiveStatusPoller(uids, args.interval)
+        try:
+            if args.once:
+                for change in poller.poll_once():
+                    print(format_live_change(change))
+                return 0
+            print(f"正在监视 {len(set(uids))} 个主播的直播状态，每 {args.interval:g} 秒查询一次，按Ctrl+C停止")
+            for change in poller.watch():
+                print(format_live_change(change))
+        except (RuntimeError, requests.RequestException) as e:
+            print(str(e))
+            return 1
+        except KeyboardInterrupt:
+            print("\n已停止")
+        return 0
+    
+    if args.command == 'danmaku-export':
+        bvid = extract_bvid(args.bvid)
+        if not bvid:
+            print("无法识别BV号")
+            return 2
+        try:
+            count, output_file = export_danmaku(bvid, args.page, args.output, args.format, args.jobs, args.xml)
+        except (RuntimeError, ValueError) as e:
+            print(str(e))
+            return 1
+        print(f"已导出 {count} 条弹幕到 {output_file}")
+        return 0
+    
+    create_required_directories()
+    cookies = load_cookies_from_file()
+    if not cookies:
+        print("错误：无法从cookies.txt加载有效的cookies")
+        return 1
+    
+    if args.command == 'comments':
+        bvid = extract_bvid(args.bvid)
+        if not bvid:
+            print("无法识别BV号")
+            return 2
+        try:
+            count, output_file = crawl_comments(bvid, args.output, args.sort, args.jobs, cookies, args.restart, args.format)
+        except ValueError as e:
+            print(str(e))
+            return 2
+        except (RuntimeError, requests.RequestException) as e:
+            print(f"{str(e)}，重新运行同一命令可从中断处继续")
+            return 1
+        print(f"已保存 {count} 条评论到 {output_file}")
+        return 0
+    
+    if args.command == 'live-record':
+        room_ids = [extract_room_id(room) if 'live.bilibili.com' in room else room for room in args.rooms]
+        room_ids = [int(room_id) for room_id in room_ids if room_id.isdigit()]
+        if not room_ids and not args.watchlist:
+            print("错误：请指定直播间号或关注列表文件！")
+            return 2
+        recorder = LiveDanmakuRecorder(cookies, args.dir, args.format, args.watchlist, args.max_size * 1024 * 1024)
+        print(f"弹幕保存在 {args.dir}，按Ctrl+C停止录制")
+        try:
+            asyncio.run(recorder.run(room_ids, args.duration * 60 if args.duration else None))
+        except KeyboardInterrupt:
+            print("\n用户停止录制")
+        return 0
+    
+    if args.command == 'live-stream':
+        room_id = extract_room_id(args.room) if 'live.bilibili.com' in args.room else args.room
+        if not room_id.isdigit():
+            print("请输入有效的直播间号或链接！")
+            return 2
+        recorder = LiveStreamRecorder(room_id, cookies, args.output, args.audio_only, args.qn)
+        print(f"开始录制直播间 {room_id}，按Ctrl+C停止")
+        try:
+            files = recorder.record(args.duration * 60 if args.duration else None)
+        except KeyboardInterrupt:
+            recorder.stop()
+            files = recorder.files
+            print("\n用户停止录制")
+        print(f"共录制 {len(files)} 个分段，{recorder.bytes_written / 1024 / 1024:.1f} MB")
+        for filepath in files:
+            print(f"  {filepath}")
+        return 0 if files else 1
+    
+    if args.command == 'live-auto':
+        uids = [uid for uid in args.uids if uid.isdigit()]
+        if args.file:
+            if not os.path.exists(args.file):
+                print(f"错误：找不到{args.file}文件！")
+                return 2
+            uids += load_uid_list(args.file)
+        if not uids:
+            print("错误：没有可监视的UID！")
+            return 2
+        try:
+            budgets = [parse_rate(value) for value in (args.max_bandwidth, args.max_disk, args.min_free)]
+        except ValueError as e:
+            print(str(e))
+            return 2
+        recorder = LiveAutoRecorder(uids, cookies, args.output, args.danmaku_dir, args.interval, args.audio_only,
+                                    args.qn, *budgets, record_danmaku=not args.no_danmaku)
+        print(f"正在监视 {len(set(uids))} 个主播，开播时自动录制到 {args.output}，按Ctrl+C停止")
+        try:
+            recorder.run(args.duration * 60 if args.duration else None)
+        except KeyboardInterrupt:
+            print("\n用户停止录制")
+        print(f"共录制 {len(recorder.files)} 个分段，{recorder.bytes_written() / 1024 / 1024:.1f} MB")
+        return 0
+    
+    if args.command == 'batch-download':
+        try:
+            results = batch_download_audio(cookies, args.file, args.jobs, args.limit_rate,
+                                           args.retries, args.backend, args.output_format, args.transcode_jobs,
+                                           not args.force)
+        except ValueError as e:
+            print(str(e))
+            return 2
+        return 0 if results and all(r['success'] for r in results) else 1
+    return 0
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.command:
+        sys.exit(run_cli(args))
+    
     try:
         main()
     except Exception as e:
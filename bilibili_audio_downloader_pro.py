@@ -47,11 +47,17 @@ import shutil
 import hashlib
 import sys
 import logging
+import threading
 from typing import Dict, Optional, List, Tuple
 from tqdm import tqdm
-from urllib.parse import unquote
+from urllib.parse import unquote, urlsplit
 from pathlib import Path
 
+try:
+    import yt_dlp
+except ImportError:
+    yt_dlp = None  # 未安装时回退到yt-dlp命令行
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -69,6 +75,9 @@ CONFIG = {
     'timeout': 30,
     'download_folder': '音频',
     'ffmpeg_quality': '0',
+    'output_format': 'mp3',  # mp3: 重新编码; m4a/aac/flac: 不重新编码直接封装; copy: 按原始编码自动选择
+    'rate_limit': 5.0,  # 每个主机的初始请求速率（次/秒），风控时自动降低、持续成功后回升
+    'ytdlp_backend': 'auto',  # auto: 优先进程内API; api: 仅API; subprocess: 仅命令行
     'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36'
 }
 
@@ -84,6 +93,78 @@ class DownloadError(BilibiliError):
     """下载相关错误"""
     pass
 
+class TokenBucket:
+    """自适应令牌桶限速器
+    
+    遇到风控时速率减半，连续成功increase_after次后速率增加初始速率的十分之一，直到max_rate。
+    """
+    
+    def __init__(self, rate: float, burst: float = 1, min_rate: float = 0.1, max_rate: float = None,
+                 increase_after: int = 20):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 4
+        self.increase_step = rate / 10
+        self.increase_after = increase_after
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._successes = 0
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """阻塞直到拿到令牌"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay > 0:
+            time.sleep(delay)
+    
+    def on_success(self):
+        """请求成功，连续成功足够次数后提高速率"""
+        with self._lock:
+            self._successes += 1
+            if self._successes >= self.increase_after and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.increase_step)
+                self._successes = 0
+    
+    def on_throttle(self):
+        """触发风控，速率减半并清空积攒的令牌"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0)
+            self._successes = 0
+            logger.warning(f"触发风控，请求速率降至 {self.rate:.2f} 次/秒")
+
+class RateLimitedSession(requests.Session):
+    """按主机限速的会话，根据412/-352风控响应自动调整速率"""
+    
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+    
+    def _get_limiter(self, url: str) -> TokenBucket:
+        host = urlsplit(url).netloc
+        with self._limiters_lock:
+            if host not in self._limiters:
+                self._limiters[host] = TokenBucket(self.rate, burst=max(1, self.rate))
+            return self._limiters[host]
+    
+    def request(self, method, url, *args, **kwargs):
+        limiter = self._get_limiter(url)
+        limiter.acquire()
+        response = super().request(method, url, *args, **kwargs)
+        if response.status_code == 412 or (not kwargs.get('stream') and b'"code":-352' in response.content[:64]):
+            limiter.on_throttle()
+        else:
+            limiter.on_success()
+        return response
+
 class CookieManager:
     """Cookie管理器"""
     
@@ -248,17 +329,33 @@ class FFmpegManager:
         logger.warning("未找到ffmpeg，请确保ffmpeg已正确安装并添加到系统PATH中")
         return ''
     
+    @staticmethod
+    def find_ffprobe(ffmpeg_path: str) -> str:
+        """查找与ffmpeg同目录的ffprobe"""
+        directory, name = os.path.split(ffmpeg_path)
+        candidate = os.path.join(directory, name.replace('ffmpeg', 'ffprobe'))
+        if directory and os.path.isfile(candidate):
+            return candidate
+        return shutil.which('ffprobe') or ''
+    
     @staticmethod
     def get_audio_duration(input_file: str, ffmpeg_path: str) -> float:
-        """获取音频文件时长（秒）"""
+        """获取音频文件时长（秒），只读取容器元数据，不解码音频"""
+        ffprobe_path = FFmpegManager.find_ffprobe(ffmpeg_path)
+        if ffprobe_path:
+            try:
+                result = subprocess.run(
+                    [ffprobe_path, '-v', 'error', '-show_entries', 'format=duration',
+                     '-of', 'default=noprint_wrappers=1:nokey=1', input_file],
+                    capture_output=True, text=True, timeout=30
+                )
+                return float(result.stdout.strip())
+            except (subprocess.TimeoutExpired, OSError, ValueError) as e:
+                logger.debug(f"ffprobe读取时长失败: {str(e)}")
+        
         try:
-            cmd = [
-                ffmpeg_path,
-                '-i', input_file,
-                '-f', 'null',
-                '-'
-            ]
-            
+            # 不指定输出文件时ffmpeg只打印文件头信息就退出，不会解码整个文件
+            cmd = [ffmpeg_path, '-hide_banner', '-i', input_file]
             result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
             
             # 从stderr中提取时长信息
@@ -273,34 +370,88 @@ class FFmpegManager:
         return 0.0
     
     @staticmethod
-    def convert_to_mp3(input_file: str, output_file: str = None, quality: str = '0') -> bool:
-        """将音频文件转换为MP3格式，带准确的进度条"""
+    def get_audio_codec(input_file: str, ffmpeg_path: str) -> str:
+        """获取第一条音轨的编码名称（如aac、flac、eac3）"""
+        ffprobe_path = FFmpegManager.find_ffprobe(ffmpeg_path)
+        if ffprobe_path:
+            try:
+                result = subprocess.run(
+                    [ffprobe_path, '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=codec_name',
+                     '-of', 'default=noprint_wrappers=1:nokey=1', input_file],
+                    capture_output=True, text=True, timeout=30
+                )
+                if result.stdout.strip():
+                    return result.stdout.strip().splitlines()[0]
+            except (subprocess.TimeoutExpired, OSError) as e:
+                logger.debug(f"ffprobe读取编码失败: {str(e)}")
+        
+        try:
+            result = subprocess.run([ffmpeg_path, '-hide_banner', '-i', input_file],
+                                    capture_output=True, text=True, timeout=30)
+            codec_match = re.search(r'Audio: (\w+)', result.stderr)
+            if codec_match:
+                return codec_match.group(1)
+        except Exception as e:
+            logger.warning(f"无法获取音频编码: {str(e)}")
+        
+        return ''
+    
+    @staticmethod
+    def convert_to_mp3(input_file: str, output_file: str = None, quality: str = '0',
+                       duration: float = None, output_format: str = None) -> bool:
+        """将音频文件转换为MP3格式，带准确的进度条
+        
+        duration为已知的音频时长（秒），不传时从文件元数据读取。
+        output_format默认取CONFIG['output_format']，除mp3外都用 -c:a copy 直接封装，
+        copy时无损音轨存为.flac、其余存为.m4a。
+        """
         if not os.path.exists(input_file):
             logger.error(f"找不到输入文件: {input_file}")
             return False
         
-        if output_file is None:
-            output_file = os.path.splitext(input_file)[0] + '.mp3'
-        
         ffmpeg_path = FFmpegManager.find_ffmpeg()
         if not ffmpeg_path:
             logger.error("未找到ffmpeg")
             return False
         
+        output_format = output_format or CONFIG['output_format']
+        if output_format == 'mp3':
+            codec_args = ['-acodec', 'libmp3lame', '-q:a', quality, '-threads', '4']
+        elif output_format in ('m4a', 'aac', 'flac', 'copy'):
+            codec = FFmpegManager.get_audio_codec(input_file, ffmpeg_path)
+            if output_format == 'copy':
+                output_format = 'flac' if codec == 'flac' else 'm4a'
+            if output_format in ('aac', 'flac') and codec and codec != output_format:
+                logger.error(f"音轨编码为{codec}，无法不重新编码保存为{output_format}")
+                return False
+            codec_args = ['-vn', '-c:a', 'copy']
+            if output_format == 'm4a':
+                codec_args += ['-movflags', '+faststart']
+            elif output_format == 'aac':
+                codec_args += ['-f', 'adts']
+        else:
+            logger.error(f"不支持的输出格式: {output_format}")
+            return False
+        
+        if output_file is None:
+            output_file = os.path.splitext(input_file)[0] + '.' + output_format
+        
+        # 输出与输入同名（m4a重新封装）时先写临时文件
+        same_file = os.path.abspath(output_file) == os.path.abspath(input_file)
+        target_file = output_file + '.tmp' + os.path.splitext(output_file)[1] if same_file else output_file
+        
         # 获取音频时长用于进度计算
-        total_duration = FFmpegManager.get_audio_duration(input_file, ffmpeg_path)
+        total_duration = duration or FFmpegManager.get_audio_duration(input_file, ffmpeg_path)
         
         try:
             cmd = [
                 ffmpeg_path,
                 '-i', input_file,
-                '-acodec', 'libmp3lame',
-                '-q:a', quality,
-                '-threads', '4',
+                *codec_args,
                 '-progress', 'pipe:1',
                 '-nostats',
                 '-y',  # 覆盖输出文件
-                output_file
+                target_file
             ]
             
             logger.info(f"开始转换: {os.path.basename(input_file)} -> {os.path.basename(output_file)}")
@@ -349,6 +500,9 @@ class FFmpegManager:
             
             if process.returncode == 0:
                 logger.info(f"转换完成: {os.path.basename(output_file)}")
+                if same_file:
+                    os.replace(target_file, output_file)
+                    return True
                 
                 # 询问是否删除原始文件
                 try:
@@ -362,6 +516,8 @@ class FFmpegManager:
                 return True
             else:
                 error = process.stderr.read()
+                if same_file and os.path.exists(target_file):
+                    os.remove(target_file)
                 logger.error(f"转换失败: {error}")
                 return False
                 
@@ -374,12 +530,16 @@ class VideoDownloader:
     
     def __init__(self, cookies: Dict):
         self.cookies = cookies
-        self.session = requests.Session()
+        self.session = RateLimitedSession(CONFIG['rate_limit'])
         self.session.headers.update({
             'User-Agent': CONFIG['user_agent'],
             'Referer': 'https://www.bilibili.com',
         })
         self.session.cookies.update(cookies)
+        self._ydl_instances = {}
+        self._current_file = None
+        self._current_duration = None
+        self._pbar = None
         
     def extract_bvid(self, url_or_bvid: str) -> str:
         """从URL或直接输入的BV号中提取BV"""
@@ -408,7 +568,7 @@ class VideoDownloader:
             raise BilibiliError(f"获取视频信息失败: {str(e)}")
     
     def download_audio_with_ytdlp(self, url: str, output_path: str = None) -> Optional[str]:
-        """使用yt-dlp下载音频"""
+        """使用yt-dlp下载音频，已安装yt_dlp模块时在进程内完成，否则调用命令行"""
         if output_path is None:
             output_path = CONFIG['download_folder']
         
@@ -418,6 +578,82 @@ class VideoDownloader:
         # 保存cookies
         CookieManager.save_cookies(self.cookies)
         
+        backend = CONFIG['ytdlp_backend']
+        if backend == 'api' or (backend == 'auto' and yt_dlp is not None):
+            if yt_dlp is None:
+                raise DownloadError("未安装yt_dlp模块，请执行 pip install yt-dlp")
+            return self._download_audio_with_api(url, output_path)
+        return self._download_audio_with_subprocess(url, output_path)
+    
+    def _get_ydl(self, output_path: str):
+        """获取可复用的YoutubeDL实例，提取器只在首次使用时初始化"""
+        if output_path not in self._ydl_instances:
+            self._ydl_instances[output_path] = yt_dlp.YoutubeDL({
+                'cookiefile': 'cookies.txt',
+                'format': 'ba[ext=m4a]/ba',  # 优先选择m4a格式的最佳音质
+                'noplaylist': True,
+                'nocheckcertificate': True,
+                'socket_timeout': CONFIG['timeout'],
+                'retries': CONFIG['max_retries'],
+                'outtmpl': os.path.join(output_path, "%(title)s.%(ext)s"),
+                'quiet': True,
+                'no_warnings': True,
+                'noprogress': True,
+                'progress_hooks': [self._on_ydl_progress],
+            })
+        return self._ydl_instances[output_path]
+    
+    def _on_ydl_progress(self, d: Dict):
+        """yt_dlp进度回调，按实际字节数更新进度条"""
+        if d.get('filename'):
+            self._current_file = d['filename']
+        
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        if d['status'] == 'downloading' and total:
+            if self._pbar is None:
+                self._pbar = tqdm(
+                    total=int(total),
+                    unit='B',
+                    unit_scale=True,
+                    desc="下载进度",
+                    ncols=80,
+                    bar_format='{desc}: {percentage:3.1f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]'
+                )
+            self._pbar.total = int(total)
+            self._pbar.n = d.get('downloaded_bytes', 0)
+            self._pbar.refresh()
+        elif d['status'] == 'finished':
+            logger.info(f"下载目标: {os.path.basename(d.get('filename', ''))}")
+    
+    def _download_audio_with_api(self, url: str, output_path: str) -> Optional[str]:
+        """通过yt_dlp的Python API下载音频"""
+        logger.info("开始下载音频...")
+        self._current_file = None
+        self._current_duration = None
+        self._pbar = None
+        
+        try:
+            info = self._get_ydl(output_path).extract_info(url, download=True)
+        except yt_dlp.utils.DownloadError as e:
+            logger.error(f"下载失败: {str(e)}")
+            raise DownloadError(f"yt-dlp下载失败: {str(e)}")
+        finally:
+            if self._pbar is not None:
+                self._pbar.close()
+                self._pbar = None
+        
+        # 已下载过的文件不会触发进度回调，从返回信息中取实际路径
+        downloads = (info or {}).get('requested_downloads') or []
+        if downloads and downloads[0].get('filepath'):
+            self._current_file = downloads[0]['filepath']
+        self._current_duration = (info or {}).get('duration')
+        
+        logger.info("下载完成!")
+        return self._current_file
+    
+    def _download_audio_with_subprocess(self, url: str, output_path: str) -> Optional[str]:
+        """启动yt-dlp命令行下载音频（未安装yt_dlp模块时的回退方式）"""
+        self._current_duration = None
         cmd = [
             'yt-dlp',
             '--cookies', 'cookies.txt',
@@ -530,12 +766,12 @@ class VideoDownloader:
                 # 转换为MP3
                 if convert_to_mp3:
                     try:
-                        choice = input("是否转换为MP3格式？(y/n) [y]: ").lower()
+                        choice = input(f"是否转换为{CONFIG['output_format']}格式？(y/n) [y]: ").lower()
                         if not choice or choice == 'y':
-                            return FFmpegManager.convert_to_mp3(downloaded_file)
+                            return FFmpegManager.convert_to_mp3(downloaded_file, duration=self._current_duration)
                     except:
                         # 非交互环境下默认转换
-                        return FFmpegManager.convert_to_mp3(downloaded_file)
+                        return FFmpegManager.convert_to_mp3(downloaded_file, duration=self._current_duration)
                 
                 return True
             else:
@@ -11,11 +11,20 @@ import sys
 import json
 import tempfile
 import unittest
+import importlib.util
 from unittest.mock import patch, MagicMock
 
 # 添加项目路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+def load_v14():
+    """按文件路径加载14.0版本脚本（文件名以数字开头，无法直接import）"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '14.0bilibili_audio_dl.py')
+    spec = importlib.util.spec_from_file_location('bilibili_audio_dl_v14', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
 class TestBilibiliTool(unittest.TestCase):
     """测试类"""
     
@@ -120,6 +129,945 @@ class TestBilibiliTool(unittest.TestCase):
         else:
             print("⚠️  依赖文件不存在，跳过此测试")
     
+    def test_parse_rate(self):
+        """测试批量下载带宽参数解析"""
+        v14 = load_v14()
+        self.assertEqual(v14.parse_rate(None), 0)
+        self.assertEqual(v14.parse_rate('500K'), 500 * 1024)
+        self.assertEqual(v14.parse_rate('1.5M'), int(1.5 * 1024**2))
+        self.assertEqual(v14.parse_rate('2MiB'), 2 * 1024**2)
+        with self.assertRaises(ValueError):
+            v14.parse_rate('fast')
+        print("✅ 带宽参数解析测试通过")
+    
+    def test_parse_ffmpeg_time(self):
+        """测试ffmpeg进度时间解析和已知时长记录"""
+        v14 = load_v14()
+        self.assertAlmostEqual(v14.parse_ffmpeg_time('01:02:03.500000'), 3723.5)
+        self.assertEqual(v14.parse_ffmpeg_time('N/A'), 0.0)
+        v14.remember_duration('音频/测试.m4a', 245)
+        self.assertEqual(v14.probe_audio_duration('音频/测试.m4a'), 245.0)
+        print("✅ 转码时长解析测试通过")
+    
+    def test_build_audio_convert_command(self):
+        """测试输出格式对应的ffmpeg参数"""
+        v14 = load_v14()
+        cmd, output_file = v14.build_audio_convert_command('音频/a.m4a', 'mp3')
+        self.assertIn('libmp3lame', cmd)
+        self.assertEqual(output_file, '音频/a.mp3')
+        cmd, output_file = v14.build_audio_convert_command('音频/a.m4a', 'm4a')
+        self.assertEqual(cmd[cmd.index('-c:a') + 1], 'copy')
+        self.assertEqual(output_file, '音频/a.m4a')
+        with self.assertRaises(ValueError):
+            v14.build_audio_convert_command('音频/a.m4a', 'wav')
+        print("✅ 输出格式参数测试通过")
+    
+    def test_download_archive(self):
+        """测试下载存档的记录与查询"""
+        v14 = load_v14()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conn = v14.get_archive_connection(os.path.join(tmp_dir, 'archive.db'))
+            audio_file = os.path.join(tmp_dir, 'a.m4a')
+            with open(audio_file, 'wb') as f:
+                f.write(b'test')
+            
+            self.assertIsNone(v14.archive_lookup('BV1xx411c7mD'))
+            v14.archive_record('BV1xx411c7mD', 1, audio_file, cid=123, quality='30280', page_count=1)
+            archived = v14.archive_lookup('BV1xx411c7mD')
+            self.assertEqual(archived['cid'], 123)
+            self.assertEqual(archived['file'], audio_file)
+            
+            # 转换格式后原文件被删除，按同名文件查找
+            mp3_file = os.path.join(tmp_dir, 'a.mp3')
+            os.replace(audio_file, mp3_file)
+            self.assertEqual(v14.archive_lookup('BV1xx411c7mD')['file'], mp3_file)
+            os.remove(mp3_file)
+            self.assertIsNone(v14.archive_lookup('BV1xx411c7mD'))
+            conn.close()
+        print("✅ 下载存档测试通过")
+    
+    def test_download_archive_multi_page_ytdlp(self):
+        """测试yt-dlp后端下载多P视频时，每个分P分别存档，旧版存档自动迁移"""
+        import sqlite3
+        v14 = load_v14()
+        view = {'code': 0, 'data': {'cid': 11, 'title': '多P', 'pages': [{'cid': 11, 'page': 1}, {'cid': 22, 'page': 2}]}}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # 旧版以(bvid, cid, quality)为主键的存档
+            db_path = os.path.join(tmp_dir, 'archive.db')
+            old = sqlite3.connect(db_path)
+            old.execute('CREATE TABLE downloads (bvid TEXT NOT NULL, cid INTEGER NOT NULL, quality TEXT NOT NULL, '
+                        'page INTEGER NOT NULL, page_count INTEGER NOT NULL, filepath TEXT NOT NULL, '
+                        'downloaded_at REAL NOT NULL, PRIMARY KEY (bvid, cid, quality))')
+            old.execute("INSERT INTO downloads VALUES ('BV1old', 0, '', 1, 0, 'old.m4a', 1.0)")
+            old.commit()
+            old.close()
+            conn = v14.get_archive_connection(db_path)
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM downloads').fetchone()[0], 1)
+            
+            def fake_ytdlp(url, output_dir, *args):
+                filepath = os.path.join(tmp_dir, f"P{url.rsplit('=', 1)[1]}.m4a")
+                with open(filepath, 'wb') as f:
+                    f.write(b'audio')
+                return True, filepath, ''
+            
+            with patch.object(v14, 'download_with_ytdlp', side_effect=fake_ytdlp) as download, \
+                    patch.object(v14, 'get_video_view', return_value=view):
+                for page_num in (1, 2):
+                    url = f'https://www.bilibili.com/video/BV1xx411c7mD?p={page_num}'
+                    self.assertTrue(v14.download_audio_file(url, {}, tmp_dir, show_progress=False)[0])
+                self.assertEqual(download.call_count, 2)
+                # 重新运行时两个分P都命中存档
+                for page_num in (1, 2):
+                    url = f'https://www.bilibili.com/video/BV1xx411c7mD?p={page_num}'
+                    success, filepath, _ = v14.download_audio_file(url, {}, tmp_dir, show_progress=False)
+                    self.assertEqual(os.path.basename(filepath), f'P{page_num}.m4a')
+                self.assertEqual(download.call_count, 2)
+            archived = v14.archive_lookup('BV1xx411c7mD', 2)
+            self.assertEqual((archived['cid'], archived['page_count']), (22, 2))
+            conn.close()
+        print("✅ 多P存档测试通过")
+    
+    def test_interactive_download_backend(self):
+        """测试交互式下载把选择的下载方式传给每个分P"""
+        v14 = load_v14()
+        with patch.object(v14, 'save_cookies'), patch.object(v14, 'archive_lookup', return_value=None), \
+                patch.object(v14, 'get_video_info', return_value=[{'page': 1}]), \
+                patch.object(v14, 'download_single_audio') as download:
+            v14.download_audio('BV1xx411c7mD', {}, 'native')
+        download.assert_called_once_with('BV1xx411c7mD', {}, 'native')
+        print("✅ 交互式下载方式测试通过")
+    
+    def test_http_retry(self):
+        """测试共享HTTP会话在风控响应后退避重试"""
+        v14 = load_v14()
+        blocked = MagicMock(status_code=200, content=b'{"code":-352,"message":"-352"}')
+        ok = MagicMock(status_code=200, content=b'{"code":0,"data":{}}')
+        server_error = MagicMock(status_code=502, content=b'')
+        self.assertTrue(v14._should_retry(blocked, 'GET'))
+        self.assertTrue(v14._should_retry(server_error, 'GET'))
+        self.assertFalse(v14._should_retry(server_error, 'POST'))
+        self.assertFalse(v14._should_retry(ok, 'GET'))
+        
+        session = MagicMock()
+        session.request.side_effect = [blocked, ok]
+        with patch.object(v14, 'get_http_session', return_value=session), patch.object(v14.time, 'sleep'):
+            self.assertIs(v14.http_get('https://api.bilibili.com/x/web-interface/nav'), ok)
+        self.assertEqual(session.request.call_count, 2)
+        self.assertEqual(session.request.call_args.kwargs['timeout'], v14.NETWORK_CONFIG['timeout'])
+        print("✅ HTTP重试测试通过")
+    
+    def test_token_bucket(self):
+        """测试自适应令牌桶的预支、降速和回升"""
+        v14 = load_v14()
+        bucket = v14.TokenBucket(rate=4, burst=2, increase_after=3)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertGreater(bucket.reserve(), 0.2)
+        
+        bucket.on_throttle()
+        self.assertEqual(bucket.rate, 2)
+        for _ in range(3):
+            bucket.on_success()
+        self.assertAlmostEqual(bucket.rate, 2.4)
+        
+        # 读写请求使用不同的限速器
+        read_limiter = v14.get_rate_limiter('https://api.bilibili.com/x/web-interface/view')
+        write_limiter = v14.get_rate_limiter('https://api.bilibili.com/x/web-interface/coin/add', 'POST')
+        self.assertIsNot(read_limiter, write_limiter)
+        self.assertIs(read_limiter, v14.get_rate_limiter('https://api.bilibili.com/x/v2/reply/count'))
+        print("✅ 令牌桶限速测试通过")
+    
+    def test_fetch_video_infos(self):
+        """测试批量并发获取视频信息（线程池回退路径）"""
+        v14 = load_v14()
+        v14.httpx = None
+        
+        def fake_get(url, params=None, **kwargs):
+            if params['bvid'] == 'BV1xx411c7mE':
+                return MagicMock(json=lambda: {'code': -404, 'message': '啥都木有'})
+            return MagicMock(json=lambda: {'code': 0, 'data': {'bvid': params['bvid'], 'aid': 1}})
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            v14._metadata_cache = v14.MetadataCache(os.path.join(tmp_dir, 'cache.db'))
+            with patch.object(v14, 'http_get', side_effect=fake_get):
+                infos = v14.fetch_video_infos(['BV1xx411c7mD', 'BV1xx411c7mE'], concurrency=2)
+            v14._metadata_cache._conn.close()
+        self.assertEqual(infos['BV1xx411c7mD']['bvid'], 'BV1xx411c7mD')
+        self.assertEqual(infos['BV1xx411c7mE'], '啥都木有')
+        print("✅ 批量视频信息测试通过")
+    
+    def test_metadata_cache(self):
+        """测试视频元数据缓存的有效期、LRU淘汰和磁盘层"""
+        v14 = load_v14()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'cache.db')
+            cache = v14.MetadataCache(path, ttl=60, max_entries=2)
+            cache.put(['bv:BV1xx411c7mD', 'av:2'], {'aid': 2})
+            cache.put(['bv:BV1xx411c7mE'], {'aid': 3})
+            # 内存中只保留两条，最早的条目从SQLite读回
+            self.assertEqual(len(cache._memory), 2)
+            self.assertEqual(cache.get('bv:BV1xx411c7mD'), {'aid': 2})
+            self.assertIsNone(cache.get('bv:BV1xx411c7mF'))
+            
+            expired = v14.MetadataCache(path, ttl=-1)
+            expired.put(['av:4'], {'aid': 4})
+            self.assertIsNone(expired.get('av:4'))
+            
+            v14._metadata_cache = cache
+            with patch.object(v14, 'http_get') as fake_get:
+                self.assertEqual(v14.get_video_view(aid=2)['data'], {'aid': 2})
+                fake_get.assert_not_called()
+            cache._conn.close()
+            expired._conn.close()
+        print("✅ 元数据缓存测试通过")
+    
+    def test_bvid_codec(self):
+        """测试BV号与AV号离线互转"""
+        v14 = load_v14()
+        self.assertEqual(v14.av2bv(111298867365120), 'BV1L9Uoa9EUx')
+        self.assertEqual(v14.bv2av('BV1L9Uoa9EUx'), 111298867365120)
+        self.assertEqual(v14.av2bv(170001), 'BV17x411w7KC')
+        self.assertEqual(v14.bv_to_av('BV17x411w7KC'), '170001')
+        with self.assertRaises(ValueError):
+            v14.bv2av('BV1L9Uoa9EU0')
+        self.assertEqual(v14.convert_video_ids(['BV17x411w7KC', 'av170001', '170001', 'abc']), [
+            ('BV17x411w7KC', 'av170001'), ('av170001', 'BV17x411w7KC'), ('170001', 'BV17x411w7KC'), ('abc', '')
+        ])
+        # 整列转换与逐个转换结果一致，无效项为None
+        aids = [1, 170001, 2 ** 40 + 7, 111298867365120, 0, -5, 1 << 51]
+        bvids = v14.av2bv_many(aids)
+        self.assertEqual(bvids[4:], [None, None, None])
+        self.assertEqual(bvids[:4], [v14.av2bv(aid) for aid in aids[:4]])
+        self.assertEqual(v14.bv2av_many(bvids[:4] + ['BV1L9Uoa9EU0', 'BV17x411w7K']), aids[:4] + [None, None])
+        print("✅ BV/AV互转测试通过")
+    
+    def test_fetch_all_danmaku(self):
+        """测试并发获取全部弹幕分段并按时间合并"""
+        v14 = load_v14()
+        dm_pb2 = v14.load_dm_pb2()
+        if dm_pb2 is None:
+            print("⚠️  缺少protobuf，跳过此测试")
+            return
+        
+        def fake_get(url, params=None, **kwargs):
+            # 每段两条弹幕，段内时间倒序，验证合并后整体按时间排序
+            segment = dm_pb2.DmSegMobileReply()
+            index = params['segment_index']
+            for offset in (300, 10):
+                elem = segment.elems.add()
+                elem.id = index * 1000 + offset
+                elem.progress = ((index - 1) * 360 + offset) * 1000
+                elem.content = f"第{index}段"
+            return MagicMock(status_code=200, content=segment.SerializeToString())
+        
+        with patch.object(v14, 'http_get', side_effect=fake_get) as mocked:
+            elems = v14.fetch_all_danmaku(123, duration=7200)
+        self.assertEqual(mocked.call_count, 20)
+        self.assertEqual(len(elems), 40)
+        progress = [elem.progress for elem in elems]
+        self.assertEqual(progress, sorted(progress))
+        
+        # 时长未知：第2~4段没有弹幕，第5段仍有弹幕，之后连续空分段才停止
+        def sparse_get(url, params=None, **kwargs):
+            if params['segment_index'] in (2, 3, 4) or params['segment_index'] > 5:
+                return MagicMock(status_code=200, content=b'')
+            return fake_get(url, params)
+        
+        with patch.object(v14, 'http_get', side_effect=sparse_get) as mocked:
+            segments = list(v14.iter_danmaku_segments(123, duration=0))
+        self.assertEqual([len(elems) for elems in segments], [2, 0, 0, 0, 2])
+        self.assertEqual(mocked.call_count, 5 + v14.DANMAKU_MAX_EMPTY_SEGMENTS)
+        print("✅ 全部弹幕分段测试通过")
+    
+    def test_danmaku_exporter(self):
+        """测试弹幕导出为JSONL和CSV"""
+        v14 = load_v14()
+        dm_pb2 = v14.load_dm_pb2()
+        if dm_pb2 is None:
+            print("⚠️  缺少protobuf，跳过此测试")
+            return
+        
+        segment = dm_pb2.DmSegMobileReply()
+        for i, text in enumerate(['第一条', '含,逗号']):
+            elem = segment.elems.add()
+            elem.id, elem.progress, elem.content, elem.midHash = 100 + i, 1000 * i, text, 'abcd'
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jsonl_file = os.path.join(tmp_dir, 'dm.jsonl')
+            with v14.DanmakuExporter(jsonl_file) as exporter:
+                exporter.write(list(segment.elems))
+                exporter.write([])
+            with open(jsonl_file, encoding='utf-8') as f:
+                rows = [json.loads(line) for line in f]
+            self.assertEqual(exporter.count, 2)
+            self.assertEqual(rows[1]['content'], '含,逗号')
+            self.assertEqual(list(rows[0]), v14.DANMAKU_EXPORT_FIELDS)
+            
+            csv_file = os.path.join(tmp_dir, 'dm.csv')
+            with v14.DanmakuExporter(csv_file) as exporter:
+                exporter.write(list(segment.elems))
+            with open(csv_file, encoding='utf-8-sig') as f:
+                lines = f.read().splitlines()
+            self.assertEqual(lines[0], ','.join(v14.DANMAKU_EXPORT_FIELDS))
+            self.assertIn('"含,逗号"', lines[2])
+        
+        with self.assertRaises(ValueError):
+            v14.DanmakuExporter('dm.xlsx')
+        print("✅ 弹幕导出测试通过")
+
+    def test_row_writer(self):
+        """测试弹幕和评论导出共用的JSONL/CSV行写入"""
+        import codecs
+        v14 = load_v14()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_file = os.path.join(tmp_dir, 'rows.csv')
+            writer = v14.RowWriter(csv_file, 'csv', ['id', 'text'])
+            writer.write_rows([(1, '中文,逗号')])
+            size = writer.position()
+            writer.write_rows([(2, '写了一半')])
+            writer.close()
+            writer = v14.RowWriter(csv_file, 'csv', ['id', 'text'], resume_size=size)
+            writer.write_rows([(3, '续写')])
+            writer.close()
+            with open(csv_file, 'rb') as f:
+                data = f.read()
+            self.assertTrue(data.startswith(codecs.BOM_UTF8))
+            self.assertEqual(data.count(codecs.BOM_UTF8), 1)
+            self.assertEqual(data[3:].decode('utf-8').splitlines(), ['id,text', '1,"中文,逗号"', '3,续写'])
+
+            jsonl_file = os.path.join(tmp_dir, 'rows.jsonl')
+            writer = v14.RowWriter(jsonl_file, 'jsonl', ['id', 'text'])
+            writer.write_rows([(1, '中文')])
+            writer.close()
+            with open(jsonl_file, 'rb') as f:
+                self.assertEqual(json.loads(f.read()), {'id': 1, 'text': '中文'})
+
+        with self.assertRaises(ValueError):
+            v14.RowWriter('rows.parquet', 'parquet', ['id'])
+        print("✅ 行写入测试通过")
+
+    def test_danmaku_sync_index(self):
+        """测试增量同步的弹幕ID索引与追加写入"""
+        v14 = load_v14()
+        dm_pb2 = v14.load_dm_pb2()
+        if dm_pb2 is None:
+            print("⚠️  缺少protobuf，跳过此测试")
+            return
+
+        def make_elems(ids):
+            segment = dm_pb2.DmSegMobileReply()
+            for dmid in ids:
+                elem = segment.elems.add()
+                elem.id, elem.ctime, elem.content = dmid, 1000 + dmid, str(dmid)
+            return list(segment.elems)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index = v14.DanmakuSyncIndex(123, tmp_dir)
+            first = index.filter_new(make_elems([5, 3, 9, 3]))
+            self.assertEqual([elem.id for elem in first], [5, 3, 9])
+            index.add(first)
+            index.save(bvid='BV1xx411c7mD')
+
+            index = v14.DanmakuSyncIndex(123, tmp_dir)
+            self.assertEqual(list(index.ids), [3, 5, 9])
+            self.assertEqual(index.latest_ctime, 1009)
+            second = index.filter_new(make_elems([3, 4, 9, 12]))
+            self.assertEqual([elem.id for elem in second], [4, 12])
+
+            csv_file = os.path.join(tmp_dir, 'dm.csv')
+            for elems in (first, second):
+                with v14.DanmakuExporter(csv_file, append=True) as exporter:
+                    exporter.write(elems)
+            with open(csv_file, encoding='utf-8-sig') as f:
+                lines = f.read().splitlines()
+            self.assertEqual(len(lines), 6)
+            self.assertEqual(lines.count(','.join(v14.DANMAKU_EXPORT_FIELDS)), 1)
+
+            # 同步到第二个分段时中断，重新同步不会重复追加第一个分段
+            view = {'code': 0, 'data': {'cid': 456, 'duration': 720, 'pages': [{'page': 1, 'cid': 456, 'duration': 720}]}}
+
+            def interrupted(*args):
+                yield make_elems([1, 2])
+                raise RuntimeError("网络中断")
+
+            def complete(*args):
+                yield make_elems([1, 2])
+                yield make_elems([2, 7])
+
+            with patch.object(v14, 'get_video_view', return_value=view):
+                with patch.object(v14, 'iter_danmaku_segments', side_effect=interrupted):
+                    with self.assertRaises(RuntimeError):
+                        v14.sync_danmaku('BV1xx411c7mD', directory=tmp_dir)
+                with patch.object(v14, 'iter_danmaku_segments', side_effect=complete):
+                    self.assertEqual(v14.sync_danmaku('BV1xx411c7mD', directory=tmp_dir), {1: 1})
+            with open(os.path.join(tmp_dir, 'BV1xx411c7mD_P1.jsonl'), encoding='utf-8') as f:
+                self.assertEqual([json.loads(line)['id'] for line in f], [1, 2, 7])
+        print("✅ 弹幕增量同步索引测试通过")
+
+    def test_danmaku_xml_and_ass(self):
+        """测试XML弹幕解析和ASS轨道分配"""
+        import zlib
+        v14 = load_v14()
+        xml = ('<?xml version="1.0" encoding="UTF-8"?><i><chatid>123</chatid>'
+               '<d p="2.5,1,25,16777215,1700000000,0,abcd,902,10">第二条</d>'
+               '<d p="1.0,5,25,16711680,1700000001,0,ef01,901,0">顶部{红}</d></i>').encode('utf-8')
+        deflater = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        raw = deflater.compress(xml) + deflater.flush()
+        with patch.object(v14, 'http_get', return_value=MagicMock(status_code=200, content=raw)):
+            elems = v14.fetch_danmaku_xml(123)
+        self.assertEqual([elem.id for elem in elems], [901, 902])
+        self.assertEqual(elems[0].progress, 1000)
+        self.assertEqual(elems[1].weight, 10)
+
+        Record = v14.DanmakuRecord
+        scrolling = [Record(id=i, progress=0, mode=1, fontsize=25, color=0xFFFFFF, midHash='',
+                            content='弹幕', ctime=0, weight=0, pool=0) for i in range(3)]
+        lines = list(v14.iter_ass_events(iter(scrolling), height=100, font_size=40, area=1.0))
+        # 100像素高只能放两条40像素的轨道，第三条同时出现的弹幕被丢弃
+        self.assertEqual(len(lines), 2)
+        self.assertIn('\\move(1920,0,-80,0)', lines[0])
+        self.assertIn('\\move(1920,40,-80,40)', lines[1])
+
+        top = list(v14.iter_ass_events(elems[:1]))[0]
+        self.assertTrue(top.startswith('Dialogue: 0,0:00:01.00,0:00:05.00,'))
+        self.assertIn('\\c&H0000FF&', top)
+        self.assertIn('顶部\\{红\\}', top)
+        print("✅ XML弹幕与ASS转换测试通过")
+
+    def test_danmaku_segment_view(self):
+        """测试弹幕分段列式视图"""
+        v14 = load_v14()
+        dm_pb2 = v14.load_dm_pb2()
+        if dm_pb2 is None:
+            print("⚠️  缺少protobuf，跳过此测试")
+            return
+        self.assertIn(v14.protobuf_backend(), ('upb', 'cpp', 'python'))
+
+        segment = dm_pb2.DmSegMobileReply()
+        for dmid, progress in ((3, 2000), (1, 500), (2, 2000)):
+            elem = segment.elems.add()
+            elem.id, elem.progress, elem.content = dmid, progress, f"弹幕{dmid}"
+        view = v14.DanmakuSegmentView(segment.SerializeToString(), dm_pb2)
+        self.assertEqual(len(view), 3)
+        self.assertEqual(view.columns('progress', 'content'),
+                         {'progress': [2000, 500, 2000], 'content': ['弹幕3', '弹幕1', '弹幕2']})
+        self.assertIs(view.column('progress'), view.column('progress'))
+        self.assertEqual(view.order(), [1, 2, 0])
+
+        with patch.object(v14, 'http_get',
+                          return_value=MagicMock(status_code=200, content=segment.SerializeToString())):
+            columns = v14.fetch_danmaku_columns(123, duration=700, fields=['id'])
+        self.assertEqual(columns, {'id': [1, 2, 3, 1, 2, 3]})
+        print(f"✅ 弹幕列式视图测试通过 (后端: {v14.protobuf_backend()})")
+
+    def test_encode_wbi(self):
+        """测试WBI签名与公开示例一致"""
+        v14 = load_v14()
+        keys = ('7cd084941338484aae1ad9425b84077c', '4932caff0ff746eab6f01bf08b70ac45')
+        with patch.object(v14, 'get_wbi_keys', return_value=keys), \
+                patch.object(v14.time, 'time', return_value=1702204169):
+            params = v14.encode_wbi({'foo': '114', 'bar': '514', 'zab': 1919810})
+        self.assertEqual(params['w_rid'], '8f6f2b5b3d485fe1886cec6a0be8c5d4')
+        print("✅ WBI签名测试通过")
+
+    def test_crawl_comments_resume(self):
+        """测试评论区爬取的楼中楼获取和断点续爬"""
+        v14 = load_v14()
+
+        def reply(rpid, rcount=0, root=0, inline=()):
+            return {'rpid': rpid, 'root': root, 'parent': root, 'oid': 170001, 'mid': rpid,
+                    'member': {'uname': f'u{rpid}', 'level_info': {'current_level': 6}},
+                    'like': 0, 'rcount': rcount, 'ctime': 0, 'content': {'message': f'评论{rpid}'},
+                    'replies': [reply(sub, root=rpid) for sub in inline]}
+
+        pages = {
+            '': {'replies': [reply(1, rcount=3, inline=[11]), reply(2, rcount=1, inline=[21])],
+                 'top_replies': [reply(9)],
+                 'cursor': {'is_end': False, 'all_count': 8, 'pagination_reply': {'next_offset': 'p2'}}},
+            'p2': {'replies': [reply(3)], 'cursor': {'is_end': True, 'pagination_reply': {}}},
+        }
+        fail_page2 = [True]
+
+        def fake_get(url, params=None, **kwargs):
+            if 'wbi/main' in url:
+                offset = json.loads(params['pagination_str'])['offset']
+                if offset == 'p2' and fail_page2[0]:
+                    fail_page2[0] = False
+                    raise RuntimeError('网络中断')
+                return MagicMock(json=lambda: {'code': 0, 'data': pages[offset]})
+            ps, pn = params['ps'], params['pn']
+            subs = [reply(sub, root=1) for sub in (11, 12, 13)][(pn - 1) * ps:pn * ps]
+            return MagicMock(json=lambda: {'code': 0, 'data': {'replies': subs, 'page': {'count': 3}}})
+
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                patch.object(v14, 'encode_wbi', side_effect=lambda params, cookies=None: params), \
+                patch.object(v14, 'http_get', side_effect=fake_get) as mocked:
+            output_file = os.path.join(tmp_dir, 'comments.jsonl')
+            with self.assertRaises(RuntimeError):
+                v14.crawl_comments('BV17x411w7KC', output_file)
+            with open(output_file + '.state.json', encoding='utf-8') as f:
+                self.assertEqual(json.load(f)['total'], 8)
+            # 游标只对原排序方式有效，换排序续爬时拒绝
+            with self.assertRaises(ValueError):
+                v14.crawl_comments('BV17x411w7KC', output_file, sort='time')
+            count, _ = v14.crawl_comments('BV17x411w7KC', output_file)
+            with open(output_file, encoding='utf-8') as f:
+                rows = [json.loads(line) for line in f]
+        self.assertEqual(count, 8)
+        self.assertEqual([(row['rpid'], row['root']) for row in rows],
+                         [(9, 0), (1, 0), (11, 1), (12, 1), (13, 1), (2, 0), (21, 2), (3, 0)])
+        # 续爬时第一页不重新请求
+        main_offsets = [json.loads(call.kwargs['params']['pagination_str'])['offset']
+                        for call in mocked.call_args_list if 'wbi/main' in call.args[0]]
+        self.assertEqual(main_offsets, ['', 'p2', 'p2'])
+        print("✅ 评论区断点续爬测试通过")
+
+    def test_comment_exporter(self):
+        """测试评论导出为CSV和SQLite"""
+        import sqlite3
+        v14 = load_v14()
+        records = [
+            {'rpid': 1, 'root': 0, 'parent': 0, 'oid': 170001, 'mid': 7, 'uname': '用户', 'level': 6,
+             'like': 3, 'rcount': 1, 'ctime': 1700000000, 'message': '主评论,含逗号'},
+            {'rpid': 2, 'root': 1, 'parent': 1, 'oid': 170001, 'mid': 8, 'uname': '回复者', 'level': 2,
+             'like': 0, 'rcount': 0, 'ctime': 1700000001, 'message': '回复'},
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_file = os.path.join(tmp_dir, 'c.csv')
+            with v14.CommentExporter(csv_file) as exporter:
+                exporter.write(records[:1])
+                size = exporter.position()
+                exporter.write(records[1:])
+            # 续写时截断到记录的长度，丢掉之后写入的内容
+            with v14.CommentExporter(csv_file, resume_size=size) as exporter:
+                exporter.write(records[1:])
+            with open(csv_file, encoding='utf-8-sig') as f:
+                lines = f.read().splitlines()
+            self.assertEqual(lines[0], ','.join(v14.COMMENT_FIELDS))
+            self.assertEqual(len(lines), 3)
+            self.assertIn('"主评论,含逗号"', lines[1])
+
+            db_file = os.path.join(tmp_dir, 'c.db')
+            for _ in range(2):
+                with v14.CommentExporter(db_file, resume_size=0) as exporter:
+                    exporter.write(records)
+            conn = sqlite3.connect(db_file)
+            rows = conn.execute('SELECT rpid, root, parent FROM comments ORDER BY rpid').fetchall()
+            conn.close()
+            self.assertEqual(rows, [(1, 0, 0), (2, 1, 1)])
+
+        self.assertIn('评论ID: 2', v14.format_comment_text(records[1]))
+        with self.assertRaises(ValueError):
+            v14.CommentExporter('c.xlsx')
+        print("✅ 评论导出测试通过")
+
+    def test_live_danmaku_client(self):
+        """测试直播信息流的封包、解压和客户端接收"""
+        import asyncio
+        import zlib
+        v14 = load_v14()
+
+        def danmu(text, dmid):
+            return {'cmd': 'DANMU_MSG', 'info': [
+                [0, 1, 25, 16777215, 1700000000000, 0, 0, '', 0, 0, 0, '', 0, '{}', '{}',
+                 {'extra': json.dumps({'id_str': dmid})}],
+                text, [42, '观众'], [12, '粉丝团'],
+            ]}
+
+        inner = b''.join(v14.pack_live_packet(v14.LIVE_OP_MESSAGE, danmu(text, f'id{i}'), v14.LIVE_PROTO_JSON)
+                         for i, text in enumerate(['第一条', '第二条']))
+        compressed = v14.pack_live_packet(v14.LIVE_OP_MESSAGE, zlib.compress(inner), v14.LIVE_PROTO_ZLIB)
+        packets = list(v14.unpack_live_packets(compressed))
+        self.assertEqual([op for op, _ in packets], [v14.LIVE_OP_MESSAGE] * 2)
+        msg = v14.parse_danmu_msg(json.loads(packets[1][1]))
+        self.assertEqual((msg['id'], msg['text'], msg['uid'], msg['medal']), ('id1', '第二条', 42, [12, '粉丝团']))
+
+        received = []
+
+        async def scenario():
+            async def handle(reader, writer):
+                header = await reader.readexactly(16)
+                body = await reader.readexactly(v14.LIVE_PACKET_HEADER.unpack(header)[0] - 16)
+                received.append(json.loads(body))
+                writer.write(v14.pack_live_packet(v14.LIVE_OP_AUTH_REPLY, {'code': 0}))
+                writer.write(v14.pack_live_packet(v14.LIVE_OP_HEARTBEAT_REPLY, (1234).to_bytes(4, 'big')))
+                writer.write(compressed)
+                await writer.drain()
+                await asyncio.sleep(0.05)
+                writer.close()
+
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            events = []
+            client = v14.LiveDanmakuClient(123, {'DedeUserID': '7'}, sinks=[events.append])
+            with patch.object(v14, 'get_live_real_room_id', return_value=456), \
+                    patch.object(v14, 'get_live_danmu_info',
+                                 return_value={'token': 't', 'host_list': [{'host': '127.0.0.1', 'port': port}]}):
+                await client.run(duration=5)
+            server.close()
+            return client, events
+
+        client, events = asyncio.run(scenario())
+        self.assertEqual(received[0]['roomid'], 456)
+        self.assertEqual(received[0]['key'], 't')
+        self.assertEqual(received[0]['uid'], 7)
+        self.assertEqual(client.popularity, 1234)
+        self.assertEqual([v14.parse_danmu_msg(event)['text'] for event in events], ['第一条', '第二条'])
+        self.assertIn('勋章: 粉丝团 12级', v14.format_live_event(events[0]))
+        print("✅ 直播信息流客户端测试通过")
+
+    def test_live_danmaku_recorder(self):
+        """测试多直播间录制的关注列表增删和文件切换"""
+        import asyncio
+        v14 = load_v14()
+
+        class FakeClient:
+            def __init__(self, room_id, cookies=None, sinks=None, deduper=None):
+                self.room_id, self.sinks = room_id, sinks
+                self.closed = None
+
+            async def run(self):
+                self.closed = asyncio.Event()
+                for sink in self.sinks:
+                    sink({'cmd': 'DANMU_MSG', 'room': self.room_id})
+                await self.closed.wait()
+
+            def close(self):
+                self.closed.set()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            watchlist = os.path.join(tmp_dir, 'rooms.txt')
+            with open(watchlist, 'w', encoding='utf-8') as f:
+                f.write('# 关注的直播间\n1001\nhttps://live.bilibili.com/1002?from=search\n1001\n')
+            self.assertEqual(v14.load_live_watchlist(watchlist), [1001, 1002])
+
+            async def scenario():
+                recorder = v14.LiveDanmakuRecorder(directory=tmp_dir, watchlist=watchlist)
+                task = asyncio.ensure_future(recorder.run())
+                await asyncio.sleep(0.05)
+                started = sorted(recorder.tasks)
+                with open(watchlist, 'w', encoding='utf-8') as f:
+                    f.write('1002\n1003\n')
+                os.utime(watchlist, (0, 12345))
+                await recorder.sync_watchlist()
+                await asyncio.sleep(0.05)
+                updated = sorted(recorder.tasks)
+                recorder.stop()
+                await task
+                return started, updated, recorder.tasks
+
+            with patch.object(v14, 'LiveDanmakuClient', FakeClient):
+                started, updated, remaining = asyncio.run(scenario())
+            self.assertEqual(started, [1001, 1002])
+            self.assertEqual(updated, [1002, 1003])
+            self.assertEqual(remaining, {})
+            self.assertEqual(len(os.listdir(os.path.join(tmp_dir, '1003'))), 1)
+
+            # 命令行直接指定的直播间不受关注列表增删影响
+            async def pinned_scenario():
+                recorder = v14.LiveDanmakuRecorder(directory=tmp_dir, watchlist=watchlist)
+                task = asyncio.ensure_future(recorder.run([111]))
+                await asyncio.sleep(0.05)
+                started = sorted(recorder.tasks)
+                with open(watchlist, 'w', encoding='utf-8') as f:
+                    f.write('222\n')
+                os.utime(watchlist, (0, 23456))
+                await recorder.sync_watchlist()
+                updated = sorted(recorder.tasks)
+                recorder.stop()
+                await task
+                return started, updated
+
+            with patch.object(v14, 'LiveDanmakuClient', FakeClient):
+                started, updated = asyncio.run(pinned_scenario())
+            self.assertEqual(started, [111, 1002, 1003])
+            self.assertEqual(updated, [111, 222])
+            with open(os.path.join(tmp_dir, '1003', os.listdir(os.path.join(tmp_dir, '1003'))[0]), encoding='utf-8') as f:
+                self.assertIn('DANMU_MSG', f.read())
+
+            sink = v14.RotatingLiveEventSink(2001, tmp_dir, max_bytes=10)
+            for i in range(3):
+                sink({'cmd': 'DANMU_MSG', 'n': i})
+            sink.close()
+            self.assertEqual(len(os.listdir(os.path.join(tmp_dir, '2001'))), 3)
+        print("✅ 多直播间弹幕录制测试通过")
+
+    def test_live_danmaku_recorder_reconnects_on_any_error(self):
+        """测试信息流抛出非网络错误（如畸形消息的KeyError）时退避重连，而不是停止录制"""
+        import asyncio
+        v14 = load_v14()
+        runs = []
+
+        class FlakyClient:
+            def __init__(self, room_id, cookies=None, sinks=None, deduper=None):
+                self.sinks = sinks
+                self.closed = None
+
+            async def run(self):
+                runs.append(len(runs))
+                if len(runs) == 1:
+                    raise KeyError('info')
+                self.closed = asyncio.Event()
+                for sink in self.sinks:
+                    sink({'cmd': 'DANMU_MSG'})
+                await self.closed.wait()
+
+            def close(self):
+                if self.closed is not None:
+                    self.closed.set()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            async def scenario():
+                recorder = v14.LiveDanmakuRecorder(directory=tmp_dir, backoff_base=0.001)
+                task = asyncio.ensure_future(recorder.run([1001]))
+                await asyncio.sleep(0.1)
+                alive = not recorder.tasks[1001].done()
+                events = recorder.total_events()
+                recorder.stop()
+                await task
+                return alive, events
+
+            with patch.object(v14, 'LiveDanmakuClient', FlakyClient), self.assertLogs(v14.logger, 'WARNING') as logs:
+                alive, events = asyncio.run(scenario())
+        self.assertTrue(alive)
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(events, 1)
+        self.assertIn('KeyError', ''.join(logs.output))
+        print("✅ 直播间信息流出错重连测试通过")
+
+    def test_live_message_deduper(self):
+        """测试有界消息去重的时间窗口和容量上限"""
+        v14 = load_v14()
+        deduper = v14.LiveMessageDeduper(window=60, capacity=4)
+        self.assertFalse(deduper.seen('a', now=0))
+        self.assertTrue(deduper.seen('a', now=30))
+        self.assertFalse(deduper.seen('a', now=100))  # 超出时间窗口后视为新消息
+        for i in range(100):
+            deduper.seen(('msg', i), now=200)
+        self.assertLessEqual(len(deduper), 4)
+        self.assertTrue(deduper.seen(('msg', 99), now=201))
+        self.assertFalse(deduper.seen(('msg', 0), now=201))  # 已被覆盖
+
+        danmu = {'cmd': 'DANMU_MSG', 'info': [[0, 1, 25, 0, 1700000000000], '内容', [42, '观众'], []]}
+        self.assertEqual(v14.live_event_key(danmu), (1700000000000, 42, '内容'))
+        self.assertEqual(v14.live_event_key({'cmd': 'SEND_GIFT', 'msg_id': 'x1'}), 'x1')
+        self.assertIsNone(v14.live_event_key({'cmd': 'ONLINE_RANK_COUNT'}))
+        print("✅ 直播消息去重测试通过")
+
+    def test_live_status_poller(self):
+        """测试批量直播状态按上限分批、重复参数发送并只产出变化"""
+        v14 = load_v14()
+        states = {'1': (1, '标题A'), '2': (0, '标题B'), '3': (1, '标题C')}
+        requested = []
+
+        def fake_get(url, params=None, **kwargs):
+            uids = [value for key, value in params if key == 'uids[]']
+            requested.append(uids)
+            data = {uid: {'uname': f'主播{uid}', 'room_id': int(uid) + 100, 'title': states[uid][1],
+                          'live_status': states[uid][0], 'live_time': 0} for uid in uids}
+            return MagicMock(json=lambda: {'code': 0, 'data': data})
+
+        poller = v14.LiveStatusPoller([1, 2, 3, 3])
+        with patch.object(v14, 'http_get', side_effect=fake_get):
+            self.assertEqual(v14.fetch_live_status_by_uids(['1', '2', '3'], batch_size=2).keys(), {'1', '2', '3'})
+            self.assertEqual(requested, [['1', '2'], ['3']])
+            first = poller.poll_once()
+            self.assertEqual(sorted(change['uid'] for change in first), ['1', '3'])
+            self.assertEqual(poller.poll_once(), [])
+            states.update({'1': (0, '标题A'), '2': (1, '标题B'), '3': (1, '新标题')})
+            changes = {change['uid']: change for change in poller.poll_once()}
+        self.assertEqual(changes['1']['type'], 'offline')
+        self.assertEqual(changes['2']['type'], 'live')
+        self.assertEqual((changes['3']['type'], changes['3']['old_title']), ('title', '标题C'))
+        self.assertIn('改标题', v14.format_live_change(changes['3']))
+        self.assertEqual(v14.parse_id_list('1, 2，3  4'), ['1', '2', '3', '4'])
+        print("✅ 批量直播状态轮询测试通过")
+
+    def test_live_stream_recorder(self):
+        """测试直播流选择、分块写盘和断线后重新获取地址"""
+        v14 = load_v14()
+
+        def codec(name, qn, host):
+            return {'codec_name': name, 'current_qn': qn, 'base_url': '/live/stream',
+                    'url_info': [{'host': host, 'extra': '?expires=1'}]}
+
+        play_info = {'live_status': 1, 'playurl_info': {'playurl': {'stream': [
+            {'protocol_name': 'http_hls', 'format': [{'format_name': 'fmp4', 'codec': [codec('avc', 10000, 'https://hls')]}]},
+            {'protocol_name': 'http_stream', 'format': [{'format_name': 'flv', 'codec': [
+                codec('hevc', 10000, 'https://flv-hevc'), codec('avc', 10000, 'https://flv'), codec('avc', 150, 'https://low')]}]},
+        ]}}}
+        responses = {'play': 0}
+
+        def fake_get(url, **kwargs):
+            if 'getRoomPlayInfo' in url:
+                responses['play'] += 1
+                # 连接两次后下播
+                data = play_info if responses['play'] <= 2 else {**play_info, 'live_status': 0}
+                return MagicMock(json=lambda: {'code': 0, 'data': data})
+            self.assertTrue(kwargs['stream'])
+            response = MagicMock(status_code=200)
+            response.iter_content.return_value = iter([b'FLV', b'data'])
+            return response
+
+        with tempfile.TemporaryDirectory() as tmp_dir, patch.object(v14, 'http_get', side_effect=fake_get):
+            status, candidates = v14.get_live_play_streams(123)
+            self.assertEqual(status, 1)
+            self.assertEqual([c['urls'][0].split('/live')[0] for c in candidates],
+                             ['https://flv', 'https://flv-hevc', 'https://hls', 'https://low'])
+            self.assertEqual(candidates[0]['urls'][0], 'https://flv/live/stream?expires=1')
+
+            responses['play'] = 0
+            recorder = v14.LiveStreamRecorder(123, output_dir=tmp_dir)
+            files = recorder.record()
+            self.assertEqual(len(files), 2)
+            for filepath in files:
+                with open(filepath, 'rb') as f:
+                    self.assertEqual(f.read(), b'FLVdata')
+            self.assertEqual(recorder.bytes_written, 14)
+        print("✅ 直播流录制测试通过")
+
+    def test_live_stream_recorder_writes_while_streaming(self):
+        """测试从真实的本地HTTP流录制时，数据在直播流结束前就已写盘"""
+        import threading
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        v14 = load_v14()
+        release = threading.Event()
+
+        class StreamHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'video/x-flv')
+                self.end_headers()
+                self.wfile.write(b'FLV\x01')
+                self.wfile.flush()
+                # 在测试确认数据已写盘之前不结束响应
+                release.wait(10)
+                self.wfile.write(b'tail')
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), StreamHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}/live.flv'
+        streams = iter([(1, [{'protocol': 'http_stream', 'urls': [url]}]), (0, [])])
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir, \
+                    patch.object(v14, 'get_live_play_streams', side_effect=lambda *args: next(streams)):
+                recorder = v14.LiveStreamRecorder(123, output_dir=tmp_dir, chunk_size=4)
+                thread = threading.Thread(target=recorder.record, daemon=True)
+                thread.start()
+                for _ in range(100):
+                    if recorder.bytes_written >= 4:
+                        break
+                    release.wait(0.05)
+                self.assertEqual(recorder.bytes_written, 4)
+                self.assertFalse(release.is_set())
+                release.set()
+                thread.join(10)
+                self.assertFalse(thread.is_alive())
+                with open(recorder.files[0], 'rb') as f:
+                    self.assertEqual(f.read(), b'FLV\x01tail')
+        finally:
+            release.set()
+            server.shutdown()
+            server.server_close()
+        print("✅ 直播流边收边写测试通过")
+
+    @unittest.skipIf(os.name == 'nt', "用脚本模拟ffmpeg需要shebang")
+    def test_live_stream_recorder_ffmpeg_failover(self):
+        """测试ffmpeg录制时，节点连接失败换下一个CDN节点"""
+        v14 = load_v14()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fake_ffmpeg = os.path.join(tmp_dir, 'ffmpeg')
+            with open(fake_ffmpeg, 'w', encoding='utf-8') as f:
+                f.write(f"#!{sys.executable}\n"
+                        "import sys\n"
+                        "url = sys.argv[sys.argv.index('-i') + 1]\n"
+                        "if 'dead' in url:\n"
+                        "    sys.stderr.write(url + ': Connection refused\\n')\n"
+                        "    sys.exit(1)\n"
+                        "open(sys.argv[-1], 'wb').write(b'ADTS')\n")
+            os.chmod(fake_ffmpeg, 0o755)
+            recorder = v14.LiveStreamRecorder(123, output_dir=tmp_dir, audio_only=True, ffmpeg=fake_ffmpeg)
+            self.assertEqual(recorder._record_ffmpeg(['https://dead/live', 'https://ok/live']), 4)
+            self.assertEqual(len(recorder.files), 1)
+            self.assertTrue(recorder.files[0].endswith('.aac'))
+            with self.assertRaises(RuntimeError) as raised:
+                recorder._record_ffmpeg(['https://dead1/live', 'https://dead2/live'])
+            self.assertIn('dead2', str(raised.exception))
+            self.assertEqual(len(recorder.files), 1)
+        print("✅ ffmpeg录制节点切换测试通过")
+
+    def test_live_auto_recorder(self):
+        """测试开播自动录制、下播停止、带宽预算排队和磁盘预算"""
+        import time
+        import asyncio
+        import threading
+        v14 = load_v14()
+        states = {'1': 1, '2': 1, '3': 0}
+        danmaku_rooms = set()
+
+        class FakeStreamRecorder:
+            def __init__(self, room_id, *args):
+                self.room_id = room_id
+                self.started_at = time.time()
+                self.bytes_written = 100
+                self.files = [f'{room_id}.flv']
+                self._stop = threading.Event()
+
+            def record(self):
+                self._stop.wait()
+
+            def stop(self):
+                self._stop.set()
+
+        class FakeDanmakuRecorder:
+            def __init__(self, *args):
+                self._stop = None
+
+            def add_room(self, room_id):
+                danmaku_rooms.add(room_id)
+
+            async def remove_room(self, room_id):
+                danmaku_rooms.discard(room_id)
+
+            def stop(self):
+                self._stop.set()
+
+            async def run(self):
+                self._stop = asyncio.Event()
+                await self._stop.wait()
+
+        def fake_status(uids):
+            return {uid: {'uname': f'主播{uid}', 'room_id': int(uid) + 100, 'title': '', 'live_status': states[uid],
+                          'live_time': 0} for uid in uids}
+
+        with patch.object(v14, 'fetch_live_status_by_uids', side_effect=fake_status), \
+                patch.object(v14, 'LiveStreamRecorder', FakeStreamRecorder), \
+                patch.object(v14, 'LiveDanmakuRecorder', FakeDanmakuRecorder):
+            # 预算低于单个直播间的估计码率时仍录制一个，其余排队
+            with self.assertLogs(v14.logger, 'WARNING'):
+                recorder = v14.LiveAutoRecorder(['1', '2', '3'], max_bandwidth=v14.LIVE_VIDEO_ESTIMATED_RATE // 2,
+                                                max_disk_bytes=1000, min_free_bytes=0)
+            recorder.poll_once()
+            self.assertEqual(len(recorder.recordings), 1)
+            self.assertEqual(danmaku_rooms, {101})
+            states['1'] = 0
+            recorder.poll_once()
+            self.assertEqual(list(recorder.recordings), ['2'])
+            self.assertEqual(danmaku_rooms, {102})
+            self.assertEqual(recorder.files, ['101.flv'])
+            self.assertEqual(recorder.bytes_written(), 200)
+            recorder.max_disk_bytes = 200
+            recorder.poll_once()
+            self.assertTrue(recorder.disk_full)
+            self.assertEqual(recorder.recordings, {})
+            self.assertEqual(danmaku_rooms, set())
+            recorder.close()
+            self.assertIsNone(recorder._danmaku_thread)
+        print("✅ 自动录制调度测试通过")
+
     def test_ffmpeg_detection(self):
         """测试ffmpeg检测"""
         try: